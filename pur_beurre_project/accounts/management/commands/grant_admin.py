@@ -0,0 +1,31 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+'''This module grants or revokes the administrator rights of a user,
+which open the metrics page. Users created by createsuperuser are
+administrators already.
+Run it using pipenv manage.py grant_admin.
+'''
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Grant the administrator rights to an existing user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the user')
+        parser.add_argument('--revoke', action='store_true',
+                            help='Revoke the rights instead of granting them')
+
+    def handle(self, *args, **options):
+        #Sets the is_admin flag of the user
+        updated = (User.objects.filter(email=options['email'])
+                               .update(is_admin=not options['revoke']))
+        if not updated:
+            raise CommandError('No user with email {}'.format(options['email']))
+        self.stdout.write('{} {} administrator'.format(
+            options['email'], 'is no longer' if options['revoke'] else 'is now'
+        ))
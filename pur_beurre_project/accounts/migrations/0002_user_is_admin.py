@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+# No existing account is an administrator after this migration: grant the
+# rights, which open the metrics page, with manage.py grant_admin <email>.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='is_admin',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_user_is_admin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='bookmarks_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
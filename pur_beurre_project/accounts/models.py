@@ -57,6 +57,8 @@ class User(AbstractBaseUser):
     They also require a first_name, for aesthetic reasons.
     The model stores the products that were bookmarked by the user
     using many-to-many relations with the substituter_products table.
+    bookmarks_version counts the changes of these bookmarks, and keys their
+    cached ids.
     '''
 
     email = models.EmailField(
@@ -66,7 +68,9 @@ class User(AbstractBaseUser):
     )
     first_name = models.CharField(_('Prénom'), max_length=30)
     is_active = models.BooleanField(default=True)
+    is_admin = models.BooleanField(default=False)
     bookmarks = models.ManyToManyField(Product)
+    bookmarks_version = models.PositiveIntegerField(default=0)
 
     objects = UserManager()
 
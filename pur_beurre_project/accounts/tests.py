@@ -2,8 +2,11 @@
 This module contains the various unit tests for the accounts app
 '''
 
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
 from django.test.client import Client
+from io import StringIO
 
 from .models import User, UserManager
 from substituter.models import Product
@@ -58,6 +61,27 @@ class TestUserModel(TestCase):
         self.assertTrue(isinstance(user.bookmarks.all()[0], Product))
 
 
+# Commands
+
+class TestGrantAdmin(TestCase):
+    #This class tests the grant_admin command
+
+    def test_grant_and_revoke(self):
+        #tests that the rights of an existing user are granted then revoked
+
+        User.objects.create(email='admin@user.model', first_name="admin")
+
+        call_command('grant_admin', 'admin@user.model', stdout=StringIO())
+        self.assertTrue(User.objects.get().is_admin)
+
+        call_command('grant_admin', 'admin@user.model', '--revoke',
+                     stdout=StringIO())
+        self.assertFalse(User.objects.get().is_admin)
+
+        with self.assertRaises(CommandError):
+            call_command('grant_admin', 'nobody@user.model')
+
+
 # Views
 
 class TestViewSignup(TestCase):
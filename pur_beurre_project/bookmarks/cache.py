@@ -0,0 +1,36 @@
+'''
+This module caches the ids of the products bookmarked by each user, as a
+frozenset, so that pages showing whether products are saved read a single
+cache entry instead of the user's bookmark rows. The entry of a user is
+keyed on the version of their bookmarks, stored on their row and changed
+whenever their bookmarks change: every worker, loading the user with each
+request, then reads a new entry, whether or not the cache is shared.
+'''
+
+from django.conf import settings
+from django.db.models import F
+
+from accounts.models import User
+from substituter.cache import get_cache
+
+
+def bookmark_key(user):
+    #Returns the cache key of the bookmark ids of a user
+    return 'bookmarks:{}:{}'.format(user.pk, user.bookmarks_version)
+
+
+def bookmark_ids(user):
+    #Returns the frozenset of the ids of the products bookmarked by user
+    key = bookmark_key(user)
+    ids = get_cache().get(key)
+    if ids is None:
+        ids = frozenset(user.bookmarks.values_list('pk', flat=True))
+        get_cache().set(key, ids, settings.BOOKMARK_CACHE_TIMEOUT)
+    return ids
+
+
+def bump_bookmarks_version(user_ids):
+    #Changes the bookmarks version of several users, invalidating their cached ids
+    User.objects.filter(pk__in=user_ids).update(
+        bookmarks_version=F('bookmarks_version') + 1
+    )
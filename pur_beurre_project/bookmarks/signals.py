@@ -0,0 +1,27 @@
+'''
+This file contains the signal receivers keeping the cached bookmark ids of
+the users up to date, whichever side of the relation is changed.
+'''
+
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from accounts.models import User
+
+from .cache import bump_bookmarks_version
+
+
+@receiver(m2m_changed, sender=User.bookmarks.through)
+def invalidate_bookmark_ids(sender, instance, action, reverse, pk_set, **kwargs):
+    #Changes the bookmarks version of the users whose bookmarks changed
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if not reverse:
+        bump_bookmarks_version([instance.pk])
+        #the request changing the bookmarks reads the new version at once
+        instance.refresh_from_db(fields=['bookmarks_version'])
+    elif pk_set is not None:
+        bump_bookmarks_version(pk_set)
+    else:
+        bump_bookmarks_version(instance.user_set.values_list('pk', flat=True))
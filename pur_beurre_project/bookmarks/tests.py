@@ -2,12 +2,17 @@
 This module contains the various unit tests for the bookmarks app
 '''
 
+from django.core.cache.backends.locmem import LocMemCache
 from django.test import TestCase
 from django.test.client import Client
+from unittest import mock
 
+from substituter.cache import get_cache
 from substituter.models import Product
 from accounts.models import User
 
+from .cache import bookmark_ids
+
 class TestViewBookmarked(TestCase):
     #This class tests the Bookmarked view
 
@@ -102,4 +107,74 @@ class TestViewSave(TestCase):
 
         response = c.get("/bookmarks/save/2", follow=True)
 
-        self.assertEqual(response.status_code, 404)
\ No newline at end of file
+        self.assertEqual(response.status_code, 404)
+
+
+class TestBookmarkIds(TestCase):
+    #This class tests the cached ids of the bookmarks of each user
+
+    @classmethod
+    def setUpTestData(cls):
+        #sets up two products and a user having saved the first one
+
+        cls.p1 = Product.objects.create(name="first")
+        cls.p2 = Product.objects.create(name="second")
+        cls.u = User.objects.create(email="testmail")
+        cls.u.set_password('testpass')
+        cls.u.save()
+        cls.u.bookmarks.add(cls.p1)
+
+    def setUp(self):
+        #empties the cache, since it outlives the test transactions
+        get_cache().clear()
+
+    def test_bookmark_ids_cached(self):
+        #tests that the ids are read from the database once
+
+        self.assertEqual(bookmark_ids(self.u), frozenset([self.p1.pk]))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(bookmark_ids(self.u), frozenset([self.p1.pk]))
+
+    def test_save_invalidates_ids(self):
+        #tests that saving a product through the view updates the ids
+
+        bookmark_ids(self.u)
+        c = Client()
+        c.login(email='testmail', password='testpass')
+        c.get("/bookmarks/save/{}".format(self.p2.pk))
+
+        #the next request loads the user again
+        self.u = User.objects.get(pk=self.u.pk)
+        self.assertEqual(bookmark_ids(self.u),
+                         frozenset([self.p1.pk, self.p2.pk]))
+
+    def test_save_seen_by_other_workers(self):
+        #tests that the ids cached by a worker are renewed after a save
+        #handled by another worker, which has a cache of its own
+
+        other_cache = LocMemCache('other-worker', {})
+        with mock.patch('bookmarks.cache.get_cache', return_value=other_cache):
+            self.assertEqual(bookmark_ids(User.objects.get(pk=self.u.pk)),
+                             frozenset([self.p1.pk]))
+
+        c = Client()
+        c.login(email='testmail', password='testpass')
+        c.get("/bookmarks/save/{}".format(self.p2.pk))
+
+        with mock.patch('bookmarks.cache.get_cache', return_value=other_cache):
+            self.assertEqual(bookmark_ids(User.objects.get(pk=self.u.pk)),
+                             frozenset([self.p1.pk, self.p2.pk]))
+
+    def test_removals_invalidate_ids(self):
+        #tests that removing bookmarks, from either side, updates the ids
+
+        bookmark_ids(self.u)
+        self.u.bookmarks.remove(self.p1)
+        self.assertEqual(bookmark_ids(self.u), frozenset())
+
+        self.u.bookmarks.add(self.p1, self.p2)
+        bookmark_ids(self.u)
+        self.p2.user_set.clear()
+        self.u = User.objects.get(pk=self.u.pk)
+        self.assertEqual(bookmark_ids(self.u), frozenset([self.p1.pk]))
@@ -0,0 +1,176 @@
+'''
+This module measures the requests served by the project.
+For a sample of the requests, the metrics middleware records the number of
+sql queries, the time spent in the database, the time spent rendering
+templates and the total latency, aggregated per view into histograms kept
+in the memory of the worker. Slow requests are logged, and the histograms
+can be read by administrators on the metrics page.
+'''
+
+from contextlib import ExitStack
+from functools import wraps
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import JsonResponse
+from django.template.backends.django import Template
+
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+METRICS = ["queries", "db_ms", "template_ms", "total_ms"]
+
+
+class Histogram:
+    '''
+    Counts the recorded values falling into each bucket, a bucket holding
+    the values lower than or equal to its bound, plus a last bucket for the
+    values above every bound.
+    '''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def record(self, value):
+        #Adds value to the histogram
+        for number, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            number = len(self.buckets)
+        self.counts[number] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        #Returns the histogram as a json serializable dictionary
+        buckets = dict(zip([str(bound) for bound in self.buckets] + ["+Inf"],
+                           self.counts))
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class Registry:
+    #Keeps one histogram per metric per view, shared by the threads of the worker
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, measures):
+        #Records the measures of a request served by view
+        with self.lock:
+            histograms = self.views.setdefault(
+                view, {metric: Histogram() for metric in METRICS}
+            )
+            for metric, value in measures.items():
+                histograms[metric].record(value)
+
+    def snapshot(self):
+        #Returns the histograms of every view as a dictionary
+        with self.lock:
+            return {view: {metric: histogram.as_dict()
+                           for metric, histogram in histograms.items()}
+                    for view, histograms in self.views.items()}
+
+    def reset(self):
+        #Forgets every recorded measure
+        with self.lock:
+            self.views = {}
+
+
+registry = Registry()
+
+_current = threading.local()
+
+
+def _render(render):
+    #Wraps the render method of the templates to time the measured requests
+    @wraps(render)
+    def timed_render(*args, **kwargs):
+        measures = getattr(_current, 'measures', None)
+        if measures is None:
+            return render(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return render(*args, **kwargs)
+        finally:
+            measures["template_ms"] += (time.perf_counter() - start) * 1000
+    timed_render.metrics = True
+    return timed_render
+
+
+def _execute(measures):
+    #Returns a database execute wrapper counting and timing the queries
+    def wrapper(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            measures["queries"] += 1
+            measures["db_ms"] += (time.perf_counter() - start) * 1000
+    return wrapper
+
+
+class RequestMetricsMiddleware:
+    '''
+    Measures a METRICS_SAMPLE_RATE fraction of the requests, recording them
+    into the registry under the name of the view that served them, and logs
+    the ones slower than METRICS_SLOW_REQUEST_MS milliseconds.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not getattr(Template.render, 'metrics', False):
+            Template.render = _render(Template.render)
+
+    def __call__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+
+        measures = {"queries": 0, "db_ms": 0, "template_ms": 0}
+        _current.measures = measures
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(_execute(measures))
+                    )
+                response = self.get_response(request)
+        finally:
+            _current.measures = None
+        measures["total_ms"] = (time.perf_counter() - start) * 1000
+
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        registry.record(view, measures)
+
+        if measures["total_ms"] > settings.METRICS_SLOW_REQUEST_MS:
+            logger.warning(
+                "Slow request %s %s (%s): %d queries, %.1f ms in database, "
+                "%.1f ms rendering templates, %.1f ms in total",
+                request.method, request.path, view, measures["queries"],
+                measures["db_ms"], measures["template_ms"],
+                measures["total_ms"]
+            )
+
+        return response
+
+
+@login_required
+def metrics(request):
+    #Displays the histograms of this worker to administrators, as json
+    if not request.user.is_admin:
+        raise PermissionDenied
+    return JsonResponse(registry.snapshot())
@@ -0,0 +1,163 @@
+'''
+This module sends the reads of the catalogue to the read replicas.
+While answering a request, the models of the CATALOGUE_APPS are read from
+one of the DATABASE_REPLICAS, taken in turn by each request. A replica
+that cannot be connected to, or whose open connection stopped answering, is
+left aside for REPLICA_RETRY_AFTER seconds, and the primary is read when
+every replica is down. Every write goes to the
+primary, the accounts and bookmarks being read there too. A request that
+wrote reads the primary until it ends, and so do the requests of the same
+browser during the next REPLICA_PIN_SECONDS, for users to see their own
+changes despite the replication lag. Outside of the requests (management
+commands, background threads), everything is read from the primary, and
+so is the catalogue while filling the caches keyed on its version.
+'''
+
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+
+logger = logging.getLogger(__name__)
+
+CATALOGUE_APPS = {'substituter'}
+
+PIN_COOKIE = 'pin_primary'
+
+_current = threading.local()
+
+
+class ReplicaPool:
+    '''
+    Hands the replicas out in turn, skipping the ones that stopped
+    answering less than REPLICA_RETRY_AFTER seconds ago.
+    '''
+
+    def __init__(self):
+        self.down = {}
+        self.turn = 0
+        self.lock = threading.Lock()
+
+    def reset(self):
+        #Considers every replica up, and starts again from the first one
+        with self.lock:
+            self.down.clear()
+            self.turn = 0
+
+    def is_up(self, alias):
+        #Returns whether a replica may be tried
+        return self.down.get(alias, 0) <= time.monotonic()
+
+    def check(self, alias):
+        '''
+        Returns whether a replica answers, leaving it aside if not. A
+        connection kept open between requests (CONN_MAX_AGE) is checked
+        first, and opened again if the replica stopped answering it.
+        '''
+
+        connection = connections[alias]
+        try:
+            if connection.connection is not None and not connection.is_usable():
+                connection.close()
+            connection.ensure_connection()
+        except DatabaseError:
+            with self.lock:
+                self.down[alias] = time.monotonic() + settings.REPLICA_RETRY_AFTER
+            logger.warning("replica %s is down, retrying in %s seconds",
+                           alias, settings.REPLICA_RETRY_AFTER, exc_info=True)
+            return False
+        return True
+
+    def choose(self, aliases):
+        #Returns the next replica up, or None if they are all down
+        with self.lock:
+            turn = self.turn
+            self.turn += 1
+        for offset in range(len(aliases)):
+            alias = aliases[(turn + offset) % len(aliases)]
+            if self.is_up(alias) and self.check(alias):
+                return alias
+        return None
+
+
+pool = ReplicaPool()
+
+
+@contextmanager
+def read_primary():
+    '''
+    Reads the catalogue from the primary within the with block, for the
+    results cached under the current version of the catalogue, which a
+    lagging replica could fill with former rows.
+    '''
+
+    _current.primary = getattr(_current, 'primary', 0) + 1
+    try:
+        yield
+    finally:
+        _current.primary -= 1
+
+
+def read_database():
+    #Returns the database the current request reads the catalogue from, or None to read the primary
+    if (not getattr(_current, 'reading', False) or _current.pinned
+            or _current.wrote or getattr(_current, 'primary', 0)):
+        return None
+    if _current.replica is None:
+        _current.replica = (pool.choose(settings.DATABASE_REPLICAS)
+                            or DEFAULT_DB_ALIAS)
+    return _current.replica
+
+
+class ReplicaRouter:
+    #Routes the reads of the catalogue to the replicas, and every write to the primary
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in CATALOGUE_APPS:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return read_database()
+
+    def db_for_write(self, model, **hints):
+        _current.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        #the replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaMiddleware:
+    '''
+    Lets the requests read the catalogue from the replicas, unless their
+    browser wrote less than REPLICA_PIN_SECONDS ago, and marks the browsers
+    of the requests that wrote with a cookie.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        _current.reading = True
+        _current.pinned = PIN_COOKIE in request.COOKIES
+        _current.wrote = False
+        _current.replica = None
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reading = False
+
+        if _current.wrote:
+            response.set_cookie(PIN_COOKIE, '1',
+                                max_age=settings.REPLICA_PIN_SECONDS,
+                                httponly=True)
+        return response
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 
 import os
 
+import dj_database_url
 import django_heroku
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -38,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'substituter',
     'accounts',
     'bookmarks',
@@ -46,6 +48,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'pur_beurre_project.replicas.ReplicaMiddleware',
+    'pur_beurre_project.metrics.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -68,6 +72,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'substituter.context_processors.card_cache',
             ],
         },
     },
@@ -90,6 +95,98 @@ DATABASES = {
     }
 }
 
+# Read replicas: comma separated urls of the databases replicating the
+# primary, from which the catalogue is read while answering requests. A
+# replica failing to connect is left aside for REPLICA_RETRY_AFTER seconds,
+# and a browser that wrote reads the primary for REPLICA_PIN_SECONDS seconds.
+
+DATABASE_REPLICAS = []
+for number, url in enumerate(
+        filter(None, os.environ.get('REPLICA_DATABASE_URLS', '').split(',')), 1):
+    alias = 'replica_{}'.format(number)
+    DATABASES[alias] = dict(dj_database_url.parse(url.strip()),
+                            TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['pur_beurre_project.replicas.ReplicaRouter']
+
+REPLICA_RETRY_AFTER = 30
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# The local-memory backend is per process: set CACHE_BACKEND and
+# CACHE_LOCATION (e.g. memcached or redis) to share the cache between workers,
+# which warm_caches and update_db --warm require.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'pur-beurre'),
+    }
+}
+
+# Ranking of the product names: 'index' uses the inverted index on every
+# database, 'postgres' the full-text search of PostgreSQL 12+ (falling back to
+# the index on other databases, and until manage.py enable_fulltext succeeds
+# where migrations could not add the full-text column).
+
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'index')
+
+SEARCH_CACHE_ALIAS = 'default'
+SEARCH_CACHE_TIMEOUT = 60 * 60
+
+# Seconds a process keeps the version of the catalogue before reading it
+# again from the database, and so before seeing the changes of update_db.
+
+CATALOGUE_VERSION_TTL = int(os.environ.get('CATALOGUE_VERSION_TTL', 5))
+
+AUTOCOMPLETE_MAX_AGE = 60 * 5
+
+BOOKMARK_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Search analytics: searches kept in memory by each worker, and seconds
+# between two writes of the buffer (0 for no background writes).
+
+SEARCH_LOG_CAPACITY = 10000
+SEARCH_LOG_FLUSH_INTERVAL = int(os.environ.get('SEARCH_LOG_FLUSH_INTERVAL', 10))
+
+# Pages rendered the same for every anonymous visitor (index, legal mentions
+# and product details): seconds they stay in the cache, and seconds browsers
+# may reuse them without asking. The product cards are cached for
+# CARD_CACHE_TIMEOUT seconds, 0 disabling the fragment cache.
+
+PAGE_CACHE_TIMEOUT = 60 * 60
+PAGE_MAX_AGE = 60 * 5
+CARD_CACHE_TIMEOUT = int(os.environ.get('CARD_CACHE_TIMEOUT', 60 * 60 * 24))
+
+# Batch api: maximum number of items of a shopping list, and number of lists
+# resolved at once by each worker (0 for no limit), the others waiting up to
+# BATCH_WAIT seconds.
+
+BATCH_MAX_ITEMS = 300
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 4))
+BATCH_WAIT = 5
+
+# Above this number of links between products and categories, substitute
+# candidates are selected by the database instead of the in-memory index.
+
+CATEGORY_INDEX_MAX_LINKS = int(
+    os.environ.get('CATEGORY_INDEX_MAX_LINKS', 20 * 1000 * 1000)
+)
+
+
+# Metrics
+# Fraction of the requests measured by the metrics middleware, and latency
+# in milliseconds above which a measured request is logged.
+
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+METRICS_SLOW_REQUEST_MS = int(os.environ.get('METRICS_SLOW_REQUEST_MS', 500))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -130,6 +227,12 @@ USE_TZ = True
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATIC_URL = '/static/'
 
+# Local store of the product thumbnails, written by update_db --images. Web
+# workers link to the original images of the products whose thumbnails are
+# not in their store, as on Heroku, where each dyno has its own filesystem.
+
+IMAGE_ROOT = os.environ.get('IMAGE_ROOT', os.path.join(BASE_DIR, 'images'))
+
 INTERNAL_IPS = ['127.0.0.1']
 
 LOGIN_REDIRECT_URL = 'index'
@@ -0,0 +1,38 @@
+'''
+Production settings: DEBUG and the debug toolbar are off, compiled templates
+are kept in memory by the cached template loader, and database connections
+are reused between requests, replicas included. Select them with
+DJANGO_SETTINGS_MODULE=pur_beurre_project.settings.production.
+'''
+
+from . import *
+
+DEBUG = False
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app != 'debug_toolbar']
+
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE
+              if not middleware.startswith('debug_toolbar.')]
+
+# Templates are read and compiled once per process, by the warm-up of the
+# wsgi module, instead of on every request.
+
+TEMPLATES = [
+    dict(TEMPLATES[0],
+         APP_DIRS=False,
+         OPTIONS=dict(TEMPLATES[0]['OPTIONS'],
+                      debug=False,
+                      loaders=[
+                          ('django.template.loaders.cached.Loader', [
+                              'django.template.loaders.filesystem.Loader',
+                              'django.template.loaders.app_directories.Loader',
+                          ]),
+                      ])),
+]
+
+# Seconds a database connection, to the primary or a replica, is kept open
+# between requests.
+
+DATABASES = {alias: dict(database,
+                         CONN_MAX_AGE=int(os.environ.get('CONN_MAX_AGE', 600)))
+             for alias, database in DATABASES.items()}
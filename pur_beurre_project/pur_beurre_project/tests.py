@@ -0,0 +1,313 @@
+'''
+This module contains the various unit tests for the project-wide modules
+'''
+
+import os
+import tempfile
+
+from django.apps import apps
+from django.db import connections
+from django.http import HttpResponse
+from django.template.loaders import filesystem
+from django.test import (
+    RequestFactory, TestCase, TransactionTestCase, override_settings
+)
+from django.test.client import Client
+from unittest import mock
+
+from accounts.models import User
+from substituter.autocomplete import load_index
+from substituter.cache import get_cache, search_results
+from substituter.models import Category, Product
+
+from .metrics import Histogram, registry
+from .replicas import PIN_COOKIE, ReplicaMiddleware, pool
+from .settings import production
+from .warmup import template_names, warm_templates, widget_names
+
+
+# Metrics
+
+class TestHistogram(TestCase):
+    #This class tests the histograms of the metrics
+
+    def test_record(self):
+        #tests that values are counted in the smallest bucket holding them
+
+        histogram = Histogram([1, 10])
+        for value in [0.5, 1, 5, 50]:
+            histogram.record(value)
+
+        self.assertEqual(histogram.as_dict(),
+                         {"count": 4, "sum": 56.5,
+                          "buckets": {"1": 2, "10": 1, "+Inf": 1}})
+
+
+class TestMetricsMiddleware(TestCase):
+    #This class tests the measures recorded by the metrics middleware
+
+    def setUp(self):
+        #empties the registry and the caches used by the views
+        registry.reset()
+        get_cache().clear()
+        Product.objects.create(name="nutella", grade="e")
+
+    def test_views_are_measured(self):
+        #tests that queries, database and template time are recorded per view
+
+        Client().get("/substituter/search/", {"query": "nutella"})
+        Client().get("/substituter/autocomplete/", {"term": "nut"})
+        measures = registry.snapshot()
+
+        search = measures["substituter:search"]
+        self.assertEqual(search["total_ms"]["count"], 1)
+        self.assertGreater(search["queries"]["sum"], 0)
+        self.assertGreater(search["db_ms"]["sum"], 0)
+        self.assertGreater(search["template_ms"]["sum"], 0)
+        self.assertGreaterEqual(search["total_ms"]["sum"],
+                                search["template_ms"]["sum"])
+        self.assertEqual(
+            measures["substituter:autocomplete"]["template_ms"]["sum"], 0
+        )
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_sampling(self):
+        #tests that requests outside of the sample are not measured
+
+        Client().get("/substituter/search/", {"query": "nutella"})
+
+        self.assertEqual(registry.snapshot(), {})
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged(self):
+        #tests that requests over the threshold are logged with their measures
+
+        with self.assertLogs('pur_beurre_project.metrics', 'WARNING') as logs:
+            Client().get("/substituter/search/", {"query": "nutella"})
+
+        self.assertIn("substituter:search", logs.output[0])
+
+
+# Warm-up
+
+class TestWarmup(TestCase):
+    #This class tests the compilation of the templates before serving requests
+
+    @classmethod
+    def setUpTestData(cls):
+        #sets up a product and a user with a bookmark
+
+        product = Product.objects.create(name="nutella", grade="e")
+        user = User.objects.create(email="testmail")
+        user.set_password('testpass')
+        user.save()
+        user.bookmarks.add(product)
+
+    def test_template_names(self):
+        #tests that the templates of every app are found
+
+        names = list(template_names())
+
+        for name in ["substituter/base.html", "registration/login.html",
+                     "accounts/dashboard.html", "bookmarks/bookmarked.html"]:
+            self.assertIn(name, names)
+        self.assertEqual(warm_templates(),
+                         len(names) + len(list(widget_names())))
+
+    @override_settings(TEMPLATES=production.TEMPLATES)
+    def test_no_template_read_after_warm_up(self):
+        #tests that no template file is read by the requests once warmed up
+
+        get_cache().clear()
+        warm_templates()
+        product = Product.objects.get()
+        client = Client()
+
+        with mock.patch.object(filesystem.Loader, 'get_contents',
+                               side_effect=AssertionError("template read")):
+            for path in ["/", "/substituter/legal/",
+                         "/substituter/detail/{}/".format(product.pk),
+                         "/accounts/login/"]:
+                self.assertEqual(client.get(path).status_code, 200)
+
+            client.login(email='testmail', password='testpass')
+            for path in ["/substituter/search/?query=nutella",
+                         "/bookmarks/bookmarked/", "/accounts/dashboard/"]:
+                self.assertEqual(client.get(path).status_code, 200)
+
+
+# Replicas
+
+def read_product(request):
+    #answers the name of the only product, read as the router decides
+    return HttpResponse(Product.objects.get().name)
+
+
+def write_then_read(request):
+    #answers the name of the only product, read after writing a category
+    Category.objects.create(name="written")
+    return read_product(request)
+
+
+class TestReplicas(TransactionTestCase):
+    #This class tests the routing of the catalogue reads to sqlite replicas
+
+    def setUp(self):
+        #sets up a product on the primary, and two replicas holding their own
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        pool.reset()
+        get_cache().clear()
+        Product.objects.create(name="primary")
+        User.objects.create(email="primary@purbeurre.fr")
+        for alias in ["replica_1", "replica_2"]:
+            self.add_replica(alias)
+            #as replicated: without the signals indexing the product
+            Product.objects.using(alias).bulk_create([Product(name=alias)])
+        self.add_database(
+            "broken", os.path.join(self.directory.name, "missing", "db")
+        )
+
+    def add_database(self, alias, name):
+        #declares a sqlite database, forgotten at the end of the test
+        connections.databases[alias] = {
+            "ENGINE": "django.db.backends.sqlite3", "NAME": name,
+        }
+        self.addCleanup(self.forget_database, alias)
+
+    def forget_database(self, alias):
+        #closes and forgets a database
+        connections[alias].close()
+        del connections.databases[alias]
+        if hasattr(connections._connections, alias):
+            delattr(connections._connections, alias)
+
+    def add_replica(self, alias):
+        #declares a sqlite database holding the tables of the catalogue
+        self.add_database(alias, os.path.join(self.directory.name, alias))
+        with connections[alias].schema_editor() as editor:
+            for model in apps.get_app_config("substituter").get_models():
+                editor.create_model(model)
+
+    def serve(self, view, cookies=None):
+        #returns the response of a view served through the replica middleware
+        request = RequestFactory().get("/")
+        request.COOKIES.update(cookies or {})
+        return ReplicaMiddleware(view)(request)
+
+    @override_settings(DATABASE_REPLICAS=["replica_1", "replica_2"])
+    def test_round_robin(self):
+        #tests that requests read the catalogue from the replicas in turn
+
+        names = [self.serve(read_product).content.decode()
+                 for _ in range(4)]
+
+        self.assertEqual(names, ["replica_1", "replica_2"] * 2)
+
+    @override_settings(DATABASE_REPLICAS=["replica_1"])
+    def test_primary_outside_of_requests(self):
+        #tests that the catalogue is read from the primary outside of requests
+        #and that the accounts always are
+
+        def read_user(request):
+            return HttpResponse(User.objects.get().email)
+
+        self.assertEqual(Product.objects.get().name, "primary")
+        self.assertEqual(self.serve(read_user).content,
+                         b"primary@purbeurre.fr")
+
+    @override_settings(DATABASE_REPLICAS=["replica_1"])
+    def test_caches_filled_from_primary(self):
+        #tests that the indexes and results cached by version read the primary
+
+        def fill_caches(request):
+            base, substitutes = search_results(["replica_1", "primary"])
+            return HttpResponse(" ".join([load_index().lookup("r")[0],
+                                          base.name,
+                                          Product.objects.get().name]))
+
+        self.assertEqual(self.serve(fill_caches).content,
+                         b"primary primary replica_1")
+
+    @override_settings(DATABASE_REPLICAS=["replica_1"])
+    def test_pinned_after_write(self):
+        #tests that a request that wrote, then its browser, read the primary
+
+        response = self.serve(write_then_read)
+
+        self.assertEqual(response.content, b"primary")
+        self.assertFalse(Category.objects.using("replica_1").exists())
+        cookie = response.cookies[PIN_COOKIE]
+        self.assertTrue(cookie["max-age"])
+        self.assertEqual(
+            self.serve(read_product, {PIN_COOKIE: cookie.value}).content,
+            b"primary"
+        )
+        self.assertEqual(self.serve(read_product).content, b"replica_1")
+        self.assertNotIn(PIN_COOKIE, self.serve(read_product).cookies)
+
+    @override_settings(DATABASE_REPLICAS=["broken", "replica_1"],
+                       REPLICA_RETRY_AFTER=60)
+    def test_replica_down(self):
+        #tests that a replica failing to connect is left aside for a while
+
+        with self.assertLogs("pur_beurre_project.replicas", "WARNING") as logs:
+            names = [self.serve(read_product).content for _ in range(4)]
+
+        self.assertEqual(names, [b"replica_1"] * 4)
+        self.assertEqual(len(logs.output), 1)
+        self.assertFalse(pool.is_up("broken"))
+
+    @override_settings(DATABASE_REPLICAS=["replica_1"], REPLICA_RETRY_AFTER=60)
+    def test_open_connection_down(self):
+        #tests that a replica dying after its connection was opened is left aside
+
+        self.assertEqual(self.serve(read_product).content, b"replica_1")
+        connection = connections["replica_1"]
+        connection.settings_dict["NAME"] = os.path.join(self.directory.name,
+                                                        "missing", "db")
+
+        with mock.patch.object(connection, "is_usable", return_value=False), \
+             self.assertLogs("pur_beurre_project.replicas", "WARNING"):
+            self.assertEqual(self.serve(read_product).content, b"primary")
+        self.assertFalse(pool.is_up("replica_1"))
+
+    @override_settings(DATABASE_REPLICAS=["broken"], REPLICA_RETRY_AFTER=0)
+    def test_every_replica_down(self):
+        #tests that the primary is read when no replica is up
+
+        with self.assertLogs("pur_beurre_project.replicas", "WARNING") as logs:
+            names = [self.serve(read_product).content for _ in range(2)]
+
+        self.assertEqual(names, [b"primary"] * 2)
+        self.assertEqual(len(logs.output), 2)
+
+
+# Views
+
+class TestViewMetrics(TestCase):
+    #This class tests the metrics view
+
+    def setUp(self):
+        #sets up an administrator and a regular user
+        registry.reset()
+        admin = User.objects.create(email="admin@purbeurre.fr", is_admin=True)
+        admin.set_password('testpass')
+        admin.save()
+        user = User.objects.create(email="user@purbeurre.fr")
+        user.set_password('testpass')
+        user.save()
+
+    def test_admin_only(self):
+        #tests that only administrators can read the metrics
+
+        c = Client()
+        self.assertEqual(c.get("/metrics/").status_code, 302)
+
+        c.login(email="user@purbeurre.fr", password="testpass")
+        self.assertEqual(c.get("/metrics/").status_code, 403)
+
+        c.login(email="admin@purbeurre.fr", password="testpass")
+        response = c.get("/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("metrics", response.json())
@@ -20,6 +20,8 @@ from django.urls import path, re_path
 
 from substituter import views
 
+from . import metrics
+
 def trigger_error(request):
     division_by_zero = 1 / 0
 
@@ -34,6 +36,7 @@ urlpatterns = [
     path('bookmarks/', include(('bookmarks.urls', 'bookmarks'), namespace="bookmarks")), 
     path('accounts/', include('django.contrib.auth.urls')),
     path('admin/', admin.site.urls),
+    path('metrics/', metrics.metrics, name="metrics"),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,55 @@
+'''
+This module prepares a process before it serves its first request.
+Every template of the project's apps is compiled once, along with the
+templates of the form widgets, which have their own engine, so that with
+the cached template loaders of the production settings, no template is
+read from disk while serving requests. Run by the wsgi module, before gunicorn
+forks its workers when started with --preload.
+'''
+
+import os
+
+from django import forms
+from django.apps import apps
+from django.forms.renderers import get_default_renderer
+from django.template.loader import get_template
+
+
+WARM_APPS = ['substituter', 'accounts', 'bookmarks']
+
+
+def _names(directory):
+    #Yields the names of the templates found under a templates directory
+    for root, dirs, files in os.walk(directory):
+        for name in sorted(files):
+            path = os.path.relpath(os.path.join(root, name), directory)
+            yield path.replace(os.sep, '/')
+
+
+def template_names(app_labels=WARM_APPS):
+    #Yields the names of the templates found in the templates directory of each app
+    for label in app_labels:
+        yield from _names(os.path.join(apps.get_app_config(label).path,
+                                       'templates'))
+
+
+def widget_names():
+    #Yields the names of the templates of the form widgets
+    directory = os.path.join(os.path.dirname(forms.__file__), 'templates')
+    for name in _names(directory):
+        if name.startswith('django/forms/widgets/') and name.endswith('.html'):
+            yield name
+
+
+def warm_templates(app_labels=WARM_APPS):
+    #Compiles every template of the apps and of the form widgets, and returns their number
+    count = 0
+    for name in template_names(app_labels):
+        get_template(name)
+        count += 1
+
+    renderer = get_default_renderer()
+    for name in widget_names():
+        renderer.get_template(name)
+        count += 1
+    return count
@@ -1,7 +1,10 @@
 """
 WSGI config for pur_beurre_project project.
 
-It exposes the WSGI callable as a module-level variable named ``application``.
+It exposes the WSGI callable as a module-level variable named ``application``,
+after compiling the templates of the project, building the in-memory
+indexes shared by the workers and enabling the background writes of the
+search logs.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/2.2/howto/deployment/wsgi/
@@ -14,3 +17,16 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pur_beurre_project.settings')
 
 application = get_wsgi_application()
+
+from django.db import connections
+
+from pur_beurre_project.warmup import warm_templates
+from substituter.analytics import enable_flusher
+from substituter.warming import warm_indexes
+
+warm_templates()
+warm_indexes()
+enable_flusher()
+
+#workers forked by gunicorn --preload must not share the connections of the master
+connections.close_all()
@@ -0,0 +1,218 @@
+'''
+This module records the searches made on the site.
+Each search is appended to an in-memory ring buffer of the worker, which
+costs no query nor network call while answering. A background thread of
+the worker flushes the buffer into the SearchLog table every
+SEARCH_LOG_FLUSH_INTERVAL seconds, with a single insert; when the buffer
+is full, the oldest searches are dropped. The logs are then rolled up by
+hour into the SearchRollup table, from which the top queries and the
+queries finding no product are read.
+'''
+
+import atexit
+from collections import deque
+from datetime import timedelta
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .cache import normalize_query
+from .models import SearchLog, SearchRollup
+
+
+logger = logging.getLogger(__name__)
+
+HOUR = timedelta(hours=1)
+
+
+class SearchBuffer:
+    '''
+    Ring buffer of the searches waiting to be written, keeping the last
+    capacity ones. dropped counts the searches pushed out before a flush.
+    '''
+
+    def __init__(self, capacity):
+        self.entries = deque(maxlen=capacity)
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def append(self, entry):
+        #Adds an entry, dropping the oldest one if the buffer is full
+        with self.lock:
+            if len(self.entries) == self.entries.maxlen:
+                self.dropped += 1
+            self.entries.append(entry)
+
+    def drain(self):
+        #Returns and removes every entry of the buffer
+        with self.lock:
+            entries = list(self.entries)
+            self.entries.clear()
+        return entries
+
+
+buffer = SearchBuffer(settings.SEARCH_LOG_CAPACITY)
+
+_enabled = False
+_flusher = None
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def record_search(query, product, duration_ms):
+    #Buffers a search, its base product or None, and its duration in ms
+    buffer.append(SearchLog(query=query[:255],
+                            hit=product is not None,
+                            product_id=product and product.pk,
+                            duration_ms=duration_ms,
+                            created_at=timezone.now()))
+    if _enabled:
+        _ensure_flusher()
+
+
+def flush():
+    #Writes the buffered searches with a single insert, and returns their number
+    entries = buffer.drain()
+    if entries:
+        SearchLog.objects.bulk_create(entries)
+    return len(entries)
+
+
+def _flush_forever(interval):
+    #Flushes the buffer every interval seconds, logging the failures
+    while True:
+        time.sleep(interval)
+        close_old_connections()
+        try:
+            flush()
+        except Exception:
+            logger.exception("search logs could not be written")
+
+
+def enable_flusher():
+    '''
+    Lets the workers of this process flush their searches in the background.
+    The thread is started by the first search of each process, since the
+    threads of a gunicorn master started with --preload do not survive the
+    fork of its workers.
+    '''
+
+    global _enabled
+    if settings.SEARCH_LOG_FLUSH_INTERVAL:
+        _enabled = True
+
+
+def _ensure_flusher():
+    #Starts the flusher thread of the current process, if not running
+    global _flusher, _flusher_pid
+    pid = os.getpid()
+    if _flusher_pid == pid and _flusher.is_alive():
+        return
+    with _flusher_lock:
+        if _flusher_pid == pid and _flusher.is_alive():
+            return
+        _flusher = threading.Thread(target=_flush_forever,
+                                    args=(settings.SEARCH_LOG_FLUSH_INTERVAL,),
+                                    name="search-log-flusher",
+                                    daemon=True)
+        _flusher.start()
+        if _flusher_pid != pid:
+            atexit.register(flush)
+        _flusher_pid = pid
+
+
+def truncate_hour(moment):
+    #Returns the start of the hour of a datetime
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def rollup_hour(hour):
+    '''
+    Counts the searches logged during an hour by normalized query, along
+    with those that found no product, and replaces the rollups of the hour.
+    Returns the number of rolled up queries.
+    '''
+
+    counts = {}
+    for query, hit in (SearchLog.objects
+                                .filter(created_at__gte=hour,
+                                        created_at__lt=hour + HOUR)
+                                .values_list('query', 'hit')
+                                .iterator()):
+        key = (normalize_query(query.split('+')) or query.strip())[:255]
+        searches, misses = counts.get(key, (0, 0))
+        counts[key] = (searches + 1, misses + (not hit))
+
+    with transaction.atomic():
+        SearchRollup.objects.filter(hour=hour).delete()
+        SearchRollup.objects.bulk_create([
+            SearchRollup(hour=hour, query=query,
+                         searches=searches, misses=misses)
+            for query, (searches, misses) in counts.items()
+        ])
+    return len(counts)
+
+
+def rollup_searches(now=None):
+    '''
+    Rolls up every complete hour logged since the last rolled up one,
+    skipping the hours without searches, and returns the number of rolled up
+    hours. An hour is complete once the flushers had the time to write it.
+    '''
+
+    now = now or timezone.now()
+    delay = timedelta(seconds=settings.SEARCH_LOG_FLUSH_INTERVAL)
+    end = truncate_hour(now - delay)
+    last = (SearchRollup.objects.order_by('-hour')
+                                .values_list('hour', flat=True)
+                                .first())
+
+    count = 0
+    while True:
+        logs = SearchLog.objects.filter(created_at__lt=end)
+        if last is not None:
+            logs = logs.filter(created_at__gte=last + HOUR)
+        first = (logs.order_by('created_at')
+                     .values_list('created_at', flat=True)
+                     .first())
+        if first is None:
+            return count
+        last = truncate_hour(first)
+        rollup_hour(last)
+        count += 1
+
+
+def top_queries(since, limit=10, misses=False):
+    '''
+    Returns the (query, count) pairs of the limit most searched queries
+    since a datetime, from the rollups, counting only the searches that
+    found no product if misses.
+    '''
+
+    field = 'misses' if misses else 'searches'
+    return list(SearchRollup.objects
+                            .filter(hour__gte=truncate_hour(since))
+                            .values('query')
+                            .annotate(total=Sum(field))
+                            .filter(total__gt=0)
+                            .order_by('-total', 'query')
+                            .values_list('query', 'total')[:limit])
+
+
+def count_searches(since):
+    #Returns the number of searches rolled up since a datetime
+    return (SearchRollup.objects.filter(hour__gte=truncate_hour(since))
+                                .aggregate(total=Sum('searches'))['total']
+            or 0)
+
+
+def prune_searches(before):
+    #Deletes the search logs older than a datetime, and returns their number
+    count, deleted = SearchLog.objects.filter(created_at__lt=before).delete()
+    return count
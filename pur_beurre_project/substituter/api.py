@@ -0,0 +1,309 @@
+'''
+The api of the substituter app serves the research feature as json.
+Results are paginated with opaque cursors holding the sort key of the last
+result of a page, so that each page is read from where the previous one
+stopped, however deep it is. Clients select the fields of the products
+they need, and every response carries an ETag derived from the version of
+the catalogue, for conditional requests to be answered without any query.
+Whole shopping lists are resolved by the batch view, and the barcodes of a
+scanning session by the barcodes view, both sharing their queries between
+the items of the list.
+'''
+
+import base64
+from functools import wraps
+import hashlib
+import json
+import re
+import threading
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from .cache import (
+    barcode_results, catalogue_version, parse_barcode, search_many
+)
+from .models import Product
+from .ranking import search_products
+from .substitutes import substitute_page
+
+
+API_FIELDS = ["id", "barcode", "name", "grade", "link", "description",
+              "image", "salt", "carbohydrates", "sugars", "fats", "proteins",
+              "fibers"]
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class BadRequest(Exception):
+    #Raised when the parameters of a request are invalid
+    pass
+
+
+def query_words(query):
+    #Returns the words of a query, separated by spaces or plus signs
+    return [word for word in re.split(r'[\s+]+', query) if word]
+
+
+def encode_cursor(values):
+    #Returns the opaque cursor holding a list of values
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    #Returns the list of values held by a cursor
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise BadRequest("invalid cursor")
+    if not isinstance(values, list):
+        raise BadRequest("invalid cursor")
+    return values
+
+
+def _limit(request):
+    #Returns the number of results per page asked by the request
+    try:
+        limit = int(request.GET.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest("limit must be an integer")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise BadRequest("limit must be between 1 and {}".format(MAX_LIMIT))
+    return limit
+
+
+def _fields(request):
+    #Returns the product fields asked by the request, every field by default
+    fields = request.GET.get("fields")
+    if not fields:
+        return API_FIELDS
+    return _check_fields([field for field in fields.split(",") if field])
+
+
+def _check_fields(fields):
+    #Returns the list of fields, if they are all known
+    unknown = [field for field in fields if field not in API_FIELDS]
+    if unknown:
+        raise BadRequest("unknown fields: {}".format(", ".join(unknown)))
+    return fields
+
+
+def serialize(product, fields):
+    #Returns the selected fields of product as a dictionary
+    return {field: product.pk if field == "id" else getattr(product, field)
+            for field in fields}
+
+
+def api_etag(request, *args, **kwargs):
+    #Returns the ETag of an api response, shared by the workers until the catalogue changes
+    return hashlib.sha1('{}:{}'.format(catalogue_version(),
+                                       request.get_full_path()).encode()
+                        ).hexdigest()
+
+
+def api_view(view):
+    #Decorates an api view: GET only, conditional, and answering 400 to bad requests
+    @wraps(view)
+    @require_GET
+    @condition(etag_func=api_etag)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as error:
+            return JsonResponse({"error": str(error)}, status=400)
+    return wrapper
+
+
+@api_view
+def search(request):
+    '''
+    Returns a page of the products matching the query, from best to worst
+    score, with the link to the substitutes of each of them.
+    '''
+
+    words = query_words(request.GET.get("query", ""))
+    if not words:
+        raise BadRequest("query is required")
+    limit = _limit(request)
+    fields = _fields(request)
+
+    products = search_products(words)
+    cursor = request.GET.get("cursor")
+    if cursor:
+        values = decode_cursor(cursor)
+        if (len(values) != 2
+                or not all(isinstance(value, (int, float)) for value in values)):
+            raise BadRequest("invalid cursor")
+        score, pk = values
+        products = products.filter(Q(score__lt=score)
+                                   | Q(score=score, pk__lt=pk))
+
+    page = list(products[:limit + 1])
+    results = [dict(serialize(product, fields),
+                    score=product.score,
+                    substitutes=reverse("substituter:api_substitutes",
+                                        args=[product.pk]))
+               for product in page[:limit]]
+    last = page[limit - 1] if len(page) > limit else None
+
+    return JsonResponse({
+        "results": results,
+        "next": encode_cursor([last.score, last.pk]) if last else None,
+    })
+
+
+@api_view
+def substitutes(request, product_id):
+    #Returns a page of the substitutes of a product, from best to worst
+    limit = _limit(request)
+    fields = _fields(request)
+    product = get_object_or_404(Product, pk=product_id)
+
+    after = None
+    cursor = request.GET.get("cursor")
+    if cursor:
+        values = decode_cursor(cursor)
+        if (len(values) != 2
+                or not all(isinstance(value, (int, float)) for value in values)):
+            raise BadRequest("invalid cursor")
+        after = values
+
+    page = substitute_page(product, after, limit + 1)
+    results = [dict(serialize(substitute, fields), rank=rank)
+               for rank, score, substitute in page[:limit]]
+    last = page[limit - 1] if len(page) > limit else None
+
+    return JsonResponse({
+        "results": results,
+        "next": encode_cursor([last[1], last[2].pk]) if last else None,
+    })
+
+
+_slots = {}
+_slots_lock = threading.Lock()
+
+
+def _batch_slots():
+    #Returns the semaphore limiting the number of batches run at once by this worker
+    with _slots_lock:
+        size = settings.BATCH_MAX_CONCURRENCY
+        if size not in _slots:
+            _slots[size] = threading.BoundedSemaphore(size)
+        return _slots[size]
+
+
+def _items(request):
+    #Returns the items and fields of the shopping list posted as json
+    try:
+        body = json.loads(request.body.decode())
+    except (UnicodeDecodeError, ValueError):
+        raise BadRequest("the body must be json")
+    if not isinstance(body, dict):
+        raise BadRequest("the body must be a json object")
+
+    items = body.get("items")
+    if (not isinstance(items, list) or not items
+            or not all(isinstance(item, str) and item.strip()
+                       for item in items)):
+        raise BadRequest("items must be a list of strings")
+    if len(items) > settings.BATCH_MAX_ITEMS:
+        raise BadRequest("at most {} items are accepted"
+                         .format(settings.BATCH_MAX_ITEMS))
+
+    fields = body.get("fields") or API_FIELDS
+    if not isinstance(fields, list):
+        raise BadRequest("fields must be a list")
+    return [item.strip() for item in items], _check_fields(fields)
+
+
+def resolve_items(items):
+    '''
+    Returns the (base_product, substitute_list) pair of each item of a
+    shopping list. Items made of digits are looked up as barcodes, all of
+    them together, and the others searched by name together.
+    '''
+
+    parsed = [parse_barcode(item) for item in items]
+    scanned = barcode_results([barcode for barcode in parsed
+                               if barcode is not None])
+
+    queries = [item for item, barcode in zip(items, parsed) if barcode is None]
+    searched = dict(zip(queries, search_many([query_words(query)
+                                              for query in queries])))
+
+    return [searched[item] if barcode is None else scanned[barcode]
+            for item, barcode in zip(items, parsed)]
+
+
+def _result(item, base, substitute_list, fields):
+    #Returns the json result of an item, its base product and substitutes
+    return {"item": item,
+            "product": serialize(base, fields) if base else None,
+            "substitutes": [serialize(substitute, fields)
+                            for substitute in substitute_list]}
+
+
+@api_view
+def barcodes(request):
+    '''
+    Returns the product holding each of the comma separated barcodes and
+    its substitutes, for the scanning sessions. All the barcodes are looked
+    up with a single query, and their results cached.
+    '''
+
+    codes = [code.strip() for code in request.GET.get("codes", "").split(",")
+             if code.strip()]
+    if not codes:
+        raise BadRequest("codes is required")
+    if len(codes) > MAX_LIMIT:
+        raise BadRequest("at most {} codes are accepted".format(MAX_LIMIT))
+    if any(parse_barcode(code) is None for code in codes):
+        raise BadRequest("codes must be barcodes")
+    fields = _fields(request)
+
+    scanned = barcode_results([parse_barcode(code) for code in codes])
+    results = []
+    for code in codes:
+        base, substitute_list = scanned[parse_barcode(code)]
+        results.append(_result(code, base, substitute_list, fields))
+    return JsonResponse({"results": results})
+
+
+@csrf_exempt
+@require_POST
+def batch(request):
+    '''
+    Returns the best matching product and the substitutes of every item of
+    a shopping list, posted as {"items": [...], "fields": [...]}. At most
+    BATCH_MAX_CONCURRENCY lists are resolved at once by each worker, the
+    others waiting BATCH_WAIT seconds at most for their turn.
+    '''
+
+    try:
+        items, fields = _items(request)
+    except BadRequest as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    slots = _batch_slots() if settings.BATCH_MAX_CONCURRENCY else None
+    if slots and not slots.acquire(timeout=settings.BATCH_WAIT):
+        response = JsonResponse({"error": "too many batches, retry later"},
+                                status=503)
+        response["Retry-After"] = str(settings.BATCH_WAIT)
+        return response
+
+    try:
+        results = resolve_items(items)
+    finally:
+        if slots:
+            slots.release()
+
+    return JsonResponse({"results": [
+        _result(item, base, substitute_list, fields)
+        for item, (base, substitute_list) in zip(items, results)
+    ]})
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SubstituterConfig(AppConfig):
     name = 'substituter'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,90 @@
+'''
+This module answers the autocomplete requests from memory.
+Each worker loads the product names once into an AutocompleteIndex, and
+reloads them in the background when the version of the catalogue changes.
+Names are ranked by popularity (the number of users who bookmarked them)
+and kept in that order, so that the best suggestions are the ones with the
+lowest positions.
+The folded tokens of the names are stored with all their suffixes in a
+sorted list, which turns both prefix and infix lookups into a binary search.
+'''
+
+from array import array
+from bisect import bisect_left
+from django.db.models import Count
+
+from pur_beurre_project.replicas import read_primary
+
+from .cache import catalogue_version
+from .index import tokenize
+from .models import Product
+from .reloading import ReloadedIndex
+
+
+class AutocompleteIndex:
+    '''
+    In-memory index of the product names, built from (name, popularity)
+    pairs ordered by product id.
+    '''
+
+    def __init__(self, products):
+        ranked = sorted(enumerate(products), key=lambda item: (-item[1][1],
+                                                               item[0]))
+        self.names = [name for number, (name, popularity) in ranked]
+
+        postings = {}
+        for position, name in enumerate(self.names):
+            for token in set(tokenize(name)):
+                postings.setdefault(token, array('I')).append(position)
+        self.postings = postings
+
+        suffixes = sorted((token[start:], token)
+                          for token in postings
+                          for start in range(len(token)))
+        self.suffixes = [suffix for suffix, token in suffixes]
+        self.suffix_tokens = [token for suffix, token in suffixes]
+
+    def _positions(self, token):
+        #Returns the positions of the names with a word containing token
+        positions = set()
+        start = bisect_left(self.suffixes, token)
+        for number in range(start, len(self.suffixes)):
+            if not self.suffixes[number].startswith(token):
+                break
+            positions.update(self.postings[self.suffix_tokens[number]])
+        return positions
+
+    def lookup(self, term, limit=20):
+        '''
+        Returns the limit most popular names containing every token of term,
+        in any of their words.
+        '''
+
+        tokens = sorted(set(tokenize(term)), key=len, reverse=True)
+        if not tokens:
+            return []
+
+        positions = self._positions(tokens[0])
+        for token in tokens[1:]:
+            if not positions:
+                break
+            positions &= self._positions(token)
+
+        return [self.names[position] for position in sorted(positions)[:limit]]
+
+
+def load_index():
+    #Builds an index of every product of the primary database
+    with read_primary():
+        products = (Product.objects.annotate(popularity=Count('user'))
+                                   .order_by('pk')
+                                   .values_list('name', 'popularity'))
+        return AutocompleteIndex(products)
+
+
+_index = ReloadedIndex(load_index)
+
+
+def get_index(wait=False):
+    #Returns the index of this worker, rebuilt in the background when the catalogue changes
+    return _index.get(catalogue_version(), wait)
@@ -0,0 +1,189 @@
+'''
+This module measures the hot paths of the project on synthetic catalogues.
+A catalogue of the requested size is generated in the openfoodfacts format
+and written through the ingestion pipeline, then the search, autocomplete,
+detail and bookmarked views are requested repeatedly through the test
+client. For each of them, the latency percentiles, the number of queries
+and the peak memory allocated by python are reported.
+Catalogues are written into the current database, so the benchmarks are
+meant to be run on a test database, as the benchmark command does.
+'''
+
+from contextlib import contextmanager
+import random
+import resource
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import User
+
+from .cache import get_cache, search_key
+from .ingestion import Timings, write_products
+from .models import Product
+from .substitutes import compute_substitutes
+
+
+WORDS = ["pate", "tartiner", "chocolat", "noisette", "biscuit", "lait",
+         "jus", "orange", "pomme", "yaourt", "nature", "fraise", "cafe",
+         "the", "vert", "cereales", "miel", "confiture", "abricot", "beurre",
+         "sale", "jambon", "saucisson", "fromage", "blanc", "eau", "gazeuse",
+         "sirop", "menthe", "compote", "banane", "riz", "pates", "sauce",
+         "tomate", "huile", "olive", "sucre", "farine", "chips"]
+
+GRADES = "abcde"
+
+NUTRIMENTS = ["fat_100g", "proteins_100g", "carbohydrates_100g",
+              "sugars_100g", "salt_100g", "fibers_100g"]
+
+
+def synthetic_products(size, category_count=None, seed=0):
+    '''
+    Yields size products in the openfoodfacts api format. Category
+    popularity follows a Zipf distribution, so that a few categories hold
+    most of the products as in the real catalogue, and each product has
+    between 3 and 15 categories.
+    '''
+
+    rng = random.Random(seed)
+    category_count = category_count or max(50, size // 20)
+    categories = ["categorie {}".format(number)
+                  for number in range(category_count)]
+    weights = [1 / (rank + 1) for rank in range(category_count)]
+
+    for code in range(1, size + 1):
+        name = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 5)))
+        product_categories = set(rng.choices(categories, weights,
+                                             k=rng.randint(3, 15)))
+        yield {
+            "code": str(code),
+            "product_name": name,
+            "nutrition_grades": rng.choice(GRADES),
+            "url": "https://fr.openfoodfacts.org/produit/{}".format(code),
+            "generic_name": name,
+            "image_url": "https://static.openfoodfacts.org/{}.jpg".format(code),
+            "categories": ",".join(sorted(product_categories)),
+            "last_modified_t": code,
+            "nutriments": {key: round(rng.uniform(0, 50), 1)
+                           for key in NUTRIMENTS if rng.random() > 0.2},
+        }
+
+
+def percentile(values, fraction):
+    #Returns the value below which the given fraction of the sorted values lie
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+@contextmanager
+def measure(results, name):
+    '''
+    Measures the duration and the number of queries of the with block, and
+    appends them to the named entry of results. The first run of each entry
+    is a warm-up run, only used to measure the peak memory allocated by
+    python, since tracing allocations slows the code down.
+    '''
+
+    entry = results.get(name)
+    if entry is None:
+        tracemalloc.start()
+        try:
+            yield
+            results[name] = {"latencies": [], "queries": [],
+                             "peak_memory": tracemalloc.get_traced_memory()[1]}
+        finally:
+            tracemalloc.stop()
+        return
+
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        yield
+        entry["latencies"].append(time.perf_counter() - start)
+    entry["queries"].append(len(queries))
+
+
+def summarize(entry):
+    #Returns the latency percentiles in milliseconds, the mean query count and the peak memory
+    latencies = entry["latencies"]
+    return {
+        "runs": len(latencies),
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p90_ms": percentile(latencies, 0.9) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "queries": sum(entry["queries"]) / len(entry["queries"]),
+        "peak_memory_kb": entry["peak_memory"] / 1024,
+    }
+
+
+def measure_ingestion(size, seed, batch_size):
+    '''
+    Writes a synthetic catalogue of size products through the ingestion
+    pipeline, then precomputes the substitutes. Returns the duration of
+    each phase, the number of queries, the ingestion speed and the peak
+    resident memory of the process.
+    '''
+
+    timings = Timings()
+    with CaptureQueriesContext(connection) as queries:
+        written = write_products(synthetic_products(size, seed=seed),
+                                 batch_size=batch_size,
+                                 timings=timings)
+        with timings.phase("substitutes"):
+            compute_substitutes(batch_size=batch_size)
+
+    ingestion = sum(duration for phase, duration in timings.phases.items()
+                    if phase != "substitutes")
+    return {
+        "products": written,
+        "phases_s": timings.phases,
+        "rows_per_second": written / ingestion if ingestion else 0,
+        "queries": len(queries),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_benchmarks(size, repeat=20, seed=0, batch_size=500):
+    '''
+    Generates a catalogue of size products in the current database, then
+    measures the ingestion and repeat runs of each view, after a warm-up
+    run. Returns a dictionary of the summarized measures, keyed on the name
+    of the measured path.
+    '''
+
+    rng = random.Random(seed)
+    results = {}
+    ingestion = measure_ingestion(size, seed, batch_size)
+
+    pks = list(Product.objects.values_list('pk', flat=True))
+    user = User.objects.create(email="benchmark@purbeurre.fr")
+    user.bookmarks.add(*rng.sample(pks, min(len(pks), 200)))
+
+    anonymous = Client()
+    connected = Client()
+    connected.force_login(user)
+
+    for run in range(repeat + 1):
+        words = rng.sample(WORDS, 2)
+        query = "+".join(words)
+
+        get_cache().delete(search_key(words))
+        with measure(results, "search"):
+            anonymous.get("/substituter/search/", {"query": query})
+        with measure(results, "search_cached"):
+            connected.get("/substituter/search/", {"query": query})
+        with measure(results, "autocomplete"):
+            anonymous.get("/substituter/autocomplete/",
+                          {"term": rng.choice(WORDS)[:4]})
+        with measure(results, "detail"):
+            anonymous.get("/substituter/detail/{}/".format(rng.choice(pks)))
+        with measure(results, "bookmarked"):
+            connected.get("/bookmarks/bookmarked/")
+
+    summary = {name: summarize(entry) for name, entry in results.items()}
+    summary["update_db"] = ingestion
+    return summary
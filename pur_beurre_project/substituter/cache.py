@@ -0,0 +1,224 @@
+'''
+This module caches the results of the research feature.
+Results are stored as the id of the base product and the ids of its
+substitutes, under a key built from the normalized query or the scanned
+barcode, so that the same entry is shared by every user. Every key includes
+the current version of the catalogue, which is changed whenever products
+are written: all the cached results are then invalidated at once. The
+version is stored in the database, for every process to see it change, and
+kept in the cache for CATALOGUE_VERSION_TTL seconds. The results are
+computed from the primary database, since a lagging replica would cache
+former results under the new version.
+'''
+
+import hashlib
+import re
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import prefetch_related_objects
+
+from pur_beurre_project.replicas import read_primary
+
+from .index import normalize_words
+from .models import CatalogueVersion, Product
+from .ranking import search_products
+from .substitutes import get_substitutes, substitutes_of
+
+
+VERSION_KEY = 'catalogue_version'
+
+BARCODE_MAX_DIGITS = 18
+
+
+def get_cache():
+    #Returns the cache used by the research feature
+    return caches[settings.SEARCH_CACHE_ALIAS]
+
+
+def catalogue_version():
+    '''
+    Returns the current version of the catalogue, read from the primary
+    database at most once every CATALOGUE_VERSION_TTL seconds, and created
+    if missing.
+    '''
+
+    version = get_cache().get(VERSION_KEY)
+    if version is None:
+        with read_primary():
+            version = (CatalogueVersion.objects.filter(pk=1)
+                                               .values_list('version', flat=True)
+                                               .first())
+            if version is None:
+                version = CatalogueVersion.objects.get_or_create(
+                    pk=1, defaults={'version': uuid.uuid4().hex}
+                )[0].version
+        get_cache().set(VERSION_KEY, version, settings.CATALOGUE_VERSION_TTL)
+    return version
+
+
+def bump_catalogue_version():
+    #Changes the version of the catalogue, invalidating every cached result
+    version = uuid.uuid4().hex
+    CatalogueVersion.objects.update_or_create(pk=1,
+                                              defaults={'version': version})
+    get_cache().set(VERSION_KEY, version, settings.CATALOGUE_VERSION_TTL)
+
+
+def normalize_query(input):
+    #Returns the normalized form of a list of words, as searched by the ranking
+    return '+'.join(normalize_words(input))
+
+
+def search_key(input):
+    #Returns the cache key of the results of a list of words
+    digest = hashlib.sha1(normalize_query(input).encode()).hexdigest()
+    return 'search:{}:{}'.format(catalogue_version(), digest)
+
+
+def search_results(input):
+    '''
+    Returns the product best matching a list of words, or None, along with
+    the list of its six best substitutes. The ids of the results are read
+    from the cache when available, and the products fetched in one query.
+    '''
+
+    key = search_key(input)
+    cached = get_cache().get(key)
+
+    if cached is None:
+        with read_primary():
+            base_product = search_products(input).first()
+            substitute_list = (get_substitutes(base_product)
+                               if base_product else [])
+        get_cache().set(key,
+                        (base_product and base_product.pk,
+                         [substitute.pk for substitute in substitute_list]),
+                        settings.SEARCH_CACHE_TIMEOUT)
+        return base_product, substitute_list
+
+    base_id, substitute_ids = cached
+    if base_id is None:
+        return None, []
+
+    products = Product.objects.in_bulk([base_id] + substitute_ids)
+    if base_id not in products:
+        get_cache().delete(key)
+        return search_results(input)
+
+    return (products[base_id],
+            [products[pk] for pk in substitute_ids if pk in products])
+
+
+def _store(results):
+    #Caches the ids of (base_product, substitute_list) pairs, by cache key
+    get_cache().set_many(
+        {key: (base and base.pk, [substitute.pk for substitute in substitute_list])
+         for key, (base, substitute_list) in results.items()},
+        settings.SEARCH_CACHE_TIMEOUT
+    )
+
+
+def _load(cached):
+    '''
+    Returns the (base_product, substitute_list) pairs of cached entries, by
+    cache key, fetching all their products with a single query. Entries
+    whose base product was deleted are left out.
+    '''
+
+    pks = {pk for base_id, substitute_ids in cached.values()
+           for pk in [base_id] + substitute_ids if pk is not None}
+    products = Product.objects.in_bulk(sorted(pks)) if pks else {}
+
+    results = {}
+    for key, (base_id, substitute_ids) in cached.items():
+        if base_id is None:
+            results[key] = (None, [])
+        elif base_id in products:
+            results[key] = (products[base_id],
+                            [products[pk] for pk in substitute_ids
+                             if pk in products])
+    return results
+
+
+def search_many(inputs):
+    '''
+    Returns the list of the (base_product, substitute_list) pairs of several
+    lists of words, like search_results. The cached results are read with a
+    single cache lookup and their products with a single query. The other
+    lists of words are ranked one by one, then the substitutes of all their
+    products computed together and cached.
+    '''
+
+    keys = [search_key(input) for input in inputs]
+    cached = get_cache().get_many(keys)
+
+    with read_primary():
+        missing = {key: search_products(input).first()
+                   for input, key in zip(inputs, keys) if key not in cached}
+        bases = [base for base in missing.values() if base]
+        prefetch_related_objects(bases, 'categories')
+        substitutes = substitutes_of(bases)
+
+    results = {key: (base, substitutes[base.pk] if base else [])
+               for key, base in missing.items()}
+    _store(results)
+    results.update(_load(cached))
+
+    return [results[key] if key in results else search_results(input)
+            for input, key in zip(inputs, keys)]
+
+
+def parse_barcode(query):
+    #Returns the barcode held by a query made of digits only, or None
+    query = query.strip()
+    if re.fullmatch(r'[0-9]{{1,{}}}'.format(BARCODE_MAX_DIGITS), query):
+        return int(query)
+    return None
+
+
+def barcode_key(barcode):
+    #Returns the cache key of the results of a barcode
+    return 'barcode:{}:{}'.format(catalogue_version(), barcode)
+
+
+def barcode_results(barcodes):
+    '''
+    Returns a dictionary mapping each of barcodes to the product holding it,
+    or None, along with the list of its six best substitutes. Results are
+    cached like those of search_results; the missing barcodes are looked up
+    together with a single query on the unique barcode index, and their
+    substitutes read from the precomputed table or computed together.
+    '''
+
+    keys = {barcode: barcode_key(barcode) for barcode in set(barcodes)}
+    cached = get_cache().get_many(list(keys.values()))
+    missing = [barcode for barcode, key in keys.items() if key not in cached]
+
+    products = {}
+    with read_primary():
+        if missing:
+            products = {product.barcode: product
+                        for product
+                        in Product.objects.filter(barcode__in=missing)}
+        prefetch_related_objects([product for product in products.values()
+                                  if not product.substitutes_computed],
+                                 'categories')
+        substitutes = substitutes_of(list(products.values()))
+
+    results = {}
+    for barcode in missing:
+        product = products.get(barcode)
+        results[keys[barcode]] = (product,
+                                  substitutes[product.pk] if product else [])
+    _store(results)
+    results.update(_load(cached))
+
+    stale = [barcode for barcode, key in keys.items() if key not in results]
+    if stale:
+        get_cache().delete_many([keys[barcode] for barcode in stale])
+        results.update((keys[barcode], found)
+                       for barcode, found in barcode_results(stale).items())
+
+    return {barcode: results[key] for barcode, key in keys.items()}
@@ -0,0 +1,113 @@
+'''
+This module selects the substitute candidates from memory.
+Each worker loads the links between products and categories once into a
+CategoryIndex, which maps each category to the sorted array of the
+positions of its products. The specificities of the categories a product
+shares with a base product are then summed for the whole catalogue in a
+single pass over these arrays, instead of joining the categories table.
+The index is built on first use, rebuilt in the background when the
+version of the catalogue stored in the database changes (so after every
+update_db, whichever process ran it), and not built at all when the catalogue
+holds more links than CATEGORY_INDEX_MAX_LINKS, the database selecting the
+candidates instead.
+'''
+
+from array import array
+
+import numpy as np
+
+from django.conf import settings
+
+from pur_beurre_project.replicas import read_primary
+
+from .models import Category, Product
+from .reloading import ReloadedIndex
+
+
+class CategoryIndex:
+    '''
+    In-memory index of the categories, built from (pk, grade) pairs ordered
+    by product id, (product_id, category_id) links and (pk, specificity)
+    pairs.
+    '''
+
+    def __init__(self, products, links, categories):
+        products = list(products)
+        self.pks = np.array([pk for pk, grade in products], dtype=np.int64)
+        self.grades = np.array([grade for pk, grade in products], dtype='U1')
+
+        postings = {}
+        for product_id, category_id in links:
+            postings.setdefault(category_id, []).append(product_id)
+        self.postings = {
+            category_id: array('I', np.searchsorted(self.pks, sorted(pks)))
+            for category_id, pks in postings.items()
+        }
+
+        self.specificities = {pk: specificity
+                              for pk, specificity in categories
+                              if pk in self.postings}
+
+    def overlaps(self, category_ids):
+        '''
+        Returns the array of the scores of every product, by position: each
+        of category_ids linked to the product adds its specificity, as in
+        rank_by_categories.
+        '''
+
+        category_ids = [pk for pk in set(category_ids) if pk in self.postings]
+        if not category_ids:
+            return np.zeros(len(self.pks))
+
+        postings = [np.frombuffer(self.postings[pk], dtype=np.uint32)
+                    for pk in category_ids]
+        weights = np.repeat([self.specificities[pk] for pk in category_ids],
+                            [len(posting) for posting in postings])
+        return np.bincount(np.concatenate(postings),
+                           weights=weights,
+                           minlength=len(self.pks))
+
+    def candidates(self, category_ids, grade, limit):
+        '''
+        Returns the ids of the limit products of grade lower than grade with
+        the highest scores for category_ids, and their scores, sorted from
+        highest to lowest score then from latest to oldest product.
+        '''
+
+        scores = self.overlaps(category_ids)
+        positions = np.flatnonzero((scores > 0) & (self.grades < grade))
+        order = np.lexsort((-self.pks[positions], -scores[positions]))
+        positions = positions[order[:limit]]
+        return self.pks[positions], scores[positions]
+
+
+def load_category_index():
+    '''
+    Builds an index of every product and category of the primary
+    database, or returns None if the catalogue holds more than
+    CATEGORY_INDEX_MAX_LINKS links between products and categories.
+    '''
+
+    through = Product.categories.through
+    with read_primary():
+        if through.objects.count() > settings.CATEGORY_INDEX_MAX_LINKS:
+            return None
+
+        return CategoryIndex(
+            Product.objects.order_by('pk').values_list('pk', 'grade'),
+            through.objects.values_list('product_id', 'category_id')
+                           .iterator(),
+            Category.objects.values_list('pk', 'specificity')
+        )
+
+
+_index = ReloadedIndex(load_category_index)
+
+
+def get_category_index(wait=False):
+    #Returns the index of this worker, rebuilt in the background when the catalogue changes
+
+    #imported here since the cache module imports this one through substitutes
+    from .cache import catalogue_version
+
+    return _index.get(catalogue_version(), wait)
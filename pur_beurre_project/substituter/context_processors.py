@@ -0,0 +1,10 @@
+'''
+This file contains the context processors of the substituter app.
+'''
+
+from django.conf import settings
+
+
+def card_cache(request):
+    #Adds the timeout of the cached product cards to every template
+    return {"card_cache_timeout": settings.CARD_CACHE_TIMEOUT}
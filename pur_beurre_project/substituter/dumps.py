@@ -0,0 +1,101 @@
+'''
+This module reads the products of an openfoodfacts dump file.
+Dumps are either JSONL files (one product per line) or tab separated CSV
+files, possibly gzipped. They are read line by line through a chain of
+generators, so that memory use does not depend on the size of the file, and
+each product is converted to the format of the openfoodfacts api, to be
+written by the ingestion module.
+'''
+
+import csv
+import gzip
+import json
+import re
+
+from .index import fold
+from .ingestion import NUTRIMENTS, accepted_categories
+
+
+PRODUCT_URL = 'https://fr.openfoodfacts.org/produit/{}'
+
+CSV_GRADE_COLUMNS = ["nutriscore_grade", "nutrition_grade_fr"]
+
+CSV_NUTRIMENT_COLUMNS = {"fibers_100g": ["fibers_100g", "fiber_100g"]}
+
+
+def slugify(category):
+    #Returns the folded form of a category name or tag, without its language prefix
+    category = category.split(":", 1)[-1]
+    return re.sub(r'[\W_]+', '_', fold(category)).strip('_')
+
+
+def open_dump(path):
+    #Opens a dump file in text mode, decompressing it if it is gzipped
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def dump_format(path):
+    #Guesses the format of a dump file from its name
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith(('.csv', '.tsv')) else 'jsonl'
+
+
+def read_jsonl(lines):
+    #Yields the products of a JSONL dump, skipping the malformed lines
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+
+def read_csv(lines):
+    #Yields the products of a tab separated CSV dump, in the api format
+    #the dumps are not quoted: a leading quote belongs to the field
+    for row in csv.DictReader(lines, delimiter='\t', quoting=csv.QUOTE_NONE):
+        nutriments = {}
+        for key in NUTRIMENTS.values():
+            for column in CSV_NUTRIMENT_COLUMNS.get(key, [key]):
+                if row.get(column):
+                    nutriments[key] = row[column]
+
+        product = dict(row)
+        product["nutrition_grades"] = next(
+            (row[column] for column in CSV_GRADE_COLUMNS if row.get(column)),
+            None
+        )
+        product["categories_tags"] = (row.get("categories_tags") or "").split(",")
+        product["nutriments"] = nutriments
+        yield product
+
+
+def with_url(products):
+    #Yields the products, with a link to their page when the dump has none
+    for product in products:
+        if not product.get("url") and product.get("code"):
+            product["url"] = PRODUCT_URL.format(product["code"])
+        yield product
+
+
+def in_categories(products, categories=accepted_categories):
+    #Yields the products belonging to at least one of the given categories
+    accepted = {slugify(category) for category in categories}
+    for product in products:
+        names = (product.get("categories_tags") or []) + \
+                (product.get("categories") or "").split(",")
+        if any(slugify(name) in accepted for name in names):
+            yield product
+
+
+def read_dump(lines, format='jsonl', categories=accepted_categories):
+    '''
+    Yields the products of the accepted categories from the lines of a dump,
+    in the format of the openfoodfacts api.
+    '''
+
+    reader = read_csv if format == 'csv' else read_jsonl
+    return in_categories(with_url(reader(lines)), categories)
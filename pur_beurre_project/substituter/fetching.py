@@ -0,0 +1,161 @@
+'''
+This module downloads the products of the openfoodfacts api.
+The result pages of every category are fetched in parallel by a pool of
+threads sharing a single pooled session, which retries the failed requests
+with an exponential backoff. Downloaded pages are handed over to the caller
+through a bounded queue, so that the pages can be written into the database
+while the next ones are being downloaded.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import math
+import queue
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .ingestion import last_modified
+
+
+SEARCH_URL = 'https://fr.openfoodfacts.org/cgi/search.pl'
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def make_session(concurrency=4, retries=3, backoff=0.5):
+    '''
+    Returns a session keeping up to concurrency connections open per host,
+    and retrying failed requests with an exponential backoff.
+    '''
+
+    retry = Retry(total=retries,
+                  backoff_factor=backoff,
+                  status_forcelist=RETRY_STATUSES)
+    adapter = HTTPAdapter(pool_connections=concurrency,
+                          pool_maxsize=concurrency,
+                          max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_page(session, url, category, page, page_size, sort_by=None):
+    #Returns the decoded json of a result page of a category
+    params = {
+        'action': 'process',
+        'tagtype_0': 'categories',
+        'tag_contains_0': 'contains',
+        'tag_0': category,
+        'json': 1,
+        'page': page,
+        'page_size': page_size,
+    }
+    if sort_by:
+        params['sort_by'] = sort_by
+    response = session.get(url, params=params, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+def _modified_since(products, since):
+    #Returns the products modified at or after the since timestamp
+    return [product for product in products
+            if (last_modified(product) or 0) >= since]
+
+
+def fetch_pages(categories, url=SEARCH_URL, concurrency=4, page_size=100,
+                max_pages=None, retries=3, backoff=0.5, since=None, cut=None):
+    '''
+    Yields the list of products of each result page of each category, in the
+    order in which the pages are downloaded. The first page of each category
+    tells how many pages it holds, and the following ones are then fetched
+    in parallel, up to max_pages pages per category.
+    If since is given, only the products modified since that timestamp are
+    requested: pages are sorted from most to least recently modified, and
+    the pages of a category are fetched one after another until one holds
+    an older product.
+    cut is called with each category whose walk was stopped by max_pages
+    before its end, leaving products unseen.
+    '''
+
+    session = make_session(concurrency, retries, backoff)
+    pages = queue.Queue(maxsize=2 * concurrency)
+    stop = threading.Event()
+
+    def _fetch(category, page):
+        #Puts the downloaded page, or the raised exception, into the queue
+        if stop.is_set():
+            return
+        try:
+            result = fetch_page(session, url, category, page, page_size,
+                                'last_modified_t' if since else None)
+        except Exception as error:
+            result = error
+        pages.put((category, page, result))
+
+    futures = []
+    page_counts = {}
+    last_pages = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            for category in categories:
+                futures.append(executor.submit(_fetch, category, 1))
+            outstanding = len(futures)
+
+            while outstanding:
+                category, page, result = pages.get()
+                outstanding -= 1
+                if isinstance(result, Exception):
+                    raise result
+
+                if page == 1:
+                    last_pages[category] = math.ceil(
+                        int(result.get('count', 0)) / page_size
+                    )
+                    page_counts[category] = last_pages[category]
+                    if max_pages:
+                        page_counts[category] = min(page_counts[category],
+                                                    max_pages)
+
+                products = result.get('products', [])
+                next_pages = []
+                #whether the walk of the category stops at its last allowed page
+                at_bound = False
+                if since is None:
+                    if page == 1:
+                        next_pages = range(2, page_counts[category] + 1)
+                        at_bound = True
+                else:
+                    recent = _modified_since(products, since)
+                    if len(recent) == len(products):
+                        if page < page_counts[category]:
+                            next_pages = [page + 1]
+                        else:
+                            at_bound = True
+                    products = recent
+                if (cut and at_bound
+                        and page_counts[category] < last_pages[category]):
+                    cut(category)
+
+                for next_page in next_pages:
+                    futures.append(executor.submit(_fetch,
+                                                   category,
+                                                   next_page))
+                    outstanding += 1
+
+                yield products
+
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            while not all(future.done() for future in futures):
+                try:
+                    pages.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            session.close()
@@ -0,0 +1,88 @@
+'''
+This module adds the column and indexes used by the full-text ranking of
+the product names. They need PostgreSQL 12 or later, for the generated
+search_vector column, and the pg_trgm extension, which the role of the
+application may not be allowed to create: migration 0009 adds them when
+the database allows it, the enable_fulltext command otherwise, once the
+server is upgraded or the extension created. Until then, the ranking
+falls back to the inverted index.
+'''
+
+from functools import lru_cache
+import logging
+
+from django.db import DatabaseError, connection, transaction
+
+
+logger = logging.getLogger(__name__)
+
+MIN_PG_VERSION = 120000
+
+
+class FulltextUnavailable(Exception):
+    #Raised when the database cannot hold the full-text column and indexes
+    pass
+
+
+def check_version(database):
+    #Raises FulltextUnavailable unless database is PostgreSQL 12 or later
+    if (database.vendor != 'postgresql'
+            or database.pg_version < MIN_PG_VERSION):
+        raise FulltextUnavailable("the full-text search needs PostgreSQL 12 "
+                                  "or later")
+
+
+def add_search_indexes(schema_editor):
+    '''
+    Creates the pg_trgm extension, then adds the search_vector column and
+    the full-text and trigram indexes of the product names, unless they
+    exist. Raises FulltextUnavailable, leaving the database unchanged, if it
+    is not PostgreSQL 12 or later or if the extension cannot be created.
+    '''
+
+    database = schema_editor.connection
+    check_version(database)
+    try:
+        with transaction.atomic(using=database.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except DatabaseError as error:
+        raise FulltextUnavailable("the pg_trgm extension cannot be created: "
+                                  "{}".format(error))
+
+    schema_editor.execute(
+        "ALTER TABLE substituter_product ADD COLUMN IF NOT EXISTS "
+        "search_vector tsvector GENERATED ALWAYS AS "
+        "(to_tsvector('french', coalesce(name, ''))) STORED"
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS substituter_product_search_vector '
+        'ON substituter_product USING gin (search_vector)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS substituter_product_name_trgm '
+        'ON substituter_product USING gin (name gin_trgm_ops)'
+    )
+
+
+def remove_search_indexes(schema_editor):
+    #Removes the full-text column and indexes of the product names, if any
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS substituter_product_name_trgm')
+    schema_editor.execute(
+        'ALTER TABLE substituter_product DROP COLUMN IF EXISTS search_vector'
+    )
+
+
+@lru_cache(maxsize=None)
+def has_search_vector():
+    #Returns whether the search_vector column was added, checked once per process
+    with connection.cursor() as cursor:
+        columns = connection.introspection.get_table_description(
+            cursor, 'substituter_product'
+        )
+    found = any(column.name == 'search_vector' for column in columns)
+    if not found:
+        logger.warning("no search_vector column, names ranked through the "
+                       "index: see manage.py enable_fulltext")
+    return found
@@ -0,0 +1,177 @@
+'''
+This module stores local thumbnails of the product images.
+The image of each product is downloaded once from openfoodfacts, then
+resized to the fixed sizes of THUMBNAIL_SIZES, in JPEG and WebP. The files
+are stored under IMAGE_ROOT and named after the SHA-256 digest of the
+downloaded image, so that identical images are stored once and a file never
+changes once written: they are served with a cache lifetime of a year. The
+digest is kept in Product.image_hash, and reset by the ingestion when the
+url of the image changes. Images are downloaded by a pool of threads, the
+fetcher being any callable returning the bytes found at an url. Pages link
+to the original image of a product whose thumbnails are missing from the
+store of the web worker, as when update_db --images ran on another machine.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+from itertools import repeat
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .fetching import make_session
+from .models import Product
+
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZES = {
+    "small": (200, 200),
+    "large": (400, 400),
+}
+
+FORMATS = {
+    "jpg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True}),
+    "webp": ("WEBP", "image/webp", {"quality": 80}),
+}
+
+MAX_AGE = 60 * 60 * 24 * 365
+
+
+class HTTPFetcher:
+    #Downloads images through a pooled session retrying the failed requests
+
+    def __init__(self, concurrency=4):
+        self.session = make_session(concurrency)
+
+    def __call__(self, url):
+        response = self.session.get(url, timeout=30)
+        response.raise_for_status()
+        return response.content
+
+
+def thumbnail_name(digest, size, extension):
+    #Returns the path of a thumbnail, relative to IMAGE_ROOT
+    return '{}/{}-{}.{}'.format(digest[:2], digest, size, extension)
+
+
+def store_thumbnails(data):
+    '''
+    Writes the thumbnails of an image given as bytes into the store, unless
+    they are already there, and returns the digest naming them. Raises
+    OSError if the bytes are not a readable image.
+    '''
+
+    digest = hashlib.sha256(data).hexdigest()
+    names = {(size, extension): thumbnail_name(digest, size, extension)
+             for size in THUMBNAIL_SIZES for extension in FORMATS}
+    if all(os.path.exists(os.path.join(settings.IMAGE_ROOT, name))
+           for name in names.values()):
+        return digest
+
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    for (size, extension), name in names.items():
+        thumbnail = ImageOps.pad(image, THUMBNAIL_SIZES[size],
+                                 method=Image.LANCZOS, color='white')
+        image_format, content_type, options = FORMATS[extension]
+        path = os.path.join(settings.IMAGE_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        #written aside then renamed, so that a file is never served half written
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                         delete=False) as temporary:
+            try:
+                thumbnail.save(temporary, image_format, **options)
+            except Exception:
+                os.remove(temporary.name)
+                raise
+        os.replace(temporary.name, path)
+
+    return digest
+
+
+def _store_image(product, fetcher):
+    #Stores the image of a (pk, url) pair, and returns its digest, or None if it failed
+    pk, url = product
+    try:
+        return store_thumbnails(fetcher(url))
+    except Exception:
+        logger.warning("image of product #%s not stored: %s", pk, url,
+                       exc_info=True)
+        return None
+
+
+def _save_digests(digests):
+    #Saves the digests of stored images, by product id
+    #the pages and cards showing the products are cached until they change
+    now = timezone.now()
+    Product.objects.bulk_update([Product(pk=pk, image_hash=digest,
+                                         updated_at=now)
+                                 for pk, digest in digests.items()],
+                                ['image_hash', 'updated_at'])
+
+
+def process_images(products=None, fetcher=None, concurrency=4, batch_size=100):
+    '''
+    Downloads the images of the products missing their thumbnails, all of
+    them if products is None, with concurrency threads, stores their
+    thumbnails and saves their digests batch_size at a time, as downloads
+    finish, so that an interrupted run does not download them again.
+    Returns the numbers of stored and failed images.
+    '''
+
+    if products is None:
+        products = Product.objects.all()
+    fetcher = fetcher or HTTPFetcher(concurrency)
+
+    pending = list(products.filter(image_hash='')
+                           .exclude(image='')
+                           .order_by('pk')
+                           .values_list('pk', 'image'))
+    stored = 0
+    digests = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = executor.map(_store_image, pending, repeat(fetcher))
+        for (pk, url), digest in zip(pending, results):
+            if digest is None:
+                continue
+            digests[pk] = digest
+            if len(digests) >= batch_size:
+                _save_digests(digests)
+                stored += len(digests)
+                digests = {}
+    if digests:
+        _save_digests(digests)
+        stored += len(digests)
+
+    return stored, len(pending) - stored
+
+
+def has_thumbnail(product, size="small", extension="jpg"):
+    #Returns whether a thumbnail of the product is in the store
+    return bool(product.image_hash
+                and thumbnail_path(product.image_hash, size, extension))
+
+
+def thumbnail_url(product, size="small", extension="jpg"):
+    #Returns the url of a thumbnail of the product, or of its original image if not in the store
+    if not has_thumbnail(product, size, extension):
+        return product.image
+    return reverse("substituter:image",
+                   args=[product.image_hash, size, extension])
+
+
+def thumbnail_path(digest, size, extension):
+    #Returns the file of a thumbnail of the store, or None if there is no such thumbnail
+    if size not in THUMBNAIL_SIZES or extension not in FORMATS:
+        return None
+    path = os.path.join(settings.IMAGE_ROOT,
+                        thumbnail_name(digest, size, extension))
+    return path if os.path.exists(path) else None
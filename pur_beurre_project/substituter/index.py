@@ -0,0 +1,115 @@
+'''
+This module maintains the inverted index of the product names.
+Each name is folded (lowercased, accents removed) and split into tokens, and
+every suffix of each token is stored in the ProductToken table. Looking for
+the products whose name contains a given string thus becomes a prefix lookup
+on an indexed column, instead of a scan of the whole product table.
+'''
+
+import re
+import unicodedata
+
+from django.db import transaction
+
+from .models import Product, ProductToken
+
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def fold(text):
+    #Returns a lowercased version of text, stripped of its accents
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed
+                   if not unicodedata.combining(char)).lower()
+
+
+def tokenize(text):
+    #Returns the list of the folded words contained in text
+    return TOKEN_PATTERN.findall(fold(text))
+
+
+def normalize_words(input):
+    '''
+    Returns the normalized words of a list of words: each word is folded and
+    reduced to its tokens, and the words are deduplicated and sorted, since
+    neither their order nor their repetition changes the ranking.
+    '''
+
+    words = {' '.join(tokenize(word)) for word in input}
+    words.discard('')
+    return sorted(words)
+
+
+def fragments(text):
+    '''
+    Returns the set of every suffix of every token in text. A string is
+    contained in a token if and only if it is the prefix of one of its
+    suffixes.
+    '''
+
+    return {token[start:]
+            for token in tokenize(text)
+            for start in range(len(token))}
+
+
+def index_products(products):
+    '''
+    Replaces the index entries of the given products by entries computed
+    from their current names.
+    '''
+
+    products = list(products)
+    tokens = [ProductToken(product_id=product.pk, token=fragment)
+              for product in products
+              for fragment in fragments(product.name)]
+
+    with transaction.atomic():
+        ProductToken.objects.filter(
+            product_id__in=[product.pk for product in products]
+        ).delete()
+        ProductToken.objects.bulk_create(tokens)
+
+
+def rebuild_index(batch_size=1000):
+    '''
+    Rebuilds the whole index from the product table, batch_size products at
+    a time. Returns the number of indexed products.
+    '''
+
+    count = 0
+    batch = []
+
+    with transaction.atomic():
+        ProductToken.objects.all().delete()
+
+        for product in Product.objects.only('pk', 'name').iterator():
+            batch.append(product)
+            if len(batch) >= batch_size:
+                index_products(batch)
+                count += len(batch)
+                batch = []
+
+        if batch:
+            index_products(batch)
+            count += len(batch)
+
+    return count
+
+
+def matching_products(text):
+    '''
+    Returns a queryset of the products whose name contains every token of
+    text, or an empty queryset if text holds no token.
+    '''
+
+    tokens = tokenize(text)
+    if not tokens:
+        return Product.objects.none()
+
+    products = Product.objects.all()
+    for token in tokens:
+        products = products.filter(pk__in=ProductToken.objects
+                                   .filter(token__startswith=token)
+                                   .values('product_id'))
+    return products
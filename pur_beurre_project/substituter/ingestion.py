@@ -0,0 +1,306 @@
+'''
+This module writes the products obtained from openfoodfacts into the
+database. Raw products are validated and parsed as they are read, then
+written in batches of configurable size: the categories of a batch with a
+single insert, its products and their links to the categories in a single
+transaction. Categories are stored as canonical openfoodfacts tags, and
+each product is also linked to the known ancestors of its categories.
+'''
+
+from contextlib import contextmanager
+import hashlib
+import json
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from .index import index_products
+from .models import Product, Category, CategoryAncestor
+from .taxonomy import product_tags, tag_name
+
+
+accepted_categories = ["boissons", "petits_dejeuners",
+                       "produits_laitiers", "epicerie", "charcuteries"]
+
+REQUIRED_FIELDS = ["product_name", "nutrition_grades", "url", "generic_name",
+                   "image_url", "code"]
+
+NUTRIMENTS = {
+    "fats": "fat_100g",
+    "proteins": "proteins_100g",
+    "carbohydrates": "carbohydrates_100g",
+    "sugars": "sugars_100g",
+    "salt": "salt_100g",
+    "fibers": "fibers_100g",
+}
+
+PRODUCT_FIELDS = ["name", "grade", "link", "description", "image",
+                  "fats", "proteins", "carbohydrates", "sugars", "salt",
+                  "fibers", "last_modified_t", "content_hash"]
+
+
+class Timings:
+    '''
+    Accumulates the time spent in each phase of an ingestion run, in the
+    order in which the phases were first entered.
+    '''
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        #Adds the time spent in the with block to the named phase
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = (self.phases.get(name, 0)
+                                 + time.perf_counter() - start)
+
+    def summary(self):
+        #Returns one line per phase, then the total time of the run
+        lines = ["{}: {:.2f}s".format(name, duration)
+                 for name, duration in self.phases.items()]
+        lines.append("total: {:.2f}s".format(sum(self.phases.values())))
+        return lines
+
+
+def _to_float(value):
+    #Returns value as a float, or None if it is not a number
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def last_modified(product):
+    #Returns the last modification timestamp of a raw product, or None
+    try:
+        return int(product.get("last_modified_t"))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_product(product):
+    '''
+    Returns a dictionary of the product's fields, ready to be written into the
+    database, or None if the product misses one of the required fields or
+    has no category. The content hash covers every field but the
+    modification timestamp.
+    '''
+
+    if any(not product.get(field) for field in REQUIRED_FIELDS):
+        return None
+
+    barcode = str(product["code"]).strip()
+    if not barcode.isdigit():
+        return None
+
+    categories = product_tags(product)
+    if not categories:
+        return None
+
+    nutriments = product.get("nutriments") or {}
+
+    parsed = {
+        "barcode": int(barcode),
+        "name": product["product_name"][:100],
+        "grade": product["nutrition_grades"][:1],
+        "link": product["url"][:255],
+        "description": product["generic_name"][:255],
+        "image": product["image_url"][:255],
+        "categories": categories,
+    }
+    for field, key in NUTRIMENTS.items():
+        parsed[field] = _to_float(nutriments.get(key))
+
+    parsed["content_hash"] = hashlib.sha1(
+        json.dumps(parsed, sort_keys=True).encode()
+    ).hexdigest()
+    parsed["last_modified_t"] = last_modified(product)
+
+    return parsed
+
+
+def _chunks(items, size):
+    #Yields successive lists of at most size items
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def write_categories(tags, batch_size=500):
+    '''
+    Inserts the missing categories among tags with a single bulk insert,
+    then returns the list of the created tags and a dictionary mapping each
+    tag to the set of the ids of its category and of its ancestors.
+    '''
+
+    tags = sorted(set(tags))
+    existing = set()
+    for chunk in _chunks(tags, batch_size):
+        existing.update(Category.objects.filter(tag__in=chunk)
+                                        .values_list('tag', flat=True))
+
+    created = [tag for tag in tags if tag not in existing]
+    Category.objects.bulk_create([Category(tag=tag, name=tag_name(tag))
+                                  for tag in created],
+                                 batch_size=batch_size,
+                                 ignore_conflicts=True)
+
+    ids = {}
+    for chunk in _chunks(tags, batch_size):
+        ids.update(Category.objects.filter(tag__in=chunk)
+                                   .values_list('tag', 'id'))
+
+    ancestors = {pk: {pk} for pk in ids.values()}
+    for chunk in _chunks(list(ancestors), batch_size):
+        for pk, ancestor_id in (CategoryAncestor.objects
+                                .filter(category_id__in=chunk)
+                                .values_list('category_id', 'ancestor_id')):
+            ancestors[pk].add(ancestor_id)
+
+    return created, {tag: ancestors[pk] for tag, pk in ids.items()}
+
+
+def write_product_batch(batch, category_ids):
+    '''
+    Upserts a batch of parsed products, keyed on their barcode, and replaces
+    their links to the categories, category_ids mapping each tag to the ids
+    of the categories to link. Products whose content hash did not
+    change are left untouched. Returns the lists of the created, updated and
+    unchanged barcodes.
+    '''
+
+    barcodes = [parsed["barcode"] for parsed in batch]
+
+    with transaction.atomic():
+        existing = {barcode: (pk, content_hash, image, image_hash)
+                    for barcode, pk, content_hash, image, image_hash
+                    in Product.objects.filter(barcode__in=barcodes)
+                                      .values_list('barcode', 'pk',
+                                                   'content_hash', 'image',
+                                                   'image_hash')}
+
+        unchanged = [parsed["barcode"] for parsed in batch
+                     if parsed["barcode"] in existing
+                     and existing[parsed["barcode"]][1] == parsed["content_hash"]]
+        batch = [parsed for parsed in batch
+                 if parsed["barcode"] not in unchanged]
+        updated_pks = [existing[parsed["barcode"]][0] for parsed in batch
+                       if parsed["barcode"] in existing]
+
+        #bulk_update skips auto_now, so the write time is set explicitly
+        now = timezone.now()
+        to_create = []
+        to_update = []
+        for parsed in batch:
+            fields = {field: parsed[field] for field in PRODUCT_FIELDS}
+            if parsed["barcode"] in existing:
+                pk, content_hash, image, image_hash = existing[parsed["barcode"]]
+                #the downloaded image is kept as long as its url is the same
+                to_update.append(Product(pk=pk,
+                                         barcode=parsed["barcode"],
+                                         updated_at=now,
+                                         image_hash=(image_hash
+                                                     if image == parsed["image"]
+                                                     else ""),
+                                         **fields))
+            else:
+                to_create.append(Product(barcode=parsed["barcode"],
+                                         updated_at=now,
+                                         **fields))
+
+        Product.objects.bulk_create(to_create)
+        Product.objects.bulk_update(to_update,
+                                    PRODUCT_FIELDS + ["updated_at", "image_hash"])
+
+        pks = dict(Product.objects.filter(barcode__in=[parsed["barcode"]
+                                                       for parsed in batch])
+                                  .values_list('barcode', 'pk'))
+
+        through = Product.categories.through
+        through.objects.filter(product_id__in=updated_pks).delete()
+        links = {(pks[parsed["barcode"]], category_id)
+                 for parsed in batch
+                 for tag in parsed["categories"]
+                 for category_id in category_ids[tag]}
+        through.objects.bulk_create(
+            [through(product_id=product_id, category_id=category_id)
+             for product_id, category_id in links],
+            ignore_conflicts=True
+        )
+
+        index_products(Product(pk=pks[parsed["barcode"]], name=parsed["name"])
+                       for parsed in batch)
+
+    created = [parsed["barcode"] for parsed in batch
+               if parsed["barcode"] not in existing]
+    updated = [parsed["barcode"] for parsed in batch
+               if parsed["barcode"] in existing]
+    return created, updated, unchanged
+
+
+def timed(iterable, timings, name):
+    #Yields the items of iterable, adding the time spent waiting for them to the named phase
+    iterator = iter(iterable)
+    while True:
+        with timings.phase(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def write_batch(batch, timings, log):
+    #Writes a batch of parsed products with their categories, passing each log line to log
+    #Returns the number of created or updated products
+    with timings.phase("categories"):
+        created, category_ids = write_categories(
+            [tag for parsed in batch for tag in parsed["categories"]]
+        )
+        for tag in created:
+            log("category {} created".format(tag))
+
+    with timings.phase("products"):
+        created, updated, unchanged = write_product_batch(batch, category_ids)
+        for barcode in created:
+            log("product #{} created".format(barcode))
+        for barcode in updated:
+            log("product #{} updated".format(barcode))
+
+    return len(created) + len(updated)
+
+
+def write_products(products, batch_size=500, timings=None, log=None):
+    '''
+    Parses raw openfoodfacts products and writes the valid ones into the
+    database, batch_size products at a time, as they are read from the
+    products iterable, so that memory use does not depend on their number.
+    Each line describing a change is passed to the log function if given.
+    Returns the number of created or updated products, the unchanged ones
+    being skipped.
+    '''
+
+    timings = timings or Timings()
+    log = log or (lambda line: None)
+    count = 0
+    batch = {}
+
+    for product in products:
+        with timings.phase("parse"):
+            parsed = parse_product(product)
+        if not parsed:
+            continue
+
+        batch[parsed["barcode"]] = parsed
+        if len(batch) >= batch_size:
+            count += write_batch(list(batch.values()), timings, log)
+            batch = {}
+
+    if batch:
+        count += write_batch(list(batch.values()), timings, log)
+
+    return count
@@ -0,0 +1,90 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+'''This module benchmarks the search, autocomplete, detail and bookmarked
+views and the ingestion pipeline on synthetic catalogues.
+Run it using pipenv manage.py benchmark --sizes 10000 100000.
+'''
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+from datetime import datetime
+import json
+import platform
+import subprocess
+
+import django
+
+from substituter.benchmark import run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Measure the hot paths of the project on synthetic catalogues, in a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000],
+                            help='Number of products of each generated catalogue')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Number of measured requests per view')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the catalogue generator')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of products written per transaction')
+        parser.add_argument('--output',
+                            help='Path of the json file receiving the results')
+
+    def _commit(self):
+        #Returns the current git commit, if any
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'],
+                stderr=subprocess.DEVNULL
+            ).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def handle(self, *args, **options):
+        '''Creates a test database for each catalogue size, so that the real
+        data is never touched, and runs the benchmarks in it.
+        '''
+
+        report = {
+            "commit": self._commit(),
+            "date": datetime.now().isoformat(),
+            "database": connection.vendor,
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "results": {},
+        }
+
+        setup_test_environment(debug=False)
+        try:
+            for size in options['sizes']:
+                name = connection.creation.create_test_db(verbosity=0,
+                                                          autoclobber=True,
+                                                          serialize=False)
+                try:
+                    results = run_benchmarks(size,
+                                             repeat=options['repeat'],
+                                             seed=options['seed'],
+                                             batch_size=options['batch_size'])
+                finally:
+                    connection.creation.destroy_test_db(name, verbosity=0)
+
+                report["results"][size] = results
+                self.stdout.write('{} products'.format(size))
+                for path, measures in sorted(results.items()):
+                    self.stdout.write('  {}: {}'.format(
+                        path,
+                        ', '.join('{} {:.2f}'.format(key, value)
+                                  for key, value in measures.items()
+                                  if isinstance(value, (int, float)))
+                    ))
+        finally:
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as outfile:
+                json.dump(report, outfile, indent=2)
@@ -0,0 +1,25 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+'''This module rebuilds the inverted index of the product names.
+Run it using pipenv manage.py build_index.
+'''
+
+from django.core.management.base import BaseCommand
+
+from substituter.cache import bump_catalogue_version
+from substituter.index import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the inverted index of the product names'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of products indexed per batch')
+
+    def handle(self, *args, **options):
+        #Indexes every product of the database
+        count = rebuild_index(batch_size=options['batch_size'])
+        bump_catalogue_version()
+        self.stdout.write('{} products indexed'.format(count))
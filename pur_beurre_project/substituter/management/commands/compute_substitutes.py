@@ -0,0 +1,28 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+'''This module precomputes the substitutes of every product.
+Run it using pipenv manage.py compute_substitutes.
+'''
+
+from django.core.management.base import BaseCommand
+
+from substituter.cache import bump_catalogue_version
+from substituter.substitutes import SUBSTITUTE_LIMIT, compute_substitutes
+
+
+class Command(BaseCommand):
+    help = 'Precompute the substitutes of every product of the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=SUBSTITUTE_LIMIT,
+                            help='Number of substitutes stored per product')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of products computed per transaction')
+
+    def handle(self, *args, **options):
+        #Computes the substitutes of every product
+        count = compute_substitutes(limit=options['limit'],
+                                    batch_size=options['batch_size'])
+        bump_catalogue_version()
+        self.stdout.write('substitutes of {} products computed'.format(count))
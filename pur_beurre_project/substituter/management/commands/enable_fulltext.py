@@ -0,0 +1,29 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+'''This module adds the full-text column and indexes of the product names,
+when migration 0009 could not: on PostgreSQL 12 or later, with a role
+allowed to create the pg_trgm extension.
+Run it using pipenv manage.py enable_fulltext.
+'''
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from substituter.fulltext import (FulltextUnavailable, add_search_indexes,
+                                  check_version)
+
+
+class Command(BaseCommand):
+    help = 'Add the column and indexes of the PostgreSQL full-text search'
+
+    def handle(self, *args, **options):
+        #Adds the column and indexes, failing if the database does not allow it
+        try:
+            check_version(connection)
+            with connection.schema_editor() as schema_editor:
+                add_search_indexes(schema_editor)
+        except FulltextUnavailable as error:
+            raise CommandError(error)
+        self.stdout.write('full-text search enabled: set SEARCH_BACKEND to '
+                          'postgres and restart the web workers')
@@ -0,0 +1,23 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+'''This module stores the thumbnails of the product images missing them.
+Run it using pipenv manage.py fetch_images.
+'''
+
+from django.core.management.base import BaseCommand
+
+from substituter.images import process_images
+
+
+class Command(BaseCommand):
+    help = 'Download the missing product images and store their thumbnails'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Number of images downloaded in parallel')
+
+    def handle(self, *args, **options):
+        #Stores the thumbnails of every product missing them
+        stored, failed = process_images(concurrency=options['concurrency'])
+        self.stdout.write('{} images stored, {} failed'.format(stored, failed))
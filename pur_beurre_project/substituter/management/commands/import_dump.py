@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+'''This module inserts data from an openfoodfacts dump file into a database.
+Run it using pipenv manage.py import_dump <path>.
+'''
+
+from django.core.management.base import BaseCommand
+import time
+
+from substituter.cache import bump_catalogue_version
+from substituter.dumps import dump_format, open_dump, read_dump
+from substituter.ingestion import timed, Timings, write_products
+from substituter.substitutes import compute_substitutes
+
+
+class Command(BaseCommand):
+    help = 'Read an openfoodfacts JSONL or CSV dump file, possibly gzipped, and write it into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the dump file')
+        parser.add_argument('--format', choices=['jsonl', 'csv'],
+                            help='Format of the dump, guessed from its name by default')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of products written per transaction')
+        parser.add_argument('--progress', type=int, default=100000,
+                            help='Number of lines between two progress reports')
+        parser.add_argument('--skip-substitutes', action='store_true',
+                            help='Do not precompute the substitutes after the import')
+
+    def _count(self, lines, every):
+        #Yields the lines, reporting the reading speed every given number of lines
+        self.lines = 0
+        for line in lines:
+            self.lines += 1
+            if every and self.lines % every == 0:
+                self.stdout.write(self._speed())
+            yield line
+
+    def _speed(self):
+        #Returns the number of lines read so far and the number of lines per second
+        elapsed = time.perf_counter() - self.start
+        return '{} lines read ({:.0f} rows/s)'.format(
+            self.lines, self.lines / elapsed if elapsed else 0
+        )
+
+    def handle(self, *args, **options):
+        '''Streams the dump file, keeping the products of the accepted
+        categories, and writes them into the database in batches.
+        The substitutes of every product are then precomputed.
+        '''
+
+        timings = Timings()
+        path = options['path']
+        self.start = time.perf_counter()
+
+        with open_dump(path) as dump:
+            lines = self._count(dump, options['progress'])
+            products = read_dump(lines, options['format'] or dump_format(path))
+            count = write_products(timed(products, timings, "read"),
+                                   batch_size=options['batch_size'],
+                                   timings=timings)
+
+        self.stdout.write(self._speed())
+        self.stdout.write('{} products written'.format(count))
+
+        if count and not options['skip_substitutes']:
+            with timings.phase("substitutes"):
+                compute_substitutes()
+
+        if count:
+            bump_catalogue_version()
+
+        for line in timings.summary():
+            self.stdout.write(line)
@@ -0,0 +1,47 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+'''This module loads the openfoodfacts category taxonomy into a database.
+Run it using pipenv manage.py load_taxonomy [path or url].
+'''
+
+from django.core.management.base import BaseCommand
+import json
+
+import requests
+
+from substituter.cache import bump_catalogue_version
+from substituter.substitutes import compute_substitutes
+from substituter.taxonomy import TAXONOMY_URL, load_taxonomy, read_taxonomy
+
+
+class Command(BaseCommand):
+    help = 'Load the openfoodfacts category taxonomy: names, parents and ancestors of the categories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', default=TAXONOMY_URL,
+                            help='Path or url of the categories.json taxonomy')
+        parser.add_argument('--skip-substitutes', action='store_true',
+                            help='Do not precompute the substitutes after the load')
+
+    def handle(self, *args, **options):
+        '''Reads the taxonomy, writes its categories and their closure, then
+        precomputes the substitutes again, since the specificities changed.
+        '''
+        source = options['source']
+        if source.startswith(('http://', 'https://')):
+            response = requests.get(source, timeout=60)
+            response.raise_for_status()
+            data = response.json()
+        else:
+            with open(source, encoding='utf-8') as taxonomy:
+                data = json.load(taxonomy)
+
+        count = load_taxonomy(read_taxonomy(data))
+        self.stdout.write('{} categories loaded'.format(count))
+
+        if not options['skip_substitutes']:
+            count = compute_substitutes()
+            self.stdout.write('substitutes of {} products computed'.format(count))
+
+        bump_catalogue_version()
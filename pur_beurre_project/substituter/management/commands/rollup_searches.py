@@ -0,0 +1,41 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+'''This module rolls up the search logs by hour, and reports the top queries.
+Run it every hour using pipenv manage.py rollup_searches.
+'''
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from substituter.analytics import prune_searches, rollup_searches, top_queries
+
+
+class Command(BaseCommand):
+    help = 'Roll up the search logs by hour and report the top and zero-result queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24,
+                            help='Number of hours covered by the report')
+        parser.add_argument('--keep-days', type=int, default=30,
+                            help='Days of search logs kept after the rollup')
+
+    def handle(self, *args, **options):
+        '''Rolls up the complete hours, deletes the old logs, then reports the
+        most searched queries and those finding no product.
+        '''
+        now = timezone.now()
+        count = rollup_searches(now)
+        self.stdout.write('{} hours rolled up'.format(count))
+
+        count = prune_searches(now - timedelta(days=options['keep_days']))
+        self.stdout.write('{} search logs deleted'.format(count))
+
+        since = now - timedelta(hours=options['hours'])
+        for title, misses in [('top queries', False),
+                              ('zero-result queries', True)]:
+            self.stdout.write('{}:'.format(title))
+            for query, total in top_queries(since, misses=misses):
+                self.stdout.write('  {} {}'.format(total, query))
@@ -6,97 +6,141 @@ Run it using pipenv manage.py update_db.
 '''
 
 from django.core.management.base import BaseCommand
-from datetime import date, datetime
+from django.utils import timezone
+from datetime import date, datetime, timedelta
+from itertools import chain
 import json
 import os
 
-import requests
+from substituter.cache import bump_catalogue_version
+from substituter.fetching import SEARCH_URL, fetch_pages
+from substituter.images import process_images
+from substituter.ingestion import (accepted_categories, last_modified, timed,
+                                   Timings, write_products)
+from substituter.models import SyncCheckpoint
+from substituter.substitutes import compute_substitutes
+from substituter.warming import CacheNotShared, report_lines, warm_caches
 
-from substituter.models import Product, Category
 
+SYNC_SOURCE = 'api'
 
-accepted_categories = ["boissons", "petits_dejeuners",
-                       "produits_laitiers", "epicerie", "charcuteries"]
 
 class Command(BaseCommand):
     help = 'Download data from the openfoodfacts api and write it into the database'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of products written per transaction')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Number of pages downloaded in parallel')
+        parser.add_argument('--page-size', type=int, default=100,
+                            help='Number of products per downloaded page')
+        parser.add_argument('--max-pages', type=int, default=None,
+                            help='Maximum number of pages per category')
+        parser.add_argument('--retries', type=int, default=3,
+                            help='Number of retries of a failed download')
+        parser.add_argument('--backoff', type=float, default=0.5,
+                            help='Backoff factor between two retries, in seconds')
+        parser.add_argument('--api-url', default=SEARCH_URL,
+                            help='Url of the openfoodfacts search api')
+        parser.add_argument('--full', action='store_true',
+                            help='Ignore the sync checkpoint and fetch every product')
+        parser.add_argument('--images', action='store_true',
+                            help='Download the missing product images and store their thumbnails afterwards')
+        parser.add_argument('--warm', action='store_true',
+                            help='Warm the search cache with the popular queries afterwards')
+
+    def _track(self, products):
+        #Yields the products, keeping the most recent modification timestamp
+        for product in products:
+            modified = last_modified(product)
+            if modified and modified > (self.latest or 0):
+                self.latest = modified
+            yield product
+
     def handle(self, *args, **options):
         '''Requests the open food facts api and unpacks the obtained data
         Each valid product (that is, with existing name, grade and categories)
-        is added into the Products Table and linked to related Categories
+        is added into the Products Table and linked to related Categories.
+        Pages are written while the following ones are being downloaded.
+        Unless --full is given, only the products modified since the last
+        checkpoint are requested, and unchanged products are skipped.
+        The substitutes of every product are then precomputed if any
+        product was written, the thumbnails of the new images are stored if
+        --images is given, the search cache is warmed if --warm is given and
+        the cache is shared with the web workers, and the checkpoint is moved forward, unless --max-pages left pages
+        of a category unfetched.
         '''
 
-        data = []
+        timings = Timings()
+        checkpoint = SyncCheckpoint.objects.filter(source=SYNC_SOURCE).first()
+        since = None
+        if checkpoint and not options['full']:
+            since = checkpoint.last_modified_t
+        self.latest = since
+        cut = []
+
+        pages = fetch_pages(accepted_categories,
+                            url=options['api_url'],
+                            concurrency=options['concurrency'],
+                            page_size=options['page_size'],
+                            max_pages=options['max_pages'],
+                            retries=options['retries'],
+                            backoff=options['backoff'],
+                            since=since,
+                            cut=cut.append)
+        products = chain.from_iterable(timed(pages, timings, "fetch"))
 
-        results = {}
-        results['products'] = []
-
-        for category in accepted_categories:
-            url = '''https://fr.openfoodfacts.org/cgi/search.pl?action=process&tagtype_0=categories&tag_contains_0=contains&json=1&tag_0=''' + category
-            products = requests.get(url).json()["products"]
-
-            for product in products:
-                if "product_name" in product and "nutrition_grades" in product and "url" in product and "generic_name" in product and "image_url" in product and "code" in product:
-                    categories = [category.strip().lower() for category
-                                  in product["categories"].split(",")]
-                    barcode = product['code']
-                    name = product["product_name"]
-                    grade = product["nutrition_grades"]
-                    link = product["url"]
-                    description = product["generic_name"]
-                    image = product["image_url"]
-                    fats = None
-                    proteins = None
-                    carbohydrates = None
-                    sugars = None
-                    salt = None
-                    fibers = None
-
-                    if product["nutriments"]:
-
-                      if "fat_100g" in product["nutriments"]:
-                          fats = product["nutriments"]["fat_100g"]
-                      if "proteins_100g" in product["nutriments"]:
-                          proteins = product["nutriments"]["proteins_100g"]
-                      if "carbohydrates_100g" in product["nutriments"]:
-                          carbohydrates = product["nutriments"]["carbohydrates_100g"]
-                      if "sugars_100g" in product["nutriments"]:
-                          sugars = product["nutriments"]["sugars_100g"]
-                      if "salt_100g" in product["nutriments"]:
-                          salt = product["nutriments"]["salt_100g"]
-                      if "fibers_100g" in product["nutriments"]:
-                          fibers = product["nutriments"]["fibers_100g"]
-
-                    product, created = Product.objects.update_or_create(
-                                                     barcode=barcode,
-                                                     name=name,
-                                                     grade=grade,
-                                                     link=link, 
-                                                     description=description, 
-                                                     image=image, 
-                                                     fats=fats, 
-                                                     proteins=proteins, 
-                                                     carbohydrates=carbohydrates, 
-                                                     sugars=sugars, 
-                                                     salt=salt, 
-                                                     fibers=fibers
-                                                    )
-                    if created:
-                        data.append("product #{} created".format(barcode))
-                    else:
-                        data.append("product #{} updated".format(barcode))
-
-
-                    for category in categories:                    
-                        cat, created = Category.objects.update_or_create(name=category)
-                        product.categories.add(cat)
-                        if created:
-                            data.append("category {} created".format(category))
+        data = []
+        written = write_products(self._track(products),
+                                 batch_size=options['batch_size'],
+                                 timings=timings,
+                                 log=data.append)
+
+        if written:
+            with timings.phase("substitutes"):
+                count = compute_substitutes()
+                data.append("substitutes of {} products computed".format(count))
+            bump_catalogue_version()
+
+        if options['images']:
+            with timings.phase("images"):
+                stored, failed = process_images(
+                    concurrency=options['concurrency'],
+                    batch_size=options['batch_size']
+                )
+            data.append("{} images stored, {} failed".format(stored, failed))
+
+        if options['warm']:
+            try:
+                with timings.phase("warm"):
+                    report = warm_caches(timezone.now() - timedelta(days=7))
+            except CacheNotShared as error:
+                self.stderr.write("search cache not warmed: {}".format(error))
+                data.append("search cache not warmed")
+            else:
+                for line in report_lines(report):
+                    self.stdout.write(line)
+                    data.append(line)
+
+        #the products of the pages left by --max-pages are older than the
+        #latest one seen, and would never be requested again
+        if cut:
+            data.append("checkpoint kept: pages of {} not fetched"
+                        .format(", ".join(cut)))
+        elif self.latest:
+            SyncCheckpoint.objects.update_or_create(
+                source=SYNC_SOURCE,
+                defaults={'last_modified_t': self.latest}
+            )
+            data.append("checkpoint set to {}".format(self.latest))
+
+        for line in timings.summary():
+            self.stdout.write(line)
+            data.append(line)
 
         with open('{}/update_log_{}.json'.format(os.environ.get('LOGS_PATH'),date.today()), 'w') as outfile:
             outfile.write(str(datetime.now()))
             for line in data:
                 outfile.write('\n') 
                 json.dump(line, outfile) 
-
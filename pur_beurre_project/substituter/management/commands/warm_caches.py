@@ -0,0 +1,43 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+'''This module fills the search cache with the results of the popular queries.
+Run it using pipenv manage.py warm_caches, with a cache backend shared by
+the web workers.
+'''
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from substituter.warming import (CacheNotShared, SEED_PATH, report_lines,
+                                 warm_caches)
+
+
+class Command(BaseCommand):
+    help = 'Precompute the results of the most frequent recent queries into the search cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=500,
+                            help='Number of queries warmed')
+        parser.add_argument('--days', type=int, default=7,
+                            help='Days of search logs the popular queries are read from')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Number of queries searched in parallel')
+        parser.add_argument('--seed', default=SEED_PATH,
+                            help='File of the queries warmed while no search is logged')
+
+    def handle(self, *args, **options):
+        #Warms the popular queries, then reports the coverage and time spent
+        try:
+            report = warm_caches(
+                timezone.now() - timedelta(days=options['days']),
+                limit=options['limit'],
+                concurrency=options['concurrency'],
+                seed_path=options['seed']
+            )
+        except CacheNotShared as error:
+            raise CommandError(error)
+        for line in report_lines(report):
+            self.stdout.write(line)
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substituter', '0004_product_barcode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(db_index=True, max_length=100)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens', to='substituter.Product')),
+            ],
+        ),
+    ]
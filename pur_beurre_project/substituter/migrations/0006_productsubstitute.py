@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substituter', '0005_producttoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='substitutes_computed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='ProductSubstitute',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField()),
+                ('rank', models.PositiveIntegerField()),
+                ('base', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='substitutes', to='substituter.Product')),
+                ('substitute', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='substituter.Product')),
+            ],
+            options={
+                'unique_together': {('base', 'rank')},
+            },
+        ),
+    ]
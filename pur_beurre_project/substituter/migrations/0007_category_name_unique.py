@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+def merge_duplicate_categories(apps, schema_editor):
+    #Links the products of duplicate categories to the first one, then deletes the duplicates
+    Category = apps.get_model('substituter', 'Category')
+    Product = apps.get_model('substituter', 'Product')
+    through = Product.categories.through
+
+    kept = {}
+    for category in Category.objects.order_by('pk'):
+        if category.name not in kept:
+            kept[category.name] = category.pk
+            continue
+        for link in through.objects.filter(category_id=category.pk):
+            through.objects.get_or_create(product_id=link.product_id,
+                                          category_id=kept[category.name])
+        category.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substituter', '0006_productsubstitute'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_categories,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+    ]
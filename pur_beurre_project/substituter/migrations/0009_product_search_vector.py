@@ -0,0 +1,31 @@
+from django.db import migrations
+
+from substituter import fulltext
+
+
+# The full-text column and indexes need PostgreSQL 12 or later and the
+# pg_trgm extension: where they are missing, nothing is added, and
+# manage.py enable_fulltext adds them once available.
+
+def add_search_indexes(apps, schema_editor):
+    #Adds the full-text and trigram indexes of the product names, if the database allows it
+    try:
+        fulltext.add_search_indexes(schema_editor)
+    except fulltext.FulltextUnavailable:
+        pass
+
+
+def remove_search_indexes(apps, schema_editor):
+    #Removes the full-text and trigram indexes of the product names
+    fulltext.remove_search_indexes(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substituter', '0008_delta_sync'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_indexes, remove_search_indexes),
+    ]
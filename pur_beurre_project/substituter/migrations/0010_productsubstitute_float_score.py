@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substituter', '0009_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productsubstitute',
+            name='score',
+            field=models.FloatField(),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+import re
+import unicodedata
+
+
+def to_tag(name):
+    #Returns the canonical tag of a category name, as substituter.taxonomy does
+    name = name.strip().lower()
+    language = 'fr'
+    match = re.match(r'^([a-z]{2,3}):(.*)$', name)
+    if match:
+        language, name = match.groups()
+    decomposed = unicodedata.normalize('NFKD', name)
+    folded = ''.join(char for char in decomposed
+                     if not unicodedata.combining(char))
+    words = re.sub(r'[\W_]+', '-', folded).strip('-')
+    return '{}:{}'.format(language, words)[:100] if words else None
+
+
+def canonicalize_categories(apps, schema_editor):
+    '''
+    Tags the existing categories, linking the products of the categories
+    sharing a tag to the first one, then deleting the others.
+    '''
+    Category = apps.get_model('substituter', 'Category')
+    Product = apps.get_model('substituter', 'Product')
+    through = Product.categories.through
+
+    kept = {}
+    for category in Category.objects.order_by('pk'):
+        tag = to_tag(category.name)
+        if tag not in kept:
+            kept[tag] = category.pk
+            category.tag = tag
+            category.save()
+            continue
+        for link in through.objects.filter(category_id=category.pk):
+            through.objects.get_or_create(product_id=link.product_id,
+                                          category_id=kept[tag])
+        category.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substituter', '0010_productsubstitute_float_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='parents',
+            field=models.ManyToManyField(related_name='children', to='substituter.Category'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='specificity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='tag',
+            field=models.CharField(max_length=100, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.RunPython(canonicalize_categories,
+                             migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='CategoryAncestor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='substituter.Category')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='substituter.Category')),
+            ],
+            options={
+                'unique_together': {('category', 'ancestor')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substituter', '0012_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('query', models.CharField(max_length=255)),
+                ('searches', models.PositiveIntegerField()),
+                ('misses', models.PositiveIntegerField()),
+            ],
+            options={
+                'unique_together': {('hour', 'query')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=255)),
+                ('hit', models.BooleanField()),
+                ('duration_ms', models.FloatField()),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('product', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='substituter.Product')),
+            ],
+        ),
+    ]
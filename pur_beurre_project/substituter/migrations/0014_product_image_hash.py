@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substituter', '0013_search_analytics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
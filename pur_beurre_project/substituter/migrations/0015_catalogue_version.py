@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:12
+
+import uuid
+
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    CatalogueVersion = apps.get_model('substituter', 'CatalogueVersion')
+    CatalogueVersion.objects.using(schema_editor.connection.alias).create(
+        pk=1, version=uuid.uuid4().hex
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substituter', '0014_product_image_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogueVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(max_length=32)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substituter', '0015_catalogue_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='substitutes_complete',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -6,8 +6,36 @@ This file contains the models for the products and their categories.
 from django.db import models
 
 class Category(models.Model):
-    #Category model is simply a name
-    name = models.CharField(max_length=50)
+    '''
+    Categories are identified by their canonical openfoodfacts tag, such as
+    "en:beverages", and named for display. They form a taxonomy through
+    their parents; specificity is the number of categories from the root of
+    the taxonomy down to this one, and weights the shared categories when
+    matching substitutes.
+    '''
+    tag = models.CharField(max_length=100, unique=True, null=True)
+    name = models.CharField(max_length=100)
+    parents = models.ManyToManyField('self',
+                                     symmetrical=False,
+                                     related_name='children')
+    specificity = models.PositiveIntegerField(default=1)
+
+class CategoryAncestor(models.Model):
+    '''
+    The category ancestor model is the closure of the taxonomy: each
+    category is linked to itself and to all of its ancestors, along with
+    their distance.
+    '''
+    category = models.ForeignKey(Category,
+                                 on_delete=models.CASCADE,
+                                 related_name='ancestor_links')
+    ancestor = models.ForeignKey(Category,
+                                 on_delete=models.CASCADE,
+                                 related_name='descendant_links')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('category', 'ancestor')
 
 class Product(models.Model):
     '''
@@ -15,6 +43,13 @@ class Product(models.Model):
     description and image to work. Six optional fields contain the nutritional
     informations about the product.
     Finally, each product is linked to at least one category.
+    substitutes_computed tells whether the product's substitutes were
+    precomputed in the ProductSubstitute table, and substitutes_complete
+    whether every candidate was stored there. last_modified_t and
+    content_hash come from the last synchronization with OFF, and updated_at
+    is the last time the product was written, which validates its pages.
+    image_hash is the digest of the downloaded image, naming its thumbnails
+    in the local image store, and is empty until the image is downloaded.
     '''
     barcode = models.BigIntegerField(unique=True, null=True)
     name = models.CharField(max_length=100)
@@ -28,4 +63,90 @@ class Product(models.Model):
     fats = models.FloatField(null=True)
     proteins = models.FloatField(null=True)
     fibers = models.FloatField(null=True)
-    categories = models.ManyToManyField(Category)
\ No newline at end of file
+    categories = models.ManyToManyField(Category)
+    substitutes_computed = models.BooleanField(default=False)
+    substitutes_complete = models.BooleanField(default=False)
+    last_modified_t = models.BigIntegerField(null=True)
+    content_hash = models.CharField(max_length=40, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    image_hash = models.CharField(max_length=64, blank=True)
+
+class SyncCheckpoint(models.Model):
+    '''
+    The sync checkpoint model stores, for each source of products, the most
+    recent modification timestamp seen by a complete synchronization.
+    '''
+    source = models.CharField(max_length=50, unique=True)
+    last_modified_t = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class CatalogueVersion(models.Model):
+    '''
+    The catalogue version model holds a single row, whose version is
+    changed whenever products are written. Every process reads it from
+    there, so that all of them invalidate their caches and indexes.
+    '''
+    version = models.CharField(max_length=32)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ProductToken(models.Model):
+    '''
+    The product token model is the inverted index of the product names.
+    Each row links a product to a suffix of one of the folded words of its
+    name, so that substring lookups can use the index on token.
+    '''
+    token = models.CharField(max_length=100, db_index=True)
+    product = models.ForeignKey(Product,
+                                on_delete=models.CASCADE,
+                                related_name='tokens')
+
+
+class ProductSubstitute(models.Model):
+    '''
+    The product substitute model stores the precomputed substitutes of a base
+    product, along with their score: the category overlap plus the
+    nutritional score. Rank starts at 0 for the best substitute.
+    '''
+    base = models.ForeignKey(Product,
+                             on_delete=models.CASCADE,
+                             related_name='substitutes')
+    substitute = models.ForeignKey(Product,
+                                   on_delete=models.CASCADE,
+                                   related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('base', 'rank')
+
+
+class SearchLog(models.Model):
+    '''
+    The search log model stores each search made on the site: the query as
+    typed, whether a product was found (hit) and which one, and the time
+    taken to answer. Logs are written in batches by the analytics flusher.
+    '''
+    query = models.CharField(max_length=255)
+    hit = models.BooleanField()
+    product = models.ForeignKey(Product,
+                                on_delete=models.SET_NULL,
+                                null=True,
+                                related_name='+')
+    duration_ms = models.FloatField()
+    created_at = models.DateTimeField(db_index=True)
+
+
+class SearchRollup(models.Model):
+    '''
+    The search rollup model counts, for each hour, the searches of each
+    normalized query and how many of them found no product.
+    '''
+    hour = models.DateTimeField()
+    query = models.CharField(max_length=255)
+    searches = models.PositiveIntegerField()
+    misses = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('hour', 'query')
@@ -0,0 +1,112 @@
+'''
+This module scores the substitutes of a product on their nutriments.
+Nutriments are held in NumPy arrays, the missing ones being NaN, so that
+all the candidates of a product are scored in a single vectorized pass.
+The score adds the similarity of the nutriments with the base product to a
+health bonus, rewarding better grades and less salt, sugars and fats. It
+always stays below 1, so that it only orders the candidates sharing the
+same number of categories with the base product.
+'''
+
+import numpy as np
+
+from .models import Product
+
+
+FIELDS = ['salt', 'sugars', 'fats', 'carbohydrates', 'proteins', 'fibers']
+
+# Reference intakes of an adult, in grams: nutriments are compared as
+# fractions of them, a gram of salt weighing more than a gram of sugars.
+REFERENCE_INTAKES = np.array([6, 90, 70, 260, 50, 25], dtype=float)
+
+# 1 when less of the nutriment is healthier, -1 when more is
+HEALTH_SIGNS = np.array([1, 1, 1, 0, -1, -1], dtype=float)
+
+GRADE_CODES = {grade: code for code, grade in enumerate('abcde')}
+
+SIMILARITY_WEIGHT = 0.5
+HEALTH_WEIGHT = 0.45
+
+
+def grade_codes(grades):
+    #Returns the array of the codes of grades, from 0 for "a", NaN if unknown
+    return np.array([GRADE_CODES.get(grade, np.nan) for grade in grades],
+                    dtype=float)
+
+
+def nutriment_array(rows):
+    #Returns the matrix of the nutriments in rows, None becoming NaN
+    return np.array(rows, dtype=float).reshape(-1, len(FIELDS))
+
+
+def product_arrays(products):
+    #Returns the nutriment matrix and the grade codes of a list of products
+    return (nutriment_array([[getattr(product, field) for field in FIELDS]
+                             for product in products]),
+            grade_codes(product.grade for product in products))
+
+
+def nutrition_scores(base_values, base_grade, values, grades):
+    '''
+    Returns the nutritional score of each candidate described by a row of
+    values and a grade code, compared to the base product. Nutriments
+    missing on either side are left out of the comparison, and a candidate
+    sharing no known nutriment with the base product gets an average
+    similarity.
+    '''
+
+    difference = (values - base_values) / REFERENCE_INTAKES
+    known = ~np.isnan(difference)
+    difference = np.where(known, difference, 0)
+
+    counts = known.sum(axis=1)
+    distance = np.sqrt((difference ** 2).sum(axis=1) / np.maximum(counts, 1))
+    similarity = np.where(counts > 0, 1 / (1 + distance), 0.5)
+
+    nutriment_gain = np.tanh(-(difference * HEALTH_SIGNS).sum(axis=1))
+    grade_gain = np.nan_to_num((base_grade - grades) / 4)
+    health = (nutriment_gain + grade_gain) / 2
+
+    return SIMILARITY_WEIGHT * similarity + HEALTH_WEIGHT * (health + 1) / 2
+
+
+def ranking_order(scores, pks):
+    #Returns the positions of the candidates from best to worst score, then latest id
+    return np.lexsort((-np.asarray(pks), -np.asarray(scores)))
+
+
+class NutrimentMatrix:
+    '''
+    Nutriments and grades of a set of products, built from rows of
+    (pk, grade, *FIELDS) ordered by pk.
+    '''
+
+    def __init__(self, rows):
+        rows = list(rows)
+        self.pks = np.array([row[0] for row in rows], dtype=np.int64)
+        self.grades = grade_codes(row[1] for row in rows)
+        self.values = nutriment_array([row[2:] for row in rows])
+
+    def _rows(self, pks):
+        #Returns the nutriments and grade codes of pks, NaN for unknown products
+        pks = np.asarray(pks, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.pks, pks),
+                               max(len(self.pks) - 1, 0))
+        if not len(self.pks):
+            return (np.full((len(pks), len(FIELDS)), np.nan),
+                    np.full(len(pks), np.nan))
+        found = self.pks[positions] == pks
+        return (np.where(found[:, None], self.values[positions], np.nan),
+                np.where(found, self.grades[positions], np.nan))
+
+    def scores(self, base_pk, pks):
+        #Returns the nutritional scores of the products pks as substitutes of base_pk
+        base_values, base_grade = self._rows([base_pk])
+        values, grades = self._rows(pks)
+        return nutrition_scores(base_values[0], base_grade[0], values, grades)
+
+
+def load_matrix():
+    #Builds the nutriment matrix of every product of the database
+    return NutrimentMatrix(Product.objects.order_by('pk')
+                                          .values_list('pk', 'grade', *FIELDS))
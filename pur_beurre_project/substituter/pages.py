@@ -0,0 +1,84 @@
+'''
+This module caches the pages rendered the same for every anonymous visitor.
+Their content is stored in the shared cache, under a key built from the
+path of the page and the time its content last changed, when known, and
+served with Cache-Control, ETag and Last-Modified headers, so that browsers
+and proxies holding a valid copy get a 304 answer. Authenticated users,
+whose pages show their account, always get a freshly rendered private page.
+'''
+
+from calendar import timegm
+from functools import wraps
+import hashlib
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers
+)
+from django.utils.http import http_date, quote_etag
+
+from .cache import get_cache
+
+
+def page_key(request, updated_at):
+    #Returns the cache key of a page, which changes with its content
+    stamp = updated_at.isoformat() if updated_at else ''
+    digest = hashlib.sha1('{}:{}'.format(request.get_full_path(),
+                                         stamp).encode()).hexdigest()
+    return 'page:{}'.format(digest)
+
+
+def anonymous_page(updated_at=None):
+    '''
+    Decorates a view whose page is the same for every anonymous visitor.
+    updated_at(request, *args, **kwargs) returns the last time the content
+    of the page changed, or None if the page does not exist, in which case
+    the view answers. Pages without updated_at are only rendered again once
+    their cache entry expires, after PAGE_CACHE_TIMEOUT seconds.
+    '''
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            if request.user.is_authenticated:
+                response = view(request, *args, **kwargs)
+                patch_cache_control(response, private=True)
+                patch_vary_headers(response, ['Cookie'])
+                return response
+
+            changed = None
+            if updated_at is not None:
+                changed = updated_at(request, *args, **kwargs)
+                if changed is None:
+                    return view(request, *args, **kwargs)
+
+            key = page_key(request, changed)
+            cached = get_cache().get(key)
+            if cached is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200 or response.streaming:
+                    return response
+                cached = (response.content, response['Content-Type'],
+                          hashlib.sha1(response.content).hexdigest())
+                get_cache().set(key, cached, settings.PAGE_CACHE_TIMEOUT)
+
+            content, content_type, etag = cached
+            response = HttpResponse(content, content_type=content_type)
+            response['ETag'] = quote_etag(etag)
+            last_modified = changed and timegm(changed.utctimetuple())
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, public=True,
+                                max_age=settings.PAGE_MAX_AGE)
+            patch_vary_headers(response, ['Cookie'])
+
+            return get_conditional_response(request,
+                                            etag=response['ETag'],
+                                            last_modified=last_modified,
+                                            response=response)
+        return wrapper
+    return decorator
@@ -0,0 +1,141 @@
+'''
+This module contains the ranking engine used by the research feature.
+Products are scored according to the number of words they match, and the
+whole scoring is done by the database in a single aggregated query.
+On PostgreSQL, the names can also be ranked by the full-text search engine
+of the database, selected with the SEARCH_BACKEND setting, once its column
+and indexes are added (see the fulltext module).
+'''
+
+from functools import reduce
+from operator import mul, or_
+
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVectorField, TrigramSimilarity
+)
+from django.db import connection
+from django.db.models import (
+    Case, F, FloatField, IntegerField, Max, Q, Sum, Value, When
+)
+from django.db.models.expressions import RawSQL
+
+from .fulltext import has_search_vector
+from .index import normalize_words
+from .models import Product
+
+
+FULLTEXT_CONFIG = 'french'
+
+def _no_products():
+    #Returns an empty queryset, annotated like the rankings
+    return Product.objects.annotate(
+        score=Value(0, output_field=IntegerField())
+    ).none()
+
+
+def rank_by_name(input):
+    '''
+    Returns a queryset of the products whose name contains at least one of
+    the words in input, annotated with a score equal to the number of
+    matching words. Products are sorted from most to least matching words.
+    The lookups go through the inverted index of the product names: a word
+    matches when every one of its folded tokens is found in the name.
+    '''
+
+    words = [word.split() for word in normalize_words(input)]
+    if not words:
+        return _no_products()
+
+    tokens = list(dict.fromkeys(token for word in words for token in word))
+
+    matching = Q()
+    for token in tokens:
+        matching |= Q(tokens__token__startswith=token)
+
+    found = {
+        'found_{}'.format(number): Max(Case(
+            When(tokens__token__startswith=token, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField()
+        ))
+        for number, token in enumerate(tokens)
+    }
+
+    score = sum(reduce(mul, (F('found_{}'.format(tokens.index(token)))
+                             for token in word))
+                for word in words)
+
+    return (Product.objects
+            .filter(matching)
+            .annotate(**found)
+            .annotate(score=score)
+            .filter(score__gt=0)
+            .order_by('-score', '-pk'))
+
+
+def _search_vector():
+    #Returns the tsvector column of the product names, added by the fulltext module
+    return RawSQL('"{}"."search_vector"'.format(Product._meta.db_table), [],
+                  output_field=SearchVectorField())
+
+
+def rank_by_fulltext(input):
+    '''
+    Returns a queryset of the products whose name matches at least one of
+    the words in input once stemmed by the french configuration of
+    PostgreSQL, scored by ts_rank plus one, followed by the products whose
+    name is close to the words by trigram similarity, scored by their
+    similarity, so that typos are tolerated. Both are selected by a single
+    query. Only available on PostgreSQL.
+    '''
+
+    words = normalize_words(input)
+    if not words:
+        return _no_products()
+
+    query = reduce(or_, (SearchQuery(word, config=FULLTEXT_CONFIG)
+                         for word in words))
+    text = ' '.join(words)
+    return (Product.objects
+            .annotate(search_vector=_search_vector())
+            .filter(Q(search_vector=query) | Q(name__trigram_similar=text))
+            .annotate(score=Case(
+                When(search_vector=query,
+                     then=SearchRank(F('search_vector'), query)
+                     + Value(1.0, output_field=FloatField())),
+                default=TrigramSimilarity('name', text),
+                output_field=FloatField()
+            ))
+            .order_by('-score', '-pk'))
+
+
+def search_products(input):
+    '''
+    Returns the ranking of the products by name used by the research
+    feature: the full-text ranking when SEARCH_BACKEND is "postgres" and the
+    database is PostgreSQL with the full-text column, the ranking through
+    the inverted index otherwise.
+    '''
+
+    if (settings.SEARCH_BACKEND == 'postgres'
+            and connection.vendor == 'postgresql'
+            and has_search_vector()):
+        return rank_by_fulltext(input)
+    return rank_by_name(input)
+
+
+def rank_by_categories(category_ids):
+    '''
+    Returns a queryset of the products linked to at least one of the given
+    categories. Each shared category adds its specificity to the product's
+    score, the products being sorted from highest to lowest score.
+    '''
+
+    if not category_ids:
+        return _no_products()
+
+    return (Product.objects
+            .filter(categories__in=category_ids)
+            .annotate(score=Sum('categories__specificity'))
+            .order_by('-score', '-pk'))
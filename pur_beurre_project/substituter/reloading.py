@@ -0,0 +1,62 @@
+'''
+This module keeps the in-memory indexes of a worker up to date.
+An index is built by the first request needing it, then rebuilt whenever
+the version of the catalogue changes. Rebuilds run in a background thread,
+the previous index being served until the new one replaces it, so that no
+request waits for the whole catalogue to be read. Callers inside a
+transaction rebuild the index themselves, since another thread would not
+see the rows they have not committed yet.
+'''
+
+import logging
+import threading
+
+from django.db import connection, connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReloadedIndex:
+    #Holds the index built by load() for a version of the catalogue
+
+    def __init__(self, load):
+        self.load = load
+        self.state = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def get(self, version, wait=False):
+        '''
+        Returns the index, built for version unless a background rebuild
+        is still running, in which case the previous index is returned.
+        The index is built before returning if wait, or if there is none yet.
+        '''
+
+        state = self.state
+        if state is not None and state[1] == version:
+            return state[0]
+
+        if state is None or wait or connection.in_atomic_block:
+            with self.lock:
+                if self.state is None or self.state[1] != version:
+                    self.state = (self.load(), version)
+                return self.state[0]
+
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._rebuild,
+                                               args=(version,),
+                                               name="index-reload",
+                                               daemon=True)
+                self.thread.start()
+        return state[0]
+
+    def _rebuild(self, version):
+        #Builds the index for version and swaps it in, logging the failures
+        try:
+            self.state = (self.load(), version)
+        except Exception:
+            logger.exception("index not rebuilt")
+        finally:
+            connections.close_all()
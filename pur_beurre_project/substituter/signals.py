@@ -0,0 +1,20 @@
+'''
+This file contains the signal receivers keeping the product name index up
+to date when a product is saved outside of the update_db command. The
+cached results and the in-memory indexes are not invalidated on each save:
+the code writing products calls bump_catalogue_version once it is done, as
+the management commands do.
+'''
+
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .index import index_products
+from .models import Product
+
+
+@receiver(post_save, sender=Product)
+def update_product_tokens(sender, instance, update_fields=None, **kwargs):
+    #Reindexes a product's name whenever it may have changed
+    if update_fields is None or 'name' in update_fields:
+        index_products([instance])
@@ -0,0 +1,266 @@
+'''
+This module computes the substitutes of the products.
+Substitutes are the products of better grade sharing the most specific
+categories with a base product, the candidates scoring the same being
+ordered by their nutritional score. The candidates are selected from the
+in-memory category index when available, by the database otherwise.
+Substitutes are precomputed in bulk by the update_db and
+compute_substitutes commands, and computed live for the products that are
+missing from the ProductSubstitute table, or beyond its rows when they do
+not hold every candidate.
+'''
+
+import numpy as np
+
+from django.db import transaction
+from django.db.models import Q
+
+from .categories import get_category_index, load_category_index
+from .models import Product, ProductSubstitute
+from .nutrition import (
+    FIELDS, NutrimentMatrix, load_matrix, nutrition_scores, product_arrays,
+    ranking_order
+)
+from .ranking import rank_by_categories
+
+
+SUBSTITUTE_LIMIT = 50
+
+CANDIDATE_LIMIT = 500
+
+QUERY_BATCH_SIZE = 500
+
+
+def find_substitutes(product):
+    '''
+    Returns a queryset of the products of better grade than product, sorted
+    from most to least specific shared categories.
+    '''
+
+    category_ids = [category.pk for category in product.categories.all()]
+
+    return rank_by_categories(category_ids).filter(grade__lt=product.grade)
+
+
+def substitute_candidates(product, index=None, limit=CANDIDATE_LIMIT):
+    '''
+    Returns the ids of the limit products of better grade sharing the most
+    categories with product and their category scores, as two arrays
+    sorted like find_substitutes. Candidates are read from index when given,
+    from the database otherwise.
+    '''
+
+    if index is not None:
+        return index.candidates([category.pk
+                                 for category in product.categories.all()],
+                                product.grade,
+                                limit)
+
+    ranking = np.array(find_substitutes(product)
+                       .values_list('pk', 'score')[:limit],
+                       dtype=float).reshape(-1, 2)
+    return ranking[:, 0].astype(np.int64), ranking[:, 1]
+
+
+def _live_substitutes(product, limit):
+    #Returns the list of the limit best substitutes of product, ranked live
+    pks, scores = substitute_candidates(product, get_category_index())
+    products = Product.objects.in_bulk(pks.tolist())
+    candidates = [products[pk] for pk in pks.tolist() if pk in products]
+    scores = scores[[pk in products for pk in pks.tolist()]]
+
+    base_values, base_grades = product_arrays([product])
+    values, grades = product_arrays(candidates)
+    scores = scores + nutrition_scores(base_values[0], base_grades[0],
+                                       values, grades)
+    order = ranking_order(scores, [candidate.pk for candidate in candidates])
+    return [candidates[position] for position in order[:limit]]
+
+
+def get_substitutes(product, limit=6):
+    '''
+    Returns the list of the limit best substitutes of product, reading the
+    precomputed table when the product was computed.
+    '''
+
+    if not product.substitutes_computed:
+        return _live_substitutes(product, limit)
+
+    return [row.substitute
+            for row in ProductSubstitute.objects
+                                         .filter(base=product)
+                                         .select_related('substitute')
+                                         .order_by('rank')[:limit]]
+
+
+def substitutes_of(products, limit=6):
+    '''
+    Returns a dictionary mapping the id of each of products, whose
+    categories should be prefetched, to the list of its limit best
+    substitutes, ranked like get_substitutes. The precomputed substitutes
+    are read in a single query; the candidates of the other products are
+    selected from the shared category index, and their nutriments then
+    their rows fetched with one query per QUERY_BATCH_SIZE products, however
+    many products share them.
+    '''
+
+    computed = [product.pk for product in products
+                if product.substitutes_computed]
+    live = [product for product in products
+            if not product.substitutes_computed]
+    substitutes = {pk: [] for pk in computed}
+
+    if computed:
+        for row in (ProductSubstitute.objects
+                    .filter(base_id__in=computed, rank__lt=limit)
+                    .select_related('substitute')
+                    .order_by('base_id', 'rank')):
+            substitutes[row.base_id].append(row.substitute)
+
+    if not live:
+        return substitutes
+
+    index = get_category_index()
+    candidates = {product.pk: substitute_candidates(product, index)
+                  for product in live}
+    pks = sorted({pk for product_pks, scores in candidates.values()
+                  for pk in product_pks.tolist()}
+                 | {product.pk for product in live})
+    matrix = NutrimentMatrix(
+        row
+        for start in range(0, len(pks), QUERY_BATCH_SIZE)
+        for row in Product.objects.filter(
+            pk__in=pks[start:start + QUERY_BATCH_SIZE]
+        ).order_by('pk').values_list('pk', 'grade', *FIELDS)
+    )
+
+    chosen = {}
+    for product in live:
+        product_pks, scores = candidates[product.pk]
+        found = np.isin(product_pks, matrix.pks)
+        product_pks, scores = product_pks[found], scores[found]
+        scores = scores + matrix.scores(product.pk, product_pks)
+        chosen[product.pk] = product_pks[
+            ranking_order(scores, product_pks)[:limit]
+        ].tolist()
+
+    pks = sorted({pk for product_pks in chosen.values() for pk in product_pks})
+    rows = Product.objects.in_bulk(pks)
+    for product in live:
+        substitutes[product.pk] = [rows[pk] for pk in chosen[product.pk]
+                                   if pk in rows]
+    return substitutes
+
+
+def _live_ranking(product):
+    '''
+    Returns the ids of the substitute candidates of product and their
+    scores, as two arrays sorted from best to worst, ranked live from their
+    nutriments only.
+    '''
+
+    pks, scores = substitute_candidates(product, get_category_index())
+    matrix = NutrimentMatrix(
+        Product.objects.filter(pk__in=pks.tolist() + [product.pk])
+                       .order_by('pk')
+                       .values_list('pk', 'grade', *FIELDS)
+    )
+    found = np.isin(pks, matrix.pks)
+    pks, scores = pks[found], scores[found]
+    scores = scores + matrix.scores(product.pk, pks)
+    order = ranking_order(scores, pks)
+    return pks[order], scores[order]
+
+
+def substitute_page(product, after=None, limit=20):
+    '''
+    Returns at most limit substitutes of product ranked after the
+    substitute of score and id given by the after pair, as a list of
+    (rank, score, substitute) triples. Pages are read from the precomputed
+    table while it holds them, then from the live ranking, which also
+    ranks the products not precomputed: only the rows of the page are
+    fetched.
+    '''
+
+    page = []
+    if product.substitutes_computed:
+        rows = ProductSubstitute.objects.filter(base=product)
+        if after is not None:
+            score, pk = after
+            rows = rows.filter(Q(score__lt=score)
+                               | Q(score=score, substitute_id__lt=pk))
+        page = [(row.rank, row.score, row.substitute)
+                for row in rows.select_related('substitute')
+                               .order_by('rank')[:limit]]
+        if len(page) == limit or product.substitutes_complete:
+            return page
+        if page:
+            after = (page[-1][1], page[-1][2].pk)
+
+    pks, scores = _live_ranking(product)
+    start = 0
+    if after is not None:
+        score, pk = after
+        start = len(pks) - int(np.count_nonzero(
+            (scores < score) | ((scores == score) & (pks < pk))
+        ))
+    pks = pks[start:start + limit - len(page)].tolist()
+    scores = scores[start:start + limit - len(page)].tolist()
+    products = Product.objects.in_bulk(pks)
+    return page + [(start + offset, score, products[pk])
+                   for offset, (pk, score) in enumerate(zip(pks, scores))
+                   if pk in products]
+
+
+def compute_substitutes(products=None, limit=SUBSTITUTE_LIMIT, batch_size=500):
+    '''
+    Stores the limit best substitutes of each product in the
+    ProductSubstitute table, batch_size base products per transaction, and
+    whether they are all its candidates. Computes every product of the
+    database if products is None.
+    The nutriments and categories of the catalogue are loaded once for the
+    whole run. Returns the number of computed products.
+    '''
+
+    matrix = load_matrix()
+    index = load_category_index()
+
+    if products is None:
+        products = Product.objects.all()
+    products = products.order_by('pk').prefetch_related('categories')
+
+    count = 0
+    last_pk = 0
+
+    while True:
+        batch = list(products.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return count
+
+        rows = []
+        complete = []
+        for product in batch:
+            candidates, scores = substitute_candidates(product, index)
+            scores = scores + matrix.scores(product.pk, candidates)
+            rows.extend(ProductSubstitute(base_id=product.pk,
+                                          substitute_id=int(candidates[position]),
+                                          score=float(scores[position]),
+                                          rank=rank)
+                        for rank, position in enumerate(
+                            ranking_order(scores, candidates)[:limit]))
+            if len(candidates) <= limit:
+                complete.append(product.pk)
+
+        pks = [product.pk for product in batch]
+        with transaction.atomic():
+            ProductSubstitute.objects.filter(base_id__in=pks).delete()
+            ProductSubstitute.objects.bulk_create(rows)
+            Product.objects.filter(pk__in=pks).update(
+                substitutes_computed=True, substitutes_complete=False
+            )
+            Product.objects.filter(pk__in=complete).update(
+                substitutes_complete=True
+            )
+
+        count += len(batch)
+        last_pk = batch[-1].pk
@@ -0,0 +1,223 @@
+'''
+This module maintains the taxonomy of the categories.
+Products are linked to canonical openfoodfacts category tags, such as
+"en:beverages", instead of the raw category names of their language, so
+that a category is stored once whatever the spelling. The parents of the
+categories come from the openfoodfacts taxonomy, and the ancestors of every
+category are precomputed into the CategoryAncestor table, from which the
+specificity of the categories is derived.
+'''
+
+import re
+
+from django.db import transaction
+
+from .index import fold
+from .models import Category, CategoryAncestor, Product
+
+
+TAXONOMY_URL = 'https://static.openfoodfacts.org/data/taxonomies/categories.json'
+
+DEFAULT_LANGUAGE = 'fr'
+
+NAME_LANGUAGES = ['fr', 'en']
+
+BATCH_SIZE = 500
+
+LANGUAGE_PATTERN = re.compile(r'^([a-z]{2,3}):(.*)$')
+
+
+def to_tag(category, language=DEFAULT_LANGUAGE):
+    '''
+    Returns the canonical tag of a category tag or raw name, built like the
+    openfoodfacts tags: the language prefix, then the folded words of the
+    name joined by dashes. Returns None if the name holds no word.
+    '''
+
+    category = category.strip().lower()
+    match = LANGUAGE_PATTERN.match(category)
+    if match:
+        language, category = match.groups()
+
+    words = re.sub(r'[\W_]+', '-', fold(category)).strip('-')
+    if not words:
+        return None
+    return '{}:{}'.format(language, words)[:100]
+
+
+def tag_name(tag):
+    #Returns a display name for a tag missing from the taxonomy
+    return tag.split(':', 1)[-1].replace('-', ' ')[:100]
+
+
+def product_tags(product):
+    '''
+    Returns the sorted canonical tags of a raw product: its categories_tags
+    when openfoodfacts provides them, its raw categories read in the
+    language of the product otherwise.
+    '''
+
+    tags = {to_tag(tag) for tag in product.get("categories_tags") or []}
+    tags.discard(None)
+    if not tags:
+        language = product.get("lang") or DEFAULT_LANGUAGE
+        tags = {to_tag(name, language)
+                for name in (product.get("categories") or "").split(",")}
+        tags.discard(None)
+    return sorted(tags)
+
+
+def read_taxonomy(data):
+    '''
+    Yields the (tag, name, parent tags) triples of the categories of an
+    openfoodfacts taxonomy, named in the first available language of
+    NAME_LANGUAGES.
+    '''
+
+    for tag, entry in data.items():
+        names = entry.get("name") or {}
+        name = next((names[language] for language in NAME_LANGUAGES
+                     if names.get(language)), None) or tag_name(tag)
+        yield tag, name[:100], entry.get("parents") or []
+
+
+def ancestors_of(categories, parents):
+    '''
+    Returns a dictionary mapping each of categories to a dictionary of its
+    ancestors and their distance, the longest one when several paths lead to
+    an ancestor, the category itself being at distance 0. parents maps each
+    category to the list of its parents; cycles are ignored.
+    '''
+
+    closure = {}
+    visiting = set()
+
+    def visit(category):
+        if category in closure:
+            return closure[category]
+        visiting.add(category)
+        ancestors = {category: 0}
+        for parent in parents.get(category, []):
+            if parent in visiting:
+                continue
+            for ancestor, depth in visit(parent).items():
+                ancestors[ancestor] = max(ancestors.get(ancestor, 0), depth + 1)
+        visiting.discard(category)
+        closure[category] = ancestors
+        return ancestors
+
+    for category in categories:
+        visit(category)
+    return closure
+
+
+def rebuild_closure():
+    '''
+    Recomputes the ancestors of every category, and sets the specificity of
+    each category to the length of the longest path from the root of the
+    taxonomy to it. Returns the number of ancestor links.
+    '''
+
+    parents = {}
+    for category_id, parent_id in (Category.parents.through.objects
+                                   .values_list('from_category_id',
+                                                'to_category_id')):
+        parents.setdefault(category_id, []).append(parent_id)
+
+    closure = ancestors_of(Category.objects.values_list('pk', flat=True),
+                           parents)
+    links = [CategoryAncestor(category_id=category_id,
+                              ancestor_id=ancestor_id,
+                              depth=depth)
+             for category_id, ancestors in closure.items()
+             for ancestor_id, depth in ancestors.items()]
+
+    with transaction.atomic():
+        CategoryAncestor.objects.all().delete()
+        CategoryAncestor.objects.bulk_create(links)
+        Category.objects.bulk_update(
+            [Category(pk=category_id, specificity=max(ancestors.values()) + 1)
+             for category_id, ancestors in closure.items()],
+            ['specificity']
+        )
+
+    return len(links)
+
+
+def link_ancestors():
+    '''
+    Links the products of every category to the ancestors of the category,
+    a batch of categories at a time, keeping the existing links. Links to
+    former ancestors are only removed when the product is written again.
+    '''
+
+    ancestors = {}
+    for category_id, ancestor_id in (CategoryAncestor.objects
+                                     .filter(depth__gt=0)
+                                     .values_list('category_id',
+                                                  'ancestor_id')):
+        ancestors.setdefault(category_id, []).append(ancestor_id)
+
+    through = Product.categories.through
+    category_ids = sorted(ancestors)
+    for start in range(0, len(category_ids), BATCH_SIZE):
+        links = {(product_id, ancestor_id)
+                 for product_id, category_id
+                 in through.objects.filter(
+                     category_id__in=category_ids[start:start + BATCH_SIZE]
+                 ).values_list('product_id', 'category_id').iterator()
+                 for ancestor_id in ancestors[category_id]}
+        through.objects.bulk_create(
+            [through(product_id=product_id, category_id=category_id)
+             for product_id, category_id in links],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True
+        )
+
+
+def load_taxonomy(entries):
+    '''
+    Writes the categories of a taxonomy given as (tag, name, parent tags)
+    triples, creating the missing ones and replacing the names and parents
+    of the others, then rebuilds the closure and links the products already
+    in the catalogue to the new ancestors of their categories. Parents
+    missing from the taxonomy are ignored. Returns the number of written
+    categories.
+    '''
+
+    entries = list({to_tag(tag): (to_tag(tag), name, parents)
+                    for tag, name, parents in entries}.values())
+    entries = [entry for entry in entries if entry[0]]
+
+    with transaction.atomic():
+        existing = set(Category.objects.filter(tag__isnull=False)
+                                       .values_list('tag', flat=True))
+        Category.objects.bulk_create([Category(tag=tag, name=name)
+                                      for tag, name, parents in entries
+                                      if tag not in existing])
+
+        ids = dict(Category.objects.filter(tag__isnull=False)
+                                   .values_list('tag', 'pk'))
+        Category.objects.bulk_update([Category(pk=ids[tag], name=name)
+                                      for tag, name, parents in entries],
+                                     ['name'])
+
+        through = Category.parents.through
+        written = [ids[tag] for tag, name, parents in entries]
+        for start in range(0, len(written), BATCH_SIZE):
+            through.objects.filter(
+                from_category_id__in=written[start:start + BATCH_SIZE]
+            ).delete()
+
+        links = {(ids[tag], ids[parent])
+                 for tag, name, parents in entries
+                 for parent in map(to_tag, parents)
+                 if parent in ids and parent != tag}
+        through.objects.bulk_create([through(from_category_id=category_id,
+                                             to_category_id=parent_id)
+                                     for category_id, parent_id in links])
+
+        rebuild_closure()
+        link_ancestors()
+
+    return len(entries)
@@ -0,0 +1,23 @@
+'''
+This file contains the template tags giving the urls of the product
+thumbnails, and telling whether they are in the store.
+'''
+
+from django import template
+
+from substituter.images import has_thumbnail, thumbnail_url
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def thumbnail(product, size="small", extension="jpg"):
+    #Returns the url of a thumbnail of the product, or of its original image if not in the store
+    return thumbnail_url(product, size, extension)
+
+
+@register.simple_tag
+def has_webp_thumbnail(product, size="small"):
+    #Returns whether the WebP thumbnail of the product is in the store
+    return has_thumbnail(product, size, "webp")
@@ -2,12 +2,62 @@
 This module contains the various unit tests for the substituter app
 '''
 
-from django.test import TestCase
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, override_settings
+)
 from django.test.client import Client
 from django.http import JsonResponse
+from django.template.loader import render_to_string
+from django.utils import timezone
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+import gzip
+import io
+from socketserver import ThreadingMixIn
+from unittest import mock, skipUnless
 import json
-
-from .models import Product, Category
+import os
+import tempfile
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+import requests
+
+from .analytics import (
+    SearchBuffer, buffer, flush, rollup_searches, top_queries, truncate_hour
+)
+from .api import _batch_slots, encode_cursor
+from .autocomplete import AutocompleteIndex
+from .benchmark import run_benchmarks, synthetic_products
+from .cache import (
+    VERSION_KEY, bump_catalogue_version, get_cache, normalize_query,
+    parse_barcode, search_key, search_results
+)
+from .categories import get_category_index, load_category_index
+from .fetching import fetch_pages
+from .images import FORMATS, THUMBNAIL_SIZES, process_images, thumbnail_path
+from .index import fragments, matching_products
+from .ingestion import parse_product, write_products
+from .models import (
+    Product, Category, ProductSubstitute, ProductToken, SearchLog,
+    SearchRollup, SyncCheckpoint
+)
+from .nutrition import (
+    NutrimentMatrix, grade_codes, nutriment_array, nutrition_scores
+)
+from .ranking import (
+    rank_by_fulltext, rank_by_name, rank_by_categories, search_products
+)
+from .reloading import ReloadedIndex
+from .substitutes import compute_substitutes, get_substitutes
+from .taxonomy import load_taxonomy, read_taxonomy, to_tag
+from .warming import popular_queries, warm_caches
 from accounts.models import User
 
 
@@ -58,6 +108,956 @@ class TestModels(TestCase):
         self.assertEqual(type(cat.name), str)
 
 
+# Index
+
+class TestIndex(TestCase):
+    #This class tests the inverted index of the product names
+
+    def test_fragments_folded(self):
+        #tests that fragments are lowercased and stripped of their accents
+
+        self.assertEqual(fragments("Thé"), {"the", "he", "e"})
+
+    def test_index_follows_saves(self):
+        #tests that saving a product reindexes its name
+
+        product = Product.objects.create(name="Crème brûlée")
+        self.assertEqual(list(matching_products("brul")), [product])
+
+        product.name = "Mousse"
+        product.save()
+        self.assertEqual(list(matching_products("brul")), [])
+        self.assertEqual(list(matching_products("ousse")), [product])
+
+    def test_build_index_command(self):
+        #tests that the build_index command indexes existing products
+
+        product = Product.objects.create(name="galette")
+        ProductToken.objects.all().delete()
+
+        call_command('build_index', stdout=StringIO())
+
+        self.assertEqual(list(matching_products("LETTE")), [product])
+
+
+# Cache
+
+class TestCache(SimpleTestCase):
+    #This class tests the normalization of the cached queries
+
+    def test_normalize_query(self):
+        #tests that equivalent queries share the same normalized form
+
+        self.assertEqual(normalize_query(["Gâteau", "", "chocolat", "gateau"]),
+                         "chocolat+gateau")
+        self.assertEqual(normalize_query(["Pâte  à-tartiner"]),
+                         "pate a tartiner")
+
+    def test_parse_barcode(self):
+        #tests that only the queries made of digits are read as barcodes
+
+        self.assertEqual(parse_barcode(" 3017620422003 "), 3017620422003)
+        for query in ["nutella", "301762042200a", "30 17", "²", "1" * 19, ""]:
+            self.assertIsNone(parse_barcode(query))
+
+
+# Ranking
+
+class TestRanking(TestCase):
+    #This class tests the ranking engine used by the search view
+
+    @classmethod
+    def setUpTestData(cls):
+        #sets up products sharing some words and categories
+
+        cls.cata = cata = Category.objects.create(name="cata")
+        cls.catb = catb = Category.objects.create(name="catb", specificity=2)
+
+        cls.producta = Product.objects.create(name="alpha beta gamma")
+        cls.productb = Product.objects.create(name="beta gamma")
+        cls.productc = Product.objects.create(name="gamma")
+
+        cls.producta.categories.add(cata)
+        cls.productb.categories.add(cata, catb)
+
+    def test_rank_by_name_scores(self):
+        #tests that products are scored by number of matching words
+
+        ranking = list(rank_by_name(["alpha", "beta", "gamma"]))
+
+        self.assertEqual(ranking, [self.producta, self.productb, self.productc])
+        self.assertEqual([product.score for product in ranking], [3, 2, 1])
+
+    def test_rank_by_name_normalized(self):
+        #tests that queries sharing a cache key are ranked the same
+
+        ranking = list(rank_by_name(["Béta", "beta", "gamma"]))
+
+        self.assertEqual(normalize_query(["Béta", "beta", "gamma"]),
+                         normalize_query(["beta", "gamma"]))
+        self.assertEqual(ranking, list(rank_by_name(["beta", "gamma"])))
+        self.assertEqual([product.score for product in ranking], [2, 2, 1])
+
+    def test_rank_by_name_no_word(self):
+        #tests that an empty input matches no product
+
+        self.assertEqual(list(rank_by_name(["", ""])), [])
+
+    @skipUnless(connection.vendor == 'postgresql',
+                "the full-text ranking needs PostgreSQL 12 or later")
+    @override_settings(SEARCH_BACKEND='postgres')
+    def test_rank_by_fulltext(self):
+        #tests that stemmed matches come first, then the names close to a typo
+
+        chocolate = Product.objects.create(name="chocolat noir")
+
+        with self.assertNumQueries(1):
+            ranking = list(search_products(["alpha", "Béta"]))
+        self.assertEqual(ranking[:2], [self.producta, self.productb])
+        self.assertGreater(ranking[0].score, ranking[1].score)
+        self.assertGreaterEqual(ranking[1].score, 1)
+
+        ranking = list(rank_by_fulltext(["chocolt"]))
+        self.assertEqual(ranking, [chocolate])
+        self.assertLess(ranking[0].score, 1)
+
+    @override_settings(SEARCH_BACKEND='postgres')
+    def test_search_products_fallback(self):
+        #tests that the full-text backend falls back to the index off PostgreSQL
+
+        self.assertEqual(list(search_products(["alpha", "beta", "gamma"])),
+                         list(rank_by_name(["alpha", "beta", "gamma"])))
+
+    @skipUnless(connection.vendor != 'postgresql',
+                "the full-text column may be added on PostgreSQL")
+    def test_enable_fulltext_unavailable(self):
+        #tests that the full-text column is not added off PostgreSQL 12+
+
+        with self.assertRaisesMessage(CommandError, "PostgreSQL 12"):
+            call_command('enable_fulltext', stdout=StringIO())
+
+    def test_rank_by_categories_scores(self):
+        #tests that products are scored by specificity of the shared categories
+
+        ranking = list(rank_by_categories([self.cata.pk, self.catb.pk]))
+
+        self.assertEqual(ranking, [self.productb, self.producta])
+        self.assertEqual([product.score for product in ranking], [3, 1])
+        self.assertEqual(list(rank_by_categories([self.catb.pk])),
+                         [self.productb])
+
+    def test_category_index_scores(self):
+        #tests that the category index scores candidates like the database
+
+        index = load_category_index()
+        categories = [self.cata.pk, self.catb.pk]
+        pks, scores = index.candidates(categories, "z", 10)
+
+        self.assertEqual(pks.tolist(), [self.productb.pk, self.producta.pk])
+        self.assertEqual(scores.tolist(), [3, 1])
+        self.assertEqual(index.candidates(categories, "", 10)[0].tolist(), [])
+
+    def test_category_index_refreshed_by_other_process(self):
+        #tests that the category index is rebuilt when the catalogue is
+        #changed by another process, which has a cache of its own
+
+        get_cache().clear()
+        bump_catalogue_version()
+        categories = [self.cata.pk, self.catb.pk]
+        pks, scores = get_category_index().candidates(categories, "z", 10)
+        self.assertEqual(pks.tolist(), [self.productb.pk, self.producta.pk])
+
+        self.productc.categories.add(self.catb)
+        with mock.patch('substituter.cache.get_cache',
+                        return_value=LocMemCache('update_db', {})):
+            bump_catalogue_version()
+        get_cache().delete(VERSION_KEY)
+
+        pks, scores = get_category_index().candidates(categories, "z", 10)
+        self.assertEqual(pks.tolist(), [self.productb.pk, self.productc.pk,
+                                        self.producta.pk])
+
+    @override_settings(CATEGORY_INDEX_MAX_LINKS=2)
+    def test_category_index_bounded(self):
+        #tests that no index is built for catalogues over the bound
+
+        self.assertIsNone(load_category_index())
+
+
+class TestNutrition(SimpleTestCase):
+    #This class tests the nutritional scoring of the substitutes
+
+    def test_healthier_and_closer_first(self):
+        #tests that similar nutriments and a better grade raise the score
+
+        base, base_grade = nutriment_array([[1, 30, 20, 50, 5, 2]]), 3
+        values = nutriment_array([[1, 30, 20, 50, 5, 2],
+                                  [0.5, 20, 15, 50, 6, 3],
+                                  [3, 60, 35, 80, 1, 0]])
+        scores = nutrition_scores(base[0], base_grade, values,
+                                  grade_codes("bba"))
+
+        self.assertGreater(scores[1], scores[0])
+        self.assertGreater(scores[0], scores[2])
+        self.assertTrue(((scores >= 0) & (scores < 1)).all())
+
+    def test_missing_nutriments(self):
+        #tests that missing nutriments and grades are scored without NaN
+
+        matrix = NutrimentMatrix([(1, "d", 1, 30, None, None, None, None),
+                                  (2, "", None, None, None, None, None, None),
+                                  (3, "b", 1, None, None, None, None, None)])
+        scores = matrix.scores(1, [2, 3, 4])
+
+        self.assertFalse(np.isnan(scores).any())
+        self.assertGreater(scores[1], scores[0])
+        self.assertEqual(scores[0], scores[2])
+
+
+# Ingestion
+
+def off_product(code, name, categories, grade="b", last_modified_t=0):
+    #Returns a product as sent by the openfoodfacts api
+    return {
+        "last_modified_t": last_modified_t,
+        "code": code,
+        "product_name": name,
+        "nutrition_grades": grade,
+        "url": "off.org/" + code,
+        "generic_name": "descr",
+        "image_url": "off.org/" + code + ".jpg",
+        "categories": categories,
+        "nutriments": {"salt_100g": "0.5", "sugars_100g": ""},
+    }
+
+
+class TestIngestion(TestCase):
+    #This class tests the bulk writing of the openfoodfacts products
+
+    def test_parse_product(self):
+        #tests that raw products are validated and parsed
+
+        parsed = parse_product(off_product("123", "Jus", "Boissons , jus,"))
+
+        self.assertEqual(parsed["barcode"], 123)
+        self.assertEqual(parsed["categories"], ["fr:boissons", "fr:jus"])
+        self.assertEqual(parsed["salt"], 0.5)
+        self.assertIsNone(parsed["sugars"])
+        self.assertIsNone(parse_product({"code": "123"}))
+        self.assertIsNone(parse_product(off_product("12a", "Jus", "jus")))
+
+    def test_write_products_upserts_on_barcode(self):
+        #tests that a second run updates products instead of duplicating them
+
+        write_products([off_product("1", "Jus", "boissons,jus"),
+                        off_product("2", "Lait", "boissons,lait")],
+                       batch_size=1)
+        data = []
+        count = write_products([off_product("1", "Jus d'orange", "jus")],
+                               log=data.append)
+
+        self.assertEqual(count, 1)
+        self.assertEqual(data, ["product #1 updated"])
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(Category.objects.count(), 3)
+
+        product = Product.objects.get(barcode=1)
+        self.assertEqual(product.name, "Jus d'orange")
+        self.assertGreater(product.updated_at,
+                           Product.objects.get(barcode=2).updated_at)
+        self.assertEqual([category.name for category
+                          in product.categories.all()], ["jus"])
+        self.assertEqual(list(matching_products("orange")), [product])
+
+    def test_update_db_command(self):
+        #tests that update_db writes the products and reports its timings
+
+        stdout = StringIO()
+
+        with StubOFFServer({"boissons": [off_product("1", "Jus", "boissons")]}
+                           ) as server, \
+             tempfile.TemporaryDirectory() as logs_path, \
+             mock.patch.dict(os.environ, {"LOGS_PATH": logs_path}):
+            call_command("update_db", "--batch-size", "10",
+                         "--api-url", server.url, stdout=stdout)
+
+        self.assertEqual(Product.objects.get().name, "Jus")
+        self.assertIn("products: ", stdout.getvalue())
+        self.assertIn("total: ", stdout.getvalue())
+
+
+class TestTaxonomy(TestCase):
+    #This class tests the canonical categories and their taxonomy
+
+    TAXONOMY = {
+        "en:beverages": {"name": {"en": "Beverages", "fr": "Boissons"}},
+        "en:sodas": {"name": {"en": "Sodas"}, "parents": ["en:beverages"]},
+        "en:colas": {"name": {"fr": "Colas"}, "parents": ["en:sodas"]},
+    }
+
+    def test_to_tag(self):
+        #tests that the spellings of a category share the same tag
+
+        self.assertEqual({to_tag("Boissons "), to_tag("boissons"),
+                          to_tag("fr:Boissons")}, {"fr:boissons"})
+        self.assertEqual(to_tag("Pâtes à tartiner"), "fr:pates-a-tartiner")
+        self.assertEqual(to_tag("en:beverages"), "en:beverages")
+        self.assertIsNone(to_tag(" , "))
+
+    def test_load_taxonomy(self):
+        #tests that the taxonomy is written along with its closure
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as taxonomy:
+            json.dump(self.TAXONOMY, taxonomy)
+            taxonomy.flush()
+            call_command('load_taxonomy', taxonomy.name, stdout=StringIO())
+
+        colas = Category.objects.get(tag="en:colas")
+        self.assertEqual(colas.name, "Colas")
+        self.assertEqual(Category.objects.get(tag="en:beverages").name,
+                         "Boissons")
+        self.assertEqual(
+            sorted(colas.ancestor_links.values_list('ancestor__tag', 'depth')),
+            [("en:beverages", 2), ("en:colas", 0), ("en:sodas", 1)]
+        )
+        self.assertEqual(
+            dict(Category.objects.values_list('tag', 'specificity')),
+            {"en:beverages": 1, "en:sodas": 2, "en:colas": 3}
+        )
+
+    def test_products_linked_to_ancestors(self):
+        #tests that products are linked to the ancestors of their categories
+
+        load_taxonomy(read_taxonomy(self.TAXONOMY))
+        product = off_product("1", "Cola", "Colas")
+        product["categories_tags"] = ["en:colas"]
+        write_products([product])
+
+        self.assertEqual(
+            sorted(Product.objects.get(barcode=1)
+                          .categories.values_list('tag', flat=True)),
+            ["en:beverages", "en:colas", "en:sodas"]
+        )
+
+
+    def test_existing_products_linked_to_ancestors(self):
+        #tests that loading the taxonomy links the products already written
+
+        product = off_product("1", "Cola", "Colas")
+        product["categories_tags"] = ["en:colas"]
+        write_products([product])
+        load_taxonomy(read_taxonomy(self.TAXONOMY))
+
+        self.assertEqual(
+            sorted(Product.objects.get(barcode=1)
+                          .categories.values_list('tag', flat=True)),
+            ["en:beverages", "en:colas", "en:sodas"]
+        )
+        self.assertEqual(load_taxonomy(read_taxonomy(self.TAXONOMY)), 3)
+        self.assertEqual(Product.objects.get(barcode=1).categories.count(), 3)
+
+
+class TestDeltaSync(TestCase):
+    #This class tests the incremental synchronization of update_db
+
+    def update_db(self, server, *args):
+        #Runs update_db against the stub server, returning its log lines
+        with tempfile.TemporaryDirectory() as logs_path, \
+             mock.patch.dict(os.environ, {"LOGS_PATH": logs_path}):
+            call_command("update_db", "--api-url", server.url,
+                         "--page-size", "1", *args, stdout=StringIO())
+            with open(os.path.join(logs_path, os.listdir(logs_path)[0])) as log:
+                return log.read()
+
+    def test_unchanged_products_skipped(self):
+        #tests that products with an unchanged content hash are not rewritten
+
+        products = [off_product("1", "Jus", "jus", last_modified_t=10)]
+        self.assertEqual(write_products(products), 1)
+
+        data = []
+        products[0]["last_modified_t"] = 20
+        self.assertEqual(write_products(products, log=data.append), 0)
+        self.assertEqual(data, [])
+
+    def test_update_db_delta(self):
+        #tests that a second run only requests the recently modified products
+
+        catalogue = {"boissons": [
+            off_product("1", "Jus", "boissons", last_modified_t=100),
+            off_product("2", "Lait", "boissons", last_modified_t=200),
+            off_product("4", "Thé", "boissons", last_modified_t=50),
+        ]}
+
+        with StubOFFServer(catalogue) as server:
+            self.update_db(server)
+        self.assertEqual(SyncCheckpoint.objects.get().last_modified_t, 200)
+
+        catalogue["boissons"].append(
+            off_product("3", "Soda", "boissons", last_modified_t=300)
+        )
+        catalogue["boissons"][0]["product_name"] = "Jus d'orange"
+
+        with StubOFFServer(catalogue) as server:
+            log = self.update_db(server)
+
+        self.assertEqual(SyncCheckpoint.objects.get().last_modified_t, 300)
+        self.assertIn("product #3 created", log)
+        self.assertNotIn("product #2", log)
+        self.assertEqual(Product.objects.get(barcode=1).name, "Jus")
+        self.assertEqual([params["page"][0] for params in server.requests
+                          if params["tag_0"] == ["boissons"]],
+                         ["1", "2", "3"])
+
+        with StubOFFServer(catalogue) as server:
+            self.update_db(server, "--full")
+        self.assertEqual(Product.objects.get(barcode=1).name, "Jus d'orange")
+
+    def test_max_pages_keeps_checkpoint(self):
+        #tests that the checkpoint does not pass the pages left by --max-pages
+
+        catalogue = {"boissons": [
+            off_product("1", "Jus", "boissons", last_modified_t=100),
+            off_product("2", "Lait", "boissons", last_modified_t=200),
+        ]}
+
+        with StubOFFServer(catalogue) as server:
+            log = self.update_db(server, "--max-pages", "1")
+        self.assertFalse(SyncCheckpoint.objects.exists())
+        self.assertIn("checkpoint kept: pages of boissons not fetched", log)
+
+        with StubOFFServer(catalogue) as server:
+            self.update_db(server)
+        self.assertEqual(SyncCheckpoint.objects.get().last_modified_t, 200)
+
+        catalogue["boissons"] += [
+            off_product("3", "Soda", "boissons", last_modified_t=300),
+            off_product("4", "Thé", "boissons", last_modified_t=250),
+        ]
+        with StubOFFServer(catalogue) as server:
+            self.update_db(server, "--max-pages", "1")
+        self.assertEqual(SyncCheckpoint.objects.get().last_modified_t, 200)
+        self.assertFalse(Product.objects.filter(barcode=4).exists())
+
+        with StubOFFServer(catalogue) as server:
+            self.update_db(server)
+        self.assertEqual(SyncCheckpoint.objects.get().last_modified_t, 300)
+        self.assertTrue(Product.objects.filter(barcode=4).exists())
+
+
+class TestDumps(TestCase):
+    #This class tests the import of openfoodfacts dump files
+
+    def test_import_jsonl_gz(self):
+        #tests that a gzipped JSONL dump is filtered on accepted categories
+
+        lines = [
+            json.dumps(dict(off_product("1", "Jus", "Boissons, Jus"),
+                            url=None)),
+            "not json",
+            json.dumps(dict(off_product("2", "Lait", "Laits"),
+                            categories_tags=["en:dairies",
+                                             "fr:produits-laitiers"])),
+            json.dumps(off_product("3", "Vis", "Bricolage")),
+        ]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dump.jsonl.gz")
+            with gzip.open(path, "wt", encoding="utf-8") as dump:
+                dump.write("\n".join(lines))
+            stdout = StringIO()
+            call_command("import_dump", path, stdout=stdout)
+
+        self.assertEqual(sorted(Product.objects.values_list("name", flat=True)),
+                         ["Jus", "Lait"])
+        self.assertEqual(Product.objects.get(barcode=1).link,
+                         "https://fr.openfoodfacts.org/produit/1")
+        self.assertIn("4 lines read", stdout.getvalue())
+        self.assertIn("2 products written", stdout.getvalue())
+
+    def test_import_csv(self):
+        #tests that a tab separated CSV dump is read with its nutriments
+
+        columns = ["code", "url", "product_name", "generic_name", "categories",
+                   "categories_tags", "nutrition_grade_fr", "image_url",
+                   "salt_100g", "fiber_100g"]
+        rows = [
+            ["1", "off.org/1", "Café", "descr", "Boissons chaudes",
+             "en:beverages,fr:boissons", "c", "off.org/1.jpg", "0.1", "2"],
+            ["2", "off.org/2", '"Le" thé', "descr", "Boissons chaudes",
+             "en:beverages,fr:boissons", "b", "off.org/2.jpg", "0", ""],
+            ["3", "off.org/3", "Chocolat", "descr", "Boissons chaudes",
+             "en:beverages,fr:boissons", "d", "off.org/3.jpg", "0.2", ""],
+        ]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dump.csv")
+            with open(path, "w", encoding="utf-8") as dump:
+                for line in [columns] + rows:
+                    dump.write("\t".join(line) + "\n")
+            call_command("import_dump", path, "--skip-substitutes",
+                         stdout=StringIO())
+
+        product = Product.objects.get(barcode=1)
+        self.assertEqual((product.name, product.grade), ("Café", "c"))
+        self.assertEqual((product.salt, product.fibers), (0.1, 2.0))
+        #a leading quote does not swallow the following rows
+        self.assertEqual(Product.objects.get(barcode=2).name, '"Le" thé')
+        self.assertEqual(Product.objects.get(barcode=3).grade, "d")
+
+
+class StubHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubOFFServer:
+    '''
+    Local http server imitating the openfoodfacts search api, serving the
+    products of a dictionary of categories. The first failures requests
+    are answered with a 503 error.
+    '''
+
+    def __init__(self, catalogue, failures=0):
+        self.catalogue = catalogue
+        self.failures = failures
+        self.requests = []
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                #Answers with the requested page of the requested category
+                params = parse_qs(urlparse(self.path).query)
+                stub.requests.append(params)
+                if stub.failures:
+                    stub.failures -= 1
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+
+                products = stub.catalogue.get(params["tag_0"][0], [])
+                if "sort_by" in params:
+                    products = sorted(products,
+                                      key=lambda product:
+                                          -product[params["sort_by"][0]])
+                page = int(params["page"][0])
+                page_size = int(params["page_size"][0])
+                body = json.dumps({
+                    "count": len(products),
+                    "products": products[(page - 1) * page_size:
+                                         page * page_size],
+                }).encode()
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = StubHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestFetching(SimpleTestCase):
+    #This class tests the parallel download of the openfoodfacts products
+
+    def test_fetch_all_pages(self):
+        #tests that every page of every category is downloaded
+
+        catalogue = {
+            "boissons": [off_product(str(code), "b", "b") for code in range(7)],
+            "epicerie": [off_product(str(code), "e", "e")
+                         for code in range(10, 13)],
+        }
+
+        with StubOFFServer(catalogue) as server:
+            pages = list(fetch_pages(["boissons", "epicerie", "charcuteries"],
+                                     url=server.url,
+                                     concurrency=3,
+                                     page_size=2))
+
+        codes = sorted(product["code"] for page in pages for product in page)
+        self.assertEqual(codes, sorted(["0", "1", "2", "3", "4", "5", "6",
+                                        "10", "11", "12"]))
+        self.assertEqual(len(server.requests), 4 + 2 + 1)
+
+    def test_fetch_max_pages(self):
+        #tests that no more than max_pages pages are downloaded per category
+
+        catalogue = {"boissons": [off_product(str(code), "b", "b")
+                                  for code in range(10)]}
+
+        with StubOFFServer(catalogue) as server:
+            pages = list(fetch_pages(["boissons"], url=server.url,
+                                     page_size=2, max_pages=3))
+
+        self.assertEqual(sum(len(page) for page in pages), 6)
+
+    def test_fetch_retries(self):
+        #tests that failed downloads are retried
+
+        catalogue = {"boissons": [off_product("1", "b", "b")]}
+
+        with StubOFFServer(catalogue, failures=2) as server:
+            pages = list(fetch_pages(["boissons"], url=server.url,
+                                     retries=2, backoff=0))
+
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(len(server.requests), 3)
+
+    def test_fetch_error_raised(self):
+        #tests that a download failing after every retry raises an error
+
+        with StubOFFServer({}, failures=5) as server:
+            with self.assertRaises(requests.RequestException):
+                list(fetch_pages(["boissons"], url=server.url,
+                                 retries=1, backoff=0))
+
+
+# Analytics
+
+class TestAnalytics(TestCase):
+    #This class tests the recording and the rollups of the searches
+
+    def setUp(self):
+        #empties the buffer and the cache, and changes the catalogue version,
+        #since they outlive the test transactions
+        buffer.drain()
+        get_cache().clear()
+        bump_catalogue_version()
+
+    def test_buffer_drops_oldest(self):
+        #tests that a full buffer keeps the latest entries
+
+        search_buffer = SearchBuffer(2)
+        for entry in [1, 2, 3]:
+            search_buffer.append(entry)
+
+        self.assertEqual(search_buffer.drain(), [2, 3])
+        self.assertEqual(search_buffer.dropped, 1)
+        self.assertEqual(search_buffer.drain(), [])
+
+    def test_search_recorded(self):
+        #tests that searches are buffered, then written with a single insert
+
+        Product.objects.create(name="nutella", grade="e")
+        self.client.get("/substituter/search/", {'query': 'nutella'})
+        self.client.get("/substituter/search/", {'query': 'epsilon'})
+
+        self.assertEqual(SearchLog.objects.count(), 0)
+        with self.assertNumQueries(1):
+            self.assertEqual(flush(), 2)
+
+        logs = SearchLog.objects.order_by('pk')
+        self.assertEqual([(log.query, log.hit) for log in logs],
+                         [("nutella", True), ("epsilon", False)])
+        self.assertEqual(logs[0].product.name, "nutella")
+        self.assertIsNone(logs[1].product)
+
+    def test_rollup_searches(self):
+        #tests that complete hours are rolled up once, by normalized query
+
+        now = timezone.now().replace(minute=30)
+        hour = truncate_hour(now)
+        for minutes, query, hit in [(-150, "Nutella", True),
+                                    (-140, "nutella", True),
+                                    (-60, "epsilon", False),
+                                    (-50, "nutella+", True),
+                                    (-40, "epsilon", False),
+                                    (-10, "nutella", True)]:
+            SearchLog.objects.create(query=query, hit=hit, duration_ms=1,
+                                     created_at=now + timedelta(minutes=minutes))
+
+        self.assertEqual(rollup_searches(now), 2)
+        self.assertEqual(rollup_searches(now), 0)
+
+        rollups = SearchRollup.objects.order_by('hour', 'query')
+        self.assertEqual([(rollup.hour, rollup.query, rollup.searches,
+                           rollup.misses) for rollup in rollups],
+                         [(hour - timedelta(hours=2), "nutella", 2, 0),
+                          (hour - timedelta(hours=1), "epsilon", 2, 2),
+                          (hour - timedelta(hours=1), "nutella", 1, 0)])
+        self.assertEqual(top_queries(now - timedelta(hours=3)),
+                         [("nutella", 3), ("epsilon", 2)])
+        self.assertEqual(top_queries(now - timedelta(hours=3), misses=True),
+                         [("epsilon", 2)])
+
+    def test_rollup_command(self):
+        #tests that the command reports the zero-result queries
+
+        SearchLog.objects.create(query="epsilon", hit=False, duration_ms=1,
+                                 created_at=timezone.now() - timedelta(hours=2))
+        stdout = StringIO()
+
+        call_command('rollup_searches', stdout=stdout)
+
+        self.assertIn("1 hours rolled up", stdout.getvalue())
+        self.assertIn("zero-result queries:\n  1 epsilon", stdout.getvalue())
+
+
+class TestWarming(TransactionTestCase):
+    #This class tests the warm-up of the search cache, run by worker threads
+
+    def setUp(self):
+        #sets up a product, and a file cache standing for one shared by the
+        #web workers, empty and with a new catalogue version
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared_cache = self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': directory.name,
+        }})
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+        bump_catalogue_version()
+        Product.objects.create(name="nutella", grade="e")
+
+    def _seed(self, queries):
+        #Returns the path of a temporary seed file holding queries
+        seed = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+        with seed:
+            seed.write("# comment\n\n" + "\n".join(queries))
+        self.addCleanup(os.remove, seed.name)
+        return seed.name
+
+    def test_warm_seed_queries(self):
+        #tests that the seed queries are cached while no search is logged
+
+        report = warm_caches(timezone.now() - timedelta(days=1),
+                             concurrency=2,
+                             seed_path=self._seed(["nutella", "epsilon"]))
+
+        self.assertEqual((report["queries"], report["found"]), (2, 1))
+        self.assertIsNone(report["coverage"])
+        for query in ["nutella", "epsilon"]:
+            self.assertIsNotNone(get_cache().get(search_key([query])))
+
+    def test_warm_popular_queries(self):
+        #tests that the most searched queries are warmed, and their coverage reported
+
+        created_at = timezone.now() - timedelta(hours=3)
+        for query, hit in [("nutella", True), ("Nutella", True),
+                           ("nutella", True), ("epsilon", False)]:
+            SearchLog.objects.create(query=query, hit=hit, duration_ms=1,
+                                     created_at=created_at)
+
+        self.assertEqual(popular_queries(created_at, 10, self._seed([])),
+                         [("nutella", 3), ("epsilon", 1)])
+
+        stdout = StringIO()
+        call_command('warm_caches', '--concurrency', '3', stdout=stdout)
+
+        self.assertIn("1 of 2 queries cached", stdout.getvalue())
+        self.assertIn("coverage: 75.0%", stdout.getvalue())
+
+        with self.assertNumQueries(1):
+            base_product, substitute_list = search_results(["nutella"])
+        self.assertEqual(base_product.name, "nutella")
+
+    def test_update_db_warm(self):
+        #tests that update_db warms the cache after writing the products
+
+        stdout = StringIO()
+
+        with StubOFFServer({"boissons": [off_product("1", "Jus", "boissons")]}
+                           ) as server, \
+             tempfile.TemporaryDirectory() as logs_path, \
+             mock.patch.dict(os.environ, {"LOGS_PATH": logs_path}):
+            call_command("update_db", "--warm", "--api-url", server.url,
+                         stdout=stdout)
+
+        self.assertIn("queries cached with a product", stdout.getvalue())
+        self.assertIn("warm: ", stdout.getvalue())
+
+    def test_local_cache_not_warmed(self):
+        #tests that a cache local to the warming process is left cold
+
+        local_cache = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }}
+        stderr = StringIO()
+
+        with self.settings(CACHES=local_cache):
+            with self.assertRaisesMessage(CommandError, "CACHE_BACKEND"):
+                call_command('warm_caches', seed=self._seed(["nutella"]))
+
+            with StubOFFServer({"boissons": []}) as server, \
+                 tempfile.TemporaryDirectory() as logs_path, \
+                 mock.patch.dict(os.environ, {"LOGS_PATH": logs_path}):
+                call_command("update_db", "--warm", "--api-url", server.url,
+                             stdout=StringIO(), stderr=stderr)
+
+        self.assertIn("search cache not warmed", stderr.getvalue())
+
+
+# Images
+
+def png_bytes(color, size=(60, 30)):
+    #Returns the bytes of a png image of a single color
+    output = io.BytesIO()
+    Image.new('RGB', size, color).save(output, 'PNG')
+    return output.getvalue()
+
+
+class TestImages(TestCase):
+    #This class tests the download and the thumbnails of the product images
+
+    def setUp(self):
+        #sets up products sharing an image, an empty store and a stub fetcher
+
+        store = tempfile.TemporaryDirectory()
+        self.addCleanup(store.cleanup)
+        override = override_settings(IMAGE_ROOT=store.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        get_cache().clear()
+
+        self.images = {"off.org/red.jpg": png_bytes("red"),
+                       "off.org/copy.jpg": png_bytes("red")}
+        self.fetched = []
+        for name, image in [("red", "off.org/red.jpg"),
+                            ("copy", "off.org/copy.jpg"),
+                            ("missing", "off.org/missing.jpg")]:
+            Product.objects.create(name=name, image=image)
+
+    def fetch(self, url):
+        #Returns the bytes of a stub image, failing for unknown urls
+        self.fetched.append(url)
+        if url not in self.images:
+            raise requests.HTTPError("404")
+        return self.images[url]
+
+    def test_process_images(self):
+        #tests that images are downloaded once, into fixed-size thumbnails named by their content
+
+        self.assertEqual(process_images(fetcher=self.fetch, concurrency=2),
+                         (2, 1))
+
+        red = Product.objects.get(name="red")
+        self.assertEqual(Product.objects.get(name="copy").image_hash,
+                         red.image_hash)
+        self.assertEqual(Product.objects.get(name="missing").image_hash, "")
+        for size, dimensions in THUMBNAIL_SIZES.items():
+            for extension in FORMATS:
+                path = thumbnail_path(red.image_hash, size, extension)
+                with Image.open(path) as thumbnail:
+                    self.assertEqual(thumbnail.size, dimensions)
+
+        self.fetched = []
+        self.assertEqual(process_images(fetcher=self.fetch), (0, 1))
+        self.assertEqual(self.fetched, ["off.org/missing.jpg"])
+
+    def test_digests_saved_by_batch(self):
+        #tests that the digests stored before a run is interrupted are kept
+
+        def fetch(url):
+            if url == "off.org/copy.jpg":
+                raise KeyboardInterrupt
+            return self.fetch(url)
+
+        with self.assertRaises(KeyboardInterrupt):
+            process_images(fetcher=fetch, concurrency=1, batch_size=1)
+
+        self.assertNotEqual(Product.objects.get(name="red").image_hash, "")
+        self.assertEqual(Product.objects.get(name="copy").image_hash, "")
+
+        self.fetched = []
+        self.assertEqual(process_images(fetcher=self.fetch), (1, 1))
+        self.assertEqual(self.fetched, ["off.org/copy.jpg",
+                                        "off.org/missing.jpg"])
+
+    def test_image_kept_until_url_changes(self):
+        #tests that the ingestion only forgets the image when its url changes
+
+        write_products([off_product("1", "Jus", "jus")])
+        process_images(fetcher=self.fetch)
+        self.images["off.org/1.jpg"] = png_bytes("blue")
+        process_images(fetcher=self.fetch)
+        digest = Product.objects.get(barcode=1).image_hash
+
+        write_products([off_product("1", "Jus de pomme", "jus")])
+        self.assertEqual(Product.objects.get(barcode=1).image_hash, digest)
+
+        changed = off_product("1", "Jus de pomme", "jus")
+        changed["image_url"] = "off.org/other.jpg"
+        write_products([changed])
+        self.assertEqual(Product.objects.get(barcode=1).image_hash, "")
+
+    def test_thumbnail_served(self):
+        #tests that thumbnails are served with a cache lifetime of a year
+
+        process_images(fetcher=self.fetch)
+        red = Product.objects.get(name="red")
+
+        response = self.client.get("/substituter/detail/{}/".format(red.pk))
+        url = "/substituter/images/{}-large.webp".format(red.image_hash)
+        self.assertContains(response, url)
+
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], "image/webp")
+        self.assertIn("max-age=31536000", response['Cache-Control'])
+        self.assertIn("immutable", response['Cache-Control'])
+        response.close()
+
+        for url in ["/substituter/images/{}-huge.jpg".format(red.image_hash),
+                    "/substituter/images/{}-small.jpg".format("0" * 64)]:
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+        missing = Product.objects.get(name="missing")
+        response = self.client.get("/substituter/detail/{}/".format(missing.pk))
+        self.assertContains(response, 'src="off.org/missing.jpg"')
+
+    def test_thumbnail_missing_from_store(self):
+        #tests that the original image is linked when the thumbnails were
+        #stored on another machine
+
+        Product.objects.filter(name="red").update(image_hash="0" * 64)
+        red = Product.objects.get(name="red")
+
+        response = self.client.get("/substituter/detail/{}/".format(red.pk))
+        self.assertContains(response, 'src="off.org/red.jpg"')
+        self.assertNotContains(response, "/substituter/images/")
+        self.assertNotContains(response, "image/webp")
+
+
+# Benchmarks
+
+class TestBenchmark(TestCase):
+    #This class tests the benchmark harness on a tiny catalogue
+
+    def test_synthetic_products_reproducible(self):
+        #tests that a seed always generates the same valid catalogue
+
+        products = list(synthetic_products(20, seed=3))
+
+        self.assertEqual(products, list(synthetic_products(20, seed=3)))
+        self.assertTrue(all(parse_product(product) for product in products))
+
+    def test_run_benchmarks(self):
+        #tests that every hot path is measured
+
+        get_cache().clear()
+        results = run_benchmarks(30, repeat=2)
+
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(set(results), {"update_db", "search", "search_cached",
+                                        "autocomplete", "detail",
+                                        "bookmarked"})
+        self.assertEqual(results["search"]["runs"], 2)
+        self.assertGreater(results["update_db"]["rows_per_second"], 0)
+        json.dumps(results)
+
+
 # Views
 
 class TestViewIndex(TestCase):
@@ -102,6 +1102,11 @@ class TestViewSearch(TestCase):
         u.save()
         u.bookmarks.add(producte)
 
+    def setUp(self):
+        #empties the cached results and rebuilds the indexes between tests
+        get_cache().clear()
+        bump_catalogue_version()
+
     def test_search_200(self):
         #tests that search view returnes 200 code with proper query
 
@@ -145,17 +1150,98 @@ class TestViewSearch(TestCase):
                          "best substitute"
         )
 
+    def test_search_query_count(self):
+        #tests that search view does not issue one query per matching product
+
+        get_category_index()
+        with self.assertNumQueries(3):
+            self.client.get("/substituter/search/", {'query': 'gamma+beta'})
+
+    def test_search_precomputed_substitutes(self):
+        #tests that precomputed substitutes are read in a single query
+
+        call_command('compute_substitutes', stdout=StringIO())
+        base_product = Product.objects.get(name="beta gamma")
+
+        with self.assertNumQueries(1):
+            substitute_list = get_substitutes(base_product)
+
+        self.assertEqual([product.name for product in substitute_list],
+                         ["best substitute", "substitute"]
+        )
+
+        response = self.client.get("/substituter/search/",
+                                   {'query': 'gamma+beta'}
+        )
+
+        self.assertEqual(response.context['substitute_list'], substitute_list)
+
+    def test_search_cached_results(self):
+        #tests that a query is only computed once for all users
+
+        self.client.get("/substituter/search/", {'query': 'gamma+beta'})
+
+        with self.assertNumQueries(1):
+            response = self.client.get("/substituter/search/",
+                                       {'query': 'Béta+gamma+beta'})
+
+        self.assertEqual(response.context['base_product'].name, "beta gamma")
+        self.assertEqual(len(response.context['substitute_list']), 2)
+
+        c = Client()
+        c.login(email='testmail', password='testpass')
+        response = c.get("/substituter/search/", {'query': 'gamma+beta'})
+
+        self.assertEqual([substitute.is_saved for substitute
+                          in response.context['substitute_list']],
+                         [True, False]
+        )
+
+    def test_search_cache_invalidated(self):
+        #tests that bumping the catalogue version after writing products
+        #invalidates the cached results
+
+        self.client.get("/substituter/search/", {'query': 'gamma+beta'})
+        Product.objects.create(name="gamma beta", grade='e')
+        bump_catalogue_version()
+
+        response = self.client.get("/substituter/search/",
+                                   {'query': 'gamma+beta'})
+        self.assertEqual(response.context['base_product'].name, "gamma beta")
+
+        self.client.get("/substituter/search/", {'query': 'gamma+beta'})
+        bump_catalogue_version()
+        get_category_index()
+
+        with self.assertNumQueries(2):
+            self.client.get("/substituter/search/", {'query': 'gamma+beta'})
+
     def test_search_gets_boomkarks(self):
-        #tests that search view returns request's user's bookmarks
+        #tests that search view flags the substitutes saved by request's user
 
         c = Client()     
         c.login(email='testmail', password='testpass')
 
         response = c.get("/substituter/search/", {'query': 'gamma+beta'})
 
-        self.assertEqual(response.context['bookmarked_list'][0].name,
+        self.assertEqual(response.context['substitute_list'][0].name,
                          "best substitute"
         )
+        self.assertTrue(response.context['substitute_list'][0].is_saved)
+        self.assertFalse(response.context['substitute_list'][1].is_saved)
+        self.assertContains(response, "Sauvegardé !", count=1)
+
+    def test_search_bookmarks_cached(self):
+        #tests that the bookmarks of a user are read once, whatever their number
+
+        c = Client()
+        c.login(email='testmail', password='testpass')
+        User.objects.get().bookmarks.add(*Product.objects.all())
+        c.get("/substituter/search/", {'query': 'gamma+beta'})
+
+        #the cached products, the session and the user are read, nothing else
+        with self.assertNumQueries(3):
+            c.get("/substituter/search/", {'query': 'gamma+beta'})
 
 
 class TestViewDetail(TestCase):
@@ -167,6 +1253,15 @@ class TestViewDetail(TestCase):
 
         Product.objects.create(id = 1, name = "testname")
 
+        u = User.objects.create(email="testmail")
+        u.set_password('testpass')
+        u.save()
+
+    def setUp(self):
+        #empties the cached pages and rebuilds the indexes between tests
+        get_cache().clear()
+        bump_catalogue_version()
+
     def test_detail_valid_id(self):
         #tests that detail view returns a 200 code for an existing product
 
@@ -188,6 +1283,59 @@ class TestViewDetail(TestCase):
 
         self.assertEqual(response.context['product'].name, "testname")
 
+    def test_detail_cached_for_anonymous(self):
+        #tests that the page is rendered once, then validated by the product's write time
+
+        response = self.client.get("/substituter/detail/1/")
+        etag = response['ETag']
+
+        self.assertIn("public", response['Cache-Control'])
+        self.assertIn("Last-Modified", response)
+
+        with self.assertNumQueries(1):
+            cached = self.client.get("/substituter/detail/1/")
+        self.assertEqual(cached.content, response.content)
+
+        response = self.client.get("/substituter/detail/1/",
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Product.objects.filter(pk=1).update(name="newname",
+                                            updated_at=timezone.now())
+        response = self.client.get("/substituter/detail/1/",
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"newname", response.content)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_private_for_users(self):
+        #tests that connected users always get their own page
+
+        self.client.get("/substituter/detail/1/")
+        self.client.login(email='testmail', password='testpass')
+
+        response = self.client.get("/substituter/detail/1/")
+
+        self.assertEqual(response.context['product'].name, "testname")
+        self.assertIn("private", response['Cache-Control'])
+
+    def test_product_card_cache(self):
+        #tests that the product cards are cached until the product is written
+
+        product = Product.objects.get(pk=1)
+        render_to_string('substituter/product_card.html',
+                         {"product": product, "card_cache_timeout": 60})
+
+        product.name = "newname"
+        card = render_to_string('substituter/product_card.html',
+                                {"product": product, "card_cache_timeout": 60})
+        self.assertIn("testname", card)
+
+        product.save()
+        card = render_to_string('substituter/product_card.html',
+                                {"product": product, "card_cache_timeout": 60})
+        self.assertIn("newname", card)
+
 
 class TestViewAutocomplete(TestCase):
     #This class tests the Autocomplete view
@@ -201,6 +1349,11 @@ class TestViewAutocomplete(TestCase):
         Product.objects.create(name = "foobar")
         Product.objects.create(name = "foba")
 
+    def setUp(self):
+        #forces the autocomplete index to be rebuilt between tests
+        get_cache().clear()
+        bump_catalogue_version()
+
     def test_autocomplete_json_type(self):
         #tests that detail view returns a 200 code for an existing product
 
@@ -211,6 +1364,47 @@ class TestViewAutocomplete(TestCase):
         self.assertEqual(type(response), JsonResponse)
 
 
+    def test_autocomplete_cache_headers(self):
+        #tests that autocomplete responses may be reused by browsers
+
+        response = self.client.get("/substituter/autocomplete/",
+                                   {'term': 'foo'})
+
+        self.assertIn("public", response["Cache-Control"])
+        self.assertIn("max-age=300", response["Cache-Control"])
+
+    def test_autocomplete_refreshed(self):
+        #tests that the index is rebuilt when the catalogue changes
+
+        response = self.client.get("/substituter/autocomplete/",
+                                   {'term': 'foob'})
+        Product.objects.create(name="foobaz")
+        bump_catalogue_version()
+
+        response = self.client.get("/substituter/autocomplete/",
+                                   {'term': 'foob'})
+        self.assertEqual(json.loads(response.content), ['foobar', 'foobaz'])
+
+    def test_autocomplete_refreshed_by_other_process(self):
+        #tests that the index is rebuilt when the catalogue is changed by
+        #another process, which has a cache of its own
+
+        self.client.get("/substituter/autocomplete/", {'term': 'foob'})
+        Product.objects.create(name="foobaz")
+        with mock.patch('substituter.cache.get_cache',
+                        return_value=LocMemCache('update_db', {})):
+            bump_catalogue_version()
+
+        response = self.client.get("/substituter/autocomplete/",
+                                   {'term': 'foob'})
+        self.assertEqual(json.loads(response.content), ['foobar'])
+
+        #the version read from the database expires from this process' cache
+        get_cache().delete(VERSION_KEY)
+        response = self.client.get("/substituter/autocomplete/",
+                                   {'term': 'foob'})
+        self.assertEqual(json.loads(response.content), ['foobar', 'foobaz'])
+
     def test_autocomplete_suggestions(self):
         #tests that detail view returns a 200 code for an existing product
 
@@ -245,6 +1439,396 @@ class TestViewAutocomplete(TestCase):
         self.assertEqual(json.loads(response.content), [])
 
 
+class TestViewApi(TestCase):
+    #This class tests the json api of the research feature
+
+    @classmethod
+    def setUpTestData(cls):
+        #sets up products matching the same query, and substitutes of one of them
+
+        category = Category.objects.create(name="cata")
+        cls.base = Product.objects.create(name="beta gamma", grade="e")
+        cls.base.categories.add(category)
+        for number in range(6):
+            Product.objects.create(name="beta {}".format(number), grade="d")
+            substitute = Product.objects.create(name="sub {}".format(number),
+                                                grade="a")
+            substitute.categories.add(category)
+
+    def setUp(self):
+        #empties the cache and rebuilds the indexes, since they outlive the
+        #test transactions
+        get_cache().clear()
+        bump_catalogue_version()
+
+    def _pages(self, url, params):
+        #Follows the cursors of an api endpoint, returning the list of pages
+        pages = []
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.json()["results"])
+            if not response.json()["next"]:
+                return pages
+            params = dict(params, cursor=response.json()["next"])
+
+    def test_search_pages(self):
+        #tests that cursors walk through the whole ranking, page after page
+
+        pages = self._pages("/substituter/api/search/",
+                            {"query": "gamma+beta", "limit": 3})
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([result["id"] for page in pages for result in page],
+                         [product.pk for product
+                          in search_products(["gamma", "beta"])])
+        self.assertEqual(pages[0][0]["substitutes"],
+                         "/substituter/api/products/{}/substitutes/"
+                         .format(self.base.pk))
+
+    def test_substitutes_pages(self):
+        #tests that live and precomputed substitutes are paged alike
+
+        url = "/substituter/api/products/{}/substitutes/".format(self.base.pk)
+        live = self._pages(url, {"limit": 4, "fields": "id"})
+        call_command('compute_substitutes', stdout=StringIO())
+        get_cache().clear()
+        precomputed = self._pages(url, {"limit": 4, "fields": "id"})
+
+        self.assertEqual([len(page) for page in live], [4, 2])
+        self.assertEqual(live, precomputed)
+        self.assertEqual([result["rank"] for page in live for result in page],
+                         list(range(6)))
+
+    def test_substitutes_pages_beyond_precomputed(self):
+        #tests that pages go on live once the precomputed rows are read
+
+        url = "/substituter/api/products/{}/substitutes/".format(self.base.pk)
+        live = self._pages(url, {"limit": 2, "fields": "id"})
+        call_command('compute_substitutes', '--limit', '3', stdout=StringIO())
+        get_cache().clear()
+        self.assertEqual(ProductSubstitute.objects.count(), 3)
+        for limit in [2, 3, 4]:
+            pages = self._pages(url, {"limit": limit, "fields": "id"})
+            self.assertEqual([result for page in pages for result in page],
+                             [result for page in live for result in page])
+
+    def test_substitutes_pages_complete(self):
+        #tests that no live ranking is made when every candidate is stored
+
+        url = "/substituter/api/products/{}/substitutes/".format(self.base.pk)
+        call_command('compute_substitutes', '--limit', '6', stdout=StringIO())
+        self.assertTrue(Product.objects.get(pk=self.base.pk)
+                                       .substitutes_complete)
+
+        with mock.patch("substituter.substitutes._live_ranking") as ranking:
+            pages = self._pages(url, {"limit": 4, "fields": "id"})
+        ranking.assert_not_called()
+        self.assertEqual([len(page) for page in pages], [4, 2])
+
+    def test_fields(self):
+        #tests that only the requested fields are returned
+
+        response = self.client.get("/substituter/api/search/",
+                                   {"query": "gamma", "fields": "name,grade"})
+        self.assertEqual(response.json()["results"],
+                         [{"name": "beta gamma", "grade": "e", "score": 1,
+                           "substitutes": "/substituter/api/products/{}"
+                                          "/substitutes/".format(self.base.pk)}])
+
+        response = self.client.get("/substituter/api/search/",
+                                   {"query": "gamma", "fields": "name,owner"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_bad_requests(self):
+        #tests that invalid parameters are answered with a 400 error
+
+        for params in [{}, {"query": "beta", "limit": 0},
+                       {"query": "beta", "cursor": "nope"},
+                       {"query": "beta", "cursor": encode_cursor(["a", 1])}]:
+            response = self.client.get("/substituter/api/search/", params)
+            self.assertEqual(response.status_code, 400)
+
+    def test_conditional_get(self):
+        #tests that unchanged results are answered with a 304 without any query
+
+        url = "/substituter/api/search/?query=beta"
+        etag = self.client.get(url)["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        bump_catalogue_version()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_shared_by_workers(self):
+        #tests that workers with caches of their own answer the same ETag,
+        #until another process changes the catalogue
+
+        url = "/substituter/api/search/?query=beta"
+        etag = self.client.get(url)["ETag"]
+
+        other_cache = LocMemCache('other-worker', {})
+        other_cache.clear()
+        with mock.patch('substituter.cache.get_cache', return_value=other_cache):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with mock.patch('substituter.cache.get_cache',
+                        return_value=LocMemCache('update_db', {})):
+            bump_catalogue_version()
+        get_cache().delete(VERSION_KEY)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class TestViewBatch(TestCase):
+    #This class tests the batch api resolving whole shopping lists
+
+    @classmethod
+    def setUpTestData(cls):
+        #sets up products with barcodes, sharing a category with their substitutes
+
+        category = Category.objects.create(name="cata")
+        for number, name in enumerate(["pate a tartiner", "jus d orange",
+                                       "biscuit", "yaourt"]):
+            product = Product.objects.create(name=name, grade="e",
+                                             barcode=100 + number)
+            product.categories.add(category)
+        for number in range(8):
+            substitute = Product.objects.create(name="sub {}".format(number),
+                                                grade="abcd"[number % 4],
+                                                salt=number)
+            substitute.categories.add(category)
+
+    def setUp(self):
+        #empties the cache and rebuilds the indexes, since they outlive the
+        #test transactions
+        get_cache().clear()
+        bump_catalogue_version()
+
+    def _post(self, body):
+        #Posts a body to the batch api, as json
+        return self.client.post("/substituter/api/batch/", json.dumps(body),
+                                content_type="application/json")
+
+    def test_batch_matches_search(self):
+        #tests that every item is resolved as by the search and barcode lookups
+
+        items = ["tartiner", "101", "biscuit", "epsilon", "999", "yaourt"]
+        results = self._post({"items": items, "fields": ["id"]}).json()
+
+        self.assertEqual([result["item"] for result in results["results"]],
+                         items)
+        get_cache().clear()
+        for item, result in zip(items, results["results"]):
+            if item.isdigit():
+                base = Product.objects.filter(barcode=item).first()
+                substitute_list = get_substitutes(base) if base else []
+            else:
+                base, substitute_list = search_results([item])
+            self.assertEqual(result["product"], base and {"id": base.pk})
+            self.assertEqual(result["substitutes"],
+                             [{"id": substitute.pk}
+                              for substitute in substitute_list])
+
+    def test_batch_shares_queries(self):
+        #tests that only the ranking of the names takes one query per item
+
+        #barcodes and names each share their categories, nutriments and rows
+        get_category_index()
+        with self.assertNumQueries(7 + 4):
+            self._post({"items": ["tartiner", "jus", "biscuit", "yaourt",
+                                  "100", "101"]})
+
+        #cached lists only load their products
+        with self.assertNumQueries(1):
+            self._post({"items": ["tartiner", "jus", "biscuit", "yaourt"]})
+
+    @override_settings(BATCH_MAX_ITEMS=2)
+    def test_bad_batches(self):
+        #tests that invalid shopping lists are answered with a 400 error
+
+        for body in [{"items": ["a", "b", "c"]}, {"items": []},
+                     {"items": ["a", 1]}, ["a"],
+                     {"items": ["a"], "fields": ["owner"]}]:
+            self.assertEqual(self._post(body).status_code, 400)
+        self.assertEqual(self.client.get("/substituter/api/batch/").status_code,
+                         405)
+
+    @override_settings(BATCH_MAX_CONCURRENCY=1, BATCH_WAIT=0)
+    def test_concurrency_limit(self):
+        #tests that batches over the concurrency limit are turned down
+
+        slots = _batch_slots()
+        slots.acquire()
+        try:
+            response = self._post({"items": ["biscuit"]})
+        finally:
+            slots.release()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self._post({"items": ["biscuit"]}).status_code, 200)
+
+
+class TestViewBarcode(TestCase):
+    #This class tests the barcode lookups, from the search and scanning views
+
+    @classmethod
+    def setUpTestData(cls):
+        #sets up products with barcodes, one of them named with digits
+
+        cata = Category.objects.create(name="cata")
+        nutella = Product.objects.create(name="nutella", grade="e",
+                                         barcode=3017620422003)
+        beer = Product.objects.create(name="1664", grade="c", barcode=1)
+        for number, grade in enumerate("abd"):
+            substitute = Product.objects.create(name="sub {}".format(grade),
+                                                grade=grade,
+                                                barcode=100 + number)
+            substitute.categories.add(cata)
+        nutella.categories.add(cata)
+        beer.categories.add(cata)
+
+    def setUp(self):
+        #empties the cached results and rebuilds the indexes between tests
+        get_cache().clear()
+        bump_catalogue_version()
+
+    def test_search_by_barcode(self):
+        #tests that a query made of digits is looked up as a barcode
+
+        response = self.client.get("/substituter/search/",
+                                   {'query': '3017620422003'})
+
+        self.assertEqual(response.context['base_product'].name, "nutella")
+        self.assertEqual([product.name
+                          for product in response.context['substitute_list']],
+                         ["sub a", "sub b", "1664", "sub d"])
+
+    def test_search_digits_fall_back(self):
+        #tests that digits holding no barcode are searched by name
+
+        response = self.client.get("/substituter/search/", {'query': '1664'})
+
+        self.assertEqual(response.context['base_product'].name, "1664")
+
+    def test_barcode_view(self):
+        #tests that the barcode view shows the substitutes of the product
+
+        response = self.client.get("/substituter/barcode/3017620422003/")
+        self.assertEqual(response.context['base_product'].name, "nutella")
+
+        for barcode in ["999", "1" * 19]:
+            response = self.client.get("/substituter/barcode/{}/"
+                                       .format(barcode))
+            self.assertEqual(response.context['status'], "error")
+
+    def test_barcode_query_count(self):
+        #tests that precomputed substitutes are reached in two queries, then cached
+
+        call_command('compute_substitutes', stdout=StringIO())
+
+        with self.assertNumQueries(2):
+            self.client.get("/substituter/barcode/3017620422003/")
+
+        with self.assertNumQueries(1):
+            response = self.client.get("/substituter/barcode/3017620422003/")
+        self.assertEqual(len(response.context['substitute_list']), 4)
+
+    def test_scanning_session(self):
+        #tests that the barcodes of a session are all looked up together
+
+        get_category_index()
+        with self.assertNumQueries(4):
+            response = self.client.get("/substituter/api/barcodes/",
+                                       {'codes': '3017620422003,999,1',
+                                        'fields': 'name'})
+
+        self.assertEqual(response.json()["results"], [
+            {"item": "3017620422003", "product": {"name": "nutella"},
+             "substitutes": [{"name": "sub a"}, {"name": "sub b"},
+                             {"name": "1664"}, {"name": "sub d"}]},
+            {"item": "999", "product": None, "substitutes": []},
+            {"item": "1", "product": {"name": "1664"},
+             "substitutes": [{"name": "sub a"}, {"name": "sub b"}]},
+        ])
+
+        for codes in ["", "1,nutella", ",".join(["1"] * 101)]:
+            response = self.client.get("/substituter/api/barcodes/",
+                                       {'codes': codes})
+            self.assertEqual(response.status_code, 400)
+
+
+class TestAutocompleteIndex(SimpleTestCase):
+    #This class tests the in-memory index answering autocomplete requests
+
+    def setUp(self):
+        #sets up an index of names with various popularities
+
+        self.index = AutocompleteIndex([("Pain complet", 0),
+                                        ("Pâte à tartiner", 2),
+                                        ("Tarte aux pommes", 0),
+                                        ("Compote de pommes", 5)])
+
+    def test_lookup_ranked_by_popularity(self):
+        #tests that prefix and infix lookups return the most popular first
+
+        self.assertEqual(self.index.lookup("pomm"),
+                         ["Compote de pommes", "Tarte aux pommes"])
+        self.assertEqual(self.index.lookup("TART"),
+                         ["Pâte à tartiner", "Tarte aux pommes"])
+        self.assertEqual(self.index.lookup("omp"),
+                         ["Compote de pommes", "Pain complet"])
+
+    def test_lookup_every_token(self):
+        #tests that names must contain every token of the term
+
+        self.assertEqual(self.index.lookup("pom tar"), ["Tarte aux pommes"])
+        self.assertEqual(self.index.lookup("pate"), ["Pâte à tartiner"])
+        self.assertEqual(self.index.lookup("pommes", limit=1),
+                         ["Compote de pommes"])
+        self.assertEqual(self.index.lookup(""), [])
+        self.assertEqual(self.index.lookup(None), [])
+
+
+class TestReloadedIndex(SimpleTestCase):
+    #This class tests the rebuilds of the in-memory indexes
+
+    def test_rebuilt_in_background(self):
+        #tests that the previous index is served while the new one is built
+
+        release = threading.Event()
+        builds = []
+
+        def load():
+            if builds:
+                release.wait(5)
+            builds.append(len(builds))
+            return builds[-1]
+
+        index = ReloadedIndex(load)
+        self.assertEqual(index.get("v1"), 0)
+        self.assertEqual(index.get("v2"), 0)
+        self.assertEqual(index.get("v2"), 0)
+
+        release.set()
+        index.thread.join(5)
+        self.assertEqual(index.get("v2"), 1)
+        self.assertEqual(builds, [0, 1])
+
+    def test_wait(self):
+        #tests that the index is rebuilt before returning when asked to wait
+
+        index = ReloadedIndex(mock.Mock(side_effect=["old", "new"]))
+        index.get("v1")
+
+        self.assertEqual(index.get("v2", wait=True), "new")
+        self.assertIsNone(index.thread)
+
+
 class TestViewLegal(TestCase):
     #This class tests the Legal view
 
@@ -253,4 +1837,15 @@ class TestViewLegal(TestCase):
 
         response = self.client.get("/substituter/legal/")
 
-        self.assertEqual(response.status_code, 200)
\ No newline at end of file
+        self.assertEqual(response.status_code, 200)
+
+    def test_legal_conditional_get(self):
+        #tests that anonymous visitors revalidate the page with its ETag
+
+        get_cache().clear()
+        response = self.client.get("/substituter/legal/")
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/substituter/legal/",
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
@@ -1,16 +1,26 @@
 '''
 This file contains the urls of the substituter, which is the core app of this
-project. It covers product research and details, and the legal mentions page.
+project. It covers product research, barcode lookups and details, the legal
+mentions page, the product thumbnails, and the json api of the research
+feature.
 '''
 
 from django.conf.urls import url
-from django.urls import path
+from django.urls import path, re_path
 
-from substituter import views
+from substituter import api, views
 
 urlpatterns = [
     path(r'search/', views.search, name="search"),
     path(r'detail/<int:product_id>/', views.detail, name="detail"),
+    path(r'barcode/<int:barcode>/', views.barcode, name="barcode"),
     path(r'autocomplete/', views._autocomplete, name="autocomplete"),
-    path(r'legal/', views.legal, name="legal")
+    path(r'legal/', views.legal, name="legal"),
+    re_path(r'^images/(?P<digest>[0-9a-f]{64})-(?P<size>[a-z]+)\.(?P<extension>[a-z]+)$',
+            views.image, name="image"),
+    path(r'api/search/', api.search, name="api_search"),
+    path(r'api/products/<int:product_id>/substitutes/', api.substitutes,
+         name="api_substitutes"),
+    path(r'api/batch/', api.batch, name="api_batch"),
+    path(r'api/barcodes/', api.barcodes, name="api_barcodes"),
     ]
\ No newline at end of file
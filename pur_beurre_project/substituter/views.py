@@ -1,115 +1,121 @@
 '''
 The views of the substituter app handles core features (such as index page)
 as well as the research feature, and the detailed page of a given
-food product.
+food product. The pages showing no results are cached for the anonymous
+visitors.
 '''
 
+import time
+
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.sessions.models import Session
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, JsonResponse
+from django.utils.cache import patch_cache_control
 
-from sentry_sdk import capture_message
+from bookmarks.cache import bookmark_ids
 
+from .analytics import record_search
+from .autocomplete import get_index
+from .cache import barcode_results, parse_barcode, search_results
+from .images import FORMATS, MAX_AGE, thumbnail_path
 from .models import Product, Category
+from .pages import anonymous_page
 
+@anonymous_page()
 def index(request):
     #Displays home page
     return render(request, 'substituter/index.html')
 
 
+def _results(request, base_product, substitute_list):
+    '''
+    Renders the results page of a base product and its substitutes, each
+    substitute telling whether the connected user already saved it.
+    '''
+
+    if base_product is None:
+        context = {"status" : "error"}
+        return render(request, 'substituter/search.html', context)
+
+    saved_ids = frozenset()
+    status = "ok"
+    if request.user.is_authenticated:
+        saved_ids = bookmark_ids(request.user)
+        status = "ok connect"
+
+    for substitute in substitute_list:
+        substitute.is_saved = substitute.pk in saved_ids
+
+    context = {
+    "status" : status,
+    "base_product": base_product,
+    "substitute_list": substitute_list,
+    }
+
+    return render(request, 'substituter/search.html', context)
+
+
 def search(request):
     '''
     Searchs the database for the product with the most words in its title that
     match user's research. Then selects six other products with the most
     categories matching that of the base product, excluding those with worse
     food grades, and returns those six products as suggested substitutes.
+    The substitutes are read from the precomputed table when available, and
+    the results of a query are cached for every user, the user's bookmarks
+    being added afterwards. Queries made of digits only are looked up as
+    barcodes first, falling back to the research by name. Every search is
+    recorded by the analytics.
     '''
 
-    def _get_matching_product(input, criterion):
-        '''
-        This function reads each separate word in an input, and for each one 
-        of them, creates a list of products with a given criterion matching
-        said words. A given product can appear more than once.
-        The function then returns a list of all the products found, sorted
-        from most correlated to least correlated.
-        '''
-
-        results = []
-
-        for word in input:
-            if criterion == "name":
-                matching_products = Product.objects.filter(name__icontains=word)
-            elif criterion == "category":
-                matching_products = Product.objects.filter(categories__name__icontains=word)
-            for product in matching_products:
-                results.append(product.pk)
-
-        counted_results = []
-        results.sort(reverse=True)
-        x = 0
-        while x < len (results):
-            key = results[x]
-            counted_results.append((key, results.count(key)))
-            x += results.count(key)
-
-        results_list = []
-
-        for key in sorted(counted_results, 
-                          key=lambda tuple: tuple[1], 
-                          reverse = True):
-            results_list.append(Product.objects.get(pk=key[0]))
-
-        return results_list
-        
-    user_input = request.GET.get("query").split("+")
-
-    try:
-        base_product = _get_matching_product(user_input, "name")[0]
-
-    except IndexError:
-        context = {"status" : "error"}
-        return render(request, 'substituter/search.html', context)
+    query = request.GET.get("query")
+    start = time.perf_counter()
 
-    category_list = [category.name 
-                    for category 
-                    in base_product.categories.all()]
+    base_product = None
+    scanned = parse_barcode(query)
+    if scanned is not None:
+        base_product, substitute_list = barcode_results([scanned])[scanned]
 
-    substitute_candidates = _get_matching_product(category_list, "category") 
+    if base_product is None:
+        base_product, substitute_list = search_results(query.split("+"))
 
-    substitute_list = []
+    record_search(query, base_product,
+                  (time.perf_counter() - start) * 1000)
 
-    for substitute in substitute_candidates:
-        if substitute.grade < base_product.grade:
-            substitute_list.append(substitute)
+    return _results(request, base_product, substitute_list)
 
-    if request.user.is_authenticated:
-        context = {
-        "status" : "ok connect",
-        "base_product": base_product,
-        "substitute_list": substitute_list[:6],
-        "bookmarked_list": request.user.bookmarks.all()
-        }
-
-    else:
-        context = {
-        "status" : "ok",
-        "base_product": base_product,
-        "substitute_list": substitute_list[:6],
-        "bookmarked_list": []
-        }
-
-    capture_message('New search : ' + request.GET.get("query"))
 
-    return render(request, 'substituter/search.html', context)
+def barcode(request, barcode):
+    #Displays the substitutes of the product holding a scanned barcode
+    if parse_barcode(str(barcode)) is None:
+        return _results(request, None, [])
+    base_product, substitute_list = barcode_results([barcode])[barcode]
+    return _results(request, base_product, substitute_list)
 
 
 def _autocomplete(request):
+    '''
+    Returns the names of the most popular products matching the term typed by
+    the user, as json. Browsers and proxies may reuse the response for
+    AUTOCOMPLETE_MAX_AGE seconds.
+    '''
     string = request.GET.get('term')
-    matching_products = Product.objects.filter(name__icontains=string)[:20]
-    response = [product.name for product in matching_products]
-    return JsonResponse(response, safe=False)
+    response = JsonResponse(get_index().lookup(string), safe=False)
+    patch_cache_control(response,
+                        public=True,
+                        max_age=settings.AUTOCOMPLETE_MAX_AGE)
+    return response
+
+
+def product_updated_at(request, product_id):
+    #Returns the last time a product was written, or None if it does not exist
+    return (Product.objects.filter(pk=product_id)
+                           .values_list('updated_at', flat=True)
+                           .first())
 
 
+@anonymous_page(product_updated_at)
 def detail(request, product_id):
     #Displays detailed information about a given product using its pk
     product = get_object_or_404(Product, pk=product_id)
@@ -119,6 +125,20 @@ def detail(request, product_id):
     return render(request, 'substituter/detail.html', context)
 
 
+@anonymous_page()
 def legal(request):
     #Displays the legal mentions page
     return render(request, 'substituter/legal.html')
+
+
+def image(request, digest, size, extension):
+    #Serves a product thumbnail, which never changes, for browsers to keep a year
+    path = thumbnail_path(digest, size, extension)
+    if path is None:
+        raise Http404("No such thumbnail")
+
+    response = FileResponse(open(path, 'rb'),
+                            content_type=FORMATS[extension][1])
+    patch_cache_control(response, public=True, max_age=MAX_AGE,
+                        immutable=True)
+    return response
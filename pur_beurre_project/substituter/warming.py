@@ -0,0 +1,133 @@
+'''
+This module warms the cache of the research feature.
+The most frequent queries of the last days, read from the rollups of the
+search logs, or from a seed file while no search was logged, are searched
+in advance by a pool of threads, so that their base product and
+substitutes are cached before users ask for them. This is only done with
+a cache backend shared by the web workers (see CACHE_BACKEND): the
+local-memory one would be filled for the warming process alone. The
+in-memory indexes of a web worker are built by warm_indexes, when the
+worker starts.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+
+from .analytics import count_searches, rollup_searches, top_queries
+from .autocomplete import get_index
+from .cache import barcode_results, get_cache, parse_barcode, search_results
+from .categories import get_category_index
+
+
+SEED_PATH = os.path.join(os.path.dirname(__file__), 'seed_queries.txt')
+
+
+class CacheNotShared(Exception):
+    #Raised when warming a cache that the web workers would not read
+    pass
+
+
+def seed_queries(path=SEED_PATH):
+    #Returns the queries of a seed file, one per line, skipping blank lines and comments
+    with open(path, encoding='utf-8') as seed:
+        return [line.strip() for line in seed
+                if line.strip() and not line.startswith('#')]
+
+
+def popular_queries(since, limit, seed_path=SEED_PATH):
+    '''
+    Returns the list of the (query, count) pairs of the limit most frequent
+    queries searched since a datetime, once the complete hours are rolled
+    up, or the queries of the seed file with a count of 0 if no search was
+    logged.
+    '''
+
+    rollup_searches()
+    queries = top_queries(since, limit)
+    if queries:
+        return queries
+    return [(query, 0) for query in seed_queries(seed_path)[:limit]]
+
+
+def warm_query(query):
+    #Searches a query as the search view does, caching its results, and returns whether a product was found
+    scanned = parse_barcode(query)
+    if scanned is not None and barcode_results([scanned])[scanned][0]:
+        return True
+    base_product, substitute_list = search_results(query.split('+'))
+    return base_product is not None
+
+
+def _warm_share(queries):
+    #Warms a share of the queries, then closes the connection of the thread
+    try:
+        return [warm_query(query) for query in queries]
+    finally:
+        connection.close()
+
+
+def warm_queries(queries, concurrency=4):
+    '''
+    Warms queries with concurrency threads, each one searching its share of
+    the queries with its own database connection. Returns the list of the
+    queries whose search found a product.
+    '''
+
+    shares = [queries[start::concurrency] for start in range(concurrency)]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(_warm_share, shares))
+
+    return [query
+            for share, found in zip(shares, results)
+            for query, hit in zip(share, found) if hit]
+
+
+def warm_indexes():
+    #Builds the category and autocomplete indexes of the current web worker
+    get_category_index(wait=True)
+    get_index(wait=True)
+
+
+def warm_caches(since, limit=500, concurrency=4, seed_path=SEED_PATH):
+    '''
+    Warms the results of the popular queries since a datetime, raising
+    CacheNotShared if the search cache is local to the current process.
+    Returns a dictionary reporting the number of warmed queries, of those
+    finding a product, the share of the logged searches they cover, and the
+    seconds spent.
+    '''
+
+    if isinstance(get_cache(), LocMemCache):
+        raise CacheNotShared("the search cache is local to this process: "
+                             "set CACHE_BACKEND to a cache shared with the "
+                             "web workers")
+
+    start = time.perf_counter()
+
+    queries = popular_queries(since, limit, seed_path)
+    counts = dict(queries)
+    found = warm_queries([query for query, count in queries], concurrency)
+
+    total = count_searches(since)
+    return {
+        "queries": len(queries),
+        "found": len(found),
+        "coverage": (sum(counts[query] for query in found) / total
+                     if total else None),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def report_lines(report):
+    #Yields the lines describing a warm-up report
+    yield "{} of {} queries cached with a product".format(report["found"],
+                                                           report["queries"])
+    if report["coverage"] is None:
+        yield "coverage: no search logged, seed queries used"
+    else:
+        yield "coverage: {:.1%} of the logged searches".format(report["coverage"])
+    yield "warm-up: {:.2f}s".format(report["seconds"])